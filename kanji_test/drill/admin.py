@@ -50,3 +50,8 @@ class TestSetAdmin(admin.ModelAdmin):
 
 admin.site.register(models.TestSet, TestSetAdmin)
 
+class PendingUpdateAdmin(admin.ModelAdmin):
+    list_display = ('response', 'user', 'queued_time', 'applied_time')
+    list_filter = ('applied_time',)
+
+admin.site.register(models.PendingUpdate, PendingUpdateAdmin)
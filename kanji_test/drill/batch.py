@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+#  batch.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-05.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+"""
+Batched data access for question generation. A TestSetBatch gives question
+plugins everything they need about a user's syllabus items: the syllabus
+distractor pools, loaded once per process, and the user's error
+distributions, fetched up front for the whole batch. Questions can then be
+built in memory and written back with a handful of bulk inserts.
+"""
+
+import random
+
+from django.core.exceptions import ObjectDoesNotExist
+from cjktools import scripts
+
+from kanji_test.drill.writer import QuestionWriter
+from kanji_test.drill.pools import SyllabusPools
+from kanji_test.user_model import models as usermodel_models
+from kanji_test.util.alignment import Alignment
+
+class TestSetBatch(object):
+    """
+    Distractor pools and prefetched error distributions for generating
+    questions about a fixed list of syllabus items.
+    """
+    def __init__(self, user, items, syllabus=None):
+        self.user = user
+        self.syllabus = syllabus or user.get_profile().syllabus
+        self.pools = SyllabusPools.get(self.syllabus)
+        self._fetch_error_dists(items)
+
+    def covers(self, item):
+        "Does this batch have data for the given syllabus item?"
+        if isinstance(item, usermodel_models.PartialKanji):
+            return item.id in self.pools.kanji_pools
+        elif isinstance(item, usermodel_models.PartialLexeme):
+            return item.id in self.pools.word_pools
+        raise ValueError('bad syllabus item %s' % item)
+
+    #------------------------------------------------------------------------#
+    # Accessors for question plugins
+    #------------------------------------------------------------------------#
+
+    def error_dist(self, tag):
+        "Returns the user's error distribution with the given tag."
+        return self._error_dists[tag]
+
+    def has_kanji(self, item):
+        "Does this item have a kanji surface?"
+        if isinstance(item, usermodel_models.PartialKanji):
+            return True
+        return bool(self.surfaces(item, kanji_only=True))
+
+    def surfaces(self, partial_lexeme, kanji_only=False):
+        "Returns the syllabus surfaces of the given word."
+        return [surface for (surface, has_kanji) in \
+                self.pools.word_pools[partial_lexeme.id]['surfaces'] \
+                if has_kanji or not kanji_only]
+
+    def random_surface(self, partial_lexeme, kanji_only=False):
+        "Picks a random syllabus surface for the given word."
+        surfaces = self.surfaces(partial_lexeme, kanji_only=kanji_only)
+        if not surfaces:
+            raise ObjectDoesNotExist
+        return random.choice(surfaces)
+
+    def random_reading(self, item):
+        "Picks a random syllabus reading for the given kanji or word."
+        return random.choice(self._get_pool(item)['readings'])
+
+    def kanji_gloss(self, partial_kanji):
+        "Returns the gloss of the given kanji."
+        return self.pools.kanji_pools[partial_kanji.id]['gloss']
+
+    def kanji_readings(self, partial_kanji):
+        "Returns every known reading of the given kanji."
+        return self.pools.kanji_pools[partial_kanji.id]['all_readings']
+
+    def homograph_readings(self, surface):
+        "Returns the readings of every word which shares this surface."
+        return self.pools.homographs.get(surface, [])
+
+    def glosses(self, partial_lexeme):
+        "Returns the glosses of every sense of the given word."
+        return set(self.pools.word_pools[partial_lexeme.id]['glosses'])
+
+    def first_gloss(self, partial_lexeme):
+        "Returns the gloss of the first (dominant) sense of the given word."
+        gloss = self.pools.word_pools[partial_lexeme.id]['first_gloss']
+        if gloss is None:
+            raise ObjectDoesNotExist
+        return gloss
+
+    def random_alignment(self, partial_lexeme):
+        """
+        Picks a random GP-alignment of one of the word's readings, returning
+        its reading, its surface and the alignment itself.
+        """
+        reading, surface, alignment = random.choice(
+                self.pools.word_pools[partial_lexeme.id]['alignments'])
+        return reading, surface, Alignment.from_short_form(alignment)
+
+    #------------------------------------------------------------------------#
+    # Storing questions
+    #------------------------------------------------------------------------#
+
+    def store(self, test_set, questions):
+        """
+        Writes the unsaved questions built from this batch, their pending
+        options and their membership of the test set.
+        """
+        writer = QuestionWriter()
+        for question in questions:
+            writer.add(question)
+        writer.flush(test_set)
+        return
+
+    #------------------------------------------------------------------------#
+    # Prefetching
+    #------------------------------------------------------------------------#
+
+    def _fetch_error_dists(self, items):
+        self._error_dists = dict((d.tag, d) for d in \
+                usermodel_models.ErrorDist.objects.filter(user=self.user))
+        for prior_dist in usermodel_models.PriorDist.objects.filter(
+                syllabus=self.syllabus):
+            error_dist = self._error_dists.get(prior_dist.tag)
+            if error_dist is not None:
+                error_dist._prior_dist = prior_dist
+
+        # Load the densities for every kanji we might ask about.
+        conditions = set()
+        for item in items:
+            if isinstance(item, usermodel_models.PartialKanji):
+                conditions.add(item.kanji_id)
+            else:
+                for surface in self.surfaces(item, kanji_only=True):
+                    conditions.update(scripts.unique_kanji(surface))
+        usermodel_models.ErrorDist.prefetch_dists(
+                self._error_dists.values(), conditions)
+
+    def _get_pool(self, item):
+        if isinstance(item, usermodel_models.PartialKanji):
+            return self.pools.kanji_pools[item.id]
+        elif isinstance(item, usermodel_models.PartialLexeme):
+            return self.pools.word_pools[item.id]
+        raise ValueError('bad syllabus item %s' % item)
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# 
+#  __init__.py
+#  kanji_test
+#  
+#  Created by Lars Yencken on 2012-03-07.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+# 
+
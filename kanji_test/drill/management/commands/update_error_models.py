@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# 
+#  update_error_models.py
+#  kanji_test
+#  
+#  Created by Lars Yencken on 2012-03-07.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+# 
+
+"""
+A command to apply queued error model updates.
+"""
+
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.conf import settings
+
+from kanji_test.drill import models
+
+class Command(NoArgsCommand):
+    help = "Applies queued error model updates from user responses."
+    requires_model_validation = True
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int',
+            dest='batch_size', default=settings.MODEL_UPDATE_BATCH_SIZE,
+            help='The number of updates to fetch at a time.'),
+        make_option('--poll', action='store', type='float', dest='poll',
+            default=None,
+            help='Keep running, checking for new updates every POLL '
+                'seconds.'),
+    )
+
+    def handle_noargs(self, **options):
+        batch_size = options['batch_size']
+        poll = options['poll']
+        while True:
+            while models.PendingUpdate.apply_pending(batch_size) > 0:
+                pass
+
+            if poll is None:
+                break
+            time.sleep(poll)
@@ -8,9 +8,10 @@
 # 
 
 import random
+import datetime
 import traceback
 
-from django.db import models
+from django.db import models, transaction
 from django.core.mail import send_mail
 from django.contrib.auth import models as auth_models
 from django.conf import settings
@@ -38,25 +39,67 @@ class QuestionPlugin(models.Model):
         """
         if not self.is_adaptive:
             return
+        QuestionPlugin._update_dist(self.uses_dist, [response])
+
+    @staticmethod
+    def update_all(responses):
+        """
+        Update the error models given a sequence of responses, such as those
+        for a whole test set. Responses are grouped by the distribution they
+        update, so that each touched condition is only written once. Returns
+        the responses whose updates couldn't be applied.
+        """
+        dist_responses = {}
+        dist_names = []
+        for response in responses:
+            question_plugin = response.question.question_plugin
+            if not question_plugin.is_adaptive:
+                continue
+            dist_name = question_plugin.uses_dist
+            if dist_name not in dist_responses:
+                dist_responses[dist_name] = []
+                dist_names.append(dist_name)
+            dist_responses[dist_name].append(response)
+
+        failed = []
+        for dist_name in dist_names:
+            failed.extend(QuestionPlugin._update_dist(dist_name,
+                    dist_responses[dist_name]))
+        return failed
+
+    @staticmethod
+    def _update_dist(dist_name, responses):
+        """
+        Applies the responses to the named distribution, and returns those
+        which couldn't be applied. When deployed, failures are mailed to the
+        admins; otherwise they are raised.
+        """
         plugin_map = plugin_api.load_plugins()
         try:
-            plugin_map[self.uses_dist].update(response)
+            errors = plugin_map[dist_name].update_all(responses)
         except:
-            if settings.DEPLOYED:
-                error_message = "In updating %s:\n\n%s" % (
-                        self.uses_dist,
-                        traceback.format_exc(),
-                    )
-                send_mail(
-                        'Error at kanjitester.gakusha.info',
-                        error_message,
-                        settings.DEFAULT_FROM_EMAIL,
-                        [settings.DEFAULT_FROM_EMAIL],
-                        fail_silently=not settings.DEBUG,
-                    )
-            else:
+            if not settings.DEPLOYED:
                 raise
-        return
+            QuestionPlugin._notify_admins(dist_name, traceback.format_exc())
+            return responses
+
+        if errors:
+            if not settings.DEPLOYED:
+                raise errors[0]
+            QuestionPlugin._notify_admins(dist_name,
+                    u'\n'.join(unicode(e) for e in errors))
+        return [e.response for e in errors]
+
+    @staticmethod
+    def _notify_admins(dist_name, details):
+        error_message = "In updating %s:\n\n%s" % (dist_name, details)
+        send_mail(
+                'Error at kanjitester.gakusha.info',
+                error_message,
+                settings.DEFAULT_FROM_EMAIL,
+                [settings.DEFAULT_FROM_EMAIL],
+                fail_silently=not settings.DEBUG,
+            )
 
 PIVOT_TYPES = (
         ('k', 'kanji'),
@@ -77,6 +120,23 @@ INSTRUCTIONS = {
         'pr': 'Choose the reading which matches the given %s.',
     }
 
+class ItemPool(models.Model):
+    """
+    Precomputed answers, exclude sets and gloss pools for a single syllabus
+    item, stored as JSON. See kanji_test.drill.pools.
+    """
+    syllabus = models.ForeignKey(usermodel_models.Syllabus)
+    pivot_type = models.CharField(max_length=1, choices=PIVOT_TYPES)
+    pivot_id = models.IntegerField(
+        help_text="The id of the PartialKanji or PartialLexeme.")
+    data = models.TextField()
+
+    class Meta:
+        unique_together = (('syllabus', 'pivot_type', 'pivot_id'),)
+
+    def __unicode__(self):
+        return u'%s %d' % (self.get_pivot_type_display(), self.pivot_id)
+
 class Question(models.Model):
     pivot = models.CharField(max_length=30, db_index=True,
         help_text="The word or kanji this question is created for.")
@@ -148,6 +208,12 @@ class MultipleChoiceQuestion(Question):
             return 'stimulus_cjk'
         
     def add_options(self, distractor_values, answer, annotation_map=None):
+        """
+        Adds the distractors and the correct answer as options, after
+        checking them in memory. Options for a saved question are written in
+        one round trip; those for an unsaved question are kept in
+        pending_options until a QuestionWriter stores it.
+        """
         if answer in distractor_values:
             raise ValueError('answer included in distractor set')
 
@@ -157,19 +223,26 @@ class MultipleChoiceQuestion(Question):
 
         annotation_map = annotation_map or {}
         if annotation_map and len(annotation_map) != len(distractor_values) + 1:
-            raise ValueEror('need annotation_map for every distractor')
+            raise ValueError('need annotation_map for every distractor')
 
         if len(set(distractor_values + [answer])) < len(distractor_values) + 1:
             raise ValueError('all option values must be unique')
 
-        for i, option_value in enumerate(distractor_values):
-            self.options.create(
-                    value=option_value,
-                    is_correct=False,
-                    annotation=annotation_map.get(option_value),
-                )
-        self.options.create(value=answer, is_correct=True,
-                annotation=annotation_map.get(answer))
+        options = [MultipleChoiceOption(value=option_value, is_correct=False,
+                    annotation=annotation_map.get(option_value)) \
+                for option_value in distractor_values]
+        options.append(MultipleChoiceOption(value=answer, is_correct=True,
+                annotation=annotation_map.get(answer)))
+
+        if self.pk is None:
+            # Stored in bulk along with the question itself.
+            self.pending_options = options
+            return
+
+        from kanji_test.drill.writer import QuestionWriter
+        for option in options:
+            option.question = self
+        QuestionWriter.write_options(options)
 
 class MultipleChoiceOption(models.Model):
     """A single option in a multiple choice question."""
@@ -217,10 +290,68 @@ class MultipleChoiceResponse(Response):
     def save(self, *args, **kwargs):
         """
         Save this response, and update the error model which generated it as
-        a side-effect.
+        a side-effect, unless update_model=False is given.
         """
+        update_model = kwargs.pop('update_model', True)
         super(MultipleChoiceResponse, self).save(*args, **kwargs)
-        self.question.question_plugin.update(self)
+        if update_model:
+            MultipleChoiceResponse.update_models([self])
+
+    @staticmethod
+    def update_models(responses):
+        "Updates, or queues updates to, the error models for these responses."
+        if settings.QUEUE_MODEL_UPDATES:
+            for response in responses:
+                PendingUpdate.enqueue(response)
+        else:
+            QuestionPlugin.update_all(responses)
+
+class PendingUpdate(models.Model):
+    """
+    An error model update queued by a response. Updates are applied in the
+    order they were queued, so each user's responses are replayed in order,
+    and each response is applied at most once.
+    """
+    response = models.ForeignKey(MultipleChoiceResponse, unique=True)
+    user = models.ForeignKey(auth_models.User)
+    queued_time = models.DateTimeField(auto_now_add=True)
+    applied_time = models.DateTimeField(blank=True, null=True)
+
+    def __unicode__(self):
+        return u'update for response %d' % self.response_id
+
+    @staticmethod
+    def enqueue(response):
+        "Queues the update for this response, unless it already has been."
+        PendingUpdate.objects.get_or_create(response=response,
+                defaults={'user_id': response.user_id})
+
+    @staticmethod
+    def apply_pending(batch_size=settings.MODEL_UPDATE_BATCH_SIZE):
+        """
+        Applies up to batch_size of the oldest pending updates in a single
+        transaction, and returns the number applied. Updates within the batch
+        are coalesced, so each touched condition is written once. Updates
+        which fail are left pending, to be retried once the cause is fixed.
+        Only one process should apply updates at a time, or per-user ordering
+        may be lost.
+        """
+        pending = PendingUpdate.objects.filter(applied_time=None
+                ).select_related('response__question__question_plugin',
+                        'response__option', 'response__user'
+                ).order_by('id')[:batch_size]
+        pending = list(pending)
+        if not pending:
+            return 0
+
+        with transaction.commit_on_success():
+            failed = QuestionPlugin.update_all([o.response for o in pending])
+            failed_ids = set(o.id for o in failed)
+            applied = [o for o in pending if o.response_id not in failed_ids]
+            PendingUpdate.objects.filter(id__in=[o.id for o in applied]
+                    ).update(applied_time=datetime.datetime.now())
+
+        return len(applied)
 
 class TestSet(models.Model):
     user = models.ForeignKey(auth_models.User)
@@ -278,20 +409,28 @@ class TestSet(models.Model):
     def from_user(user, n_questions=settings.QUESTIONS_PER_SET):
         """
         Generate a new test set for this user using their profile to determine
-        the appropriate syllabus.
+        the appropriate syllabus. The data needed for every question is
+        fetched up front, and the questions are stored in bulk.
         """
+        from kanji_test.drill import load_plugins
+        from kanji_test.drill.plugin_api import UnsupportedItem
+        from kanji_test.drill.batch import TestSetBatch
+
         set_type, plugin_set = TestSet._get_plugin_set(user)
         test_set = TestSet(user=user, random_seed=random.randrange(0, 2**30),
                 set_type=set_type)
         test_set.save()
 
-        from kanji_test.drill import load_plugins
-        from kanji_test.drill.plugin_api import UnsupportedItem
         question_plugins = load_plugins(plugin_set)
-        items = user.get_profile().syllabus.get_random_items(n_questions)
+        syllabus = user.get_profile().syllabus
+        items = syllabus.get_random_items(n_questions)
+        batch = TestSetBatch(user, items, syllabus=syllabus)
+        for plugin in question_plugins:
+            plugin.batch = batch
+
         questions = []
         for item in items:
-            has_kanji = item.has_kanji()
+            has_kanji = batch.has_kanji(item)
             available_plugins = [p for p in question_plugins if \
                     p.requires_kanji == has_kanji]
             question = None
@@ -305,7 +444,7 @@ class TestSet(models.Model):
                     # Oh well, try again with another plugin
                     del available_plugins[i]
 
-        test_set.questions = questions
+        batch.store(test_set, questions)
         return test_set
     
     def __len__(self):
@@ -19,7 +19,13 @@ from kanji_test.user_model import models as usermodel_models
 class UnsupportedItem(Exception): pass
 
 class QuestionFactoryI(object):
-    """An abstract interface for factories which build questions."""
+    """
+    An abstract interface for factories which build questions. When a batch
+    is set, questions are built in memory from its prefetched data and left
+    for the batch to store.
+    """
+    batch = None
+
     @classmethod
     def get_question_plugin(cls):
         if hasattr(cls, '_question_plugin'):
@@ -87,6 +93,17 @@ class QuestionFactoryI(object):
         else:
             raise ValueError('bad syllabus item %s' % syllabus_item)
 
+    def get_batch(self, syllabus_item, user):
+        """
+        Returns the batch holding data for this syllabus item, fetching a
+        single-item batch if the current one doesn't cover it.
+        """
+        from kanji_test.drill.batch import TestSetBatch
+        if self.batch is not None and self.batch.user == user and \
+                self.batch.covers(syllabus_item):
+            return self.batch
+        return TestSetBatch(user, [syllabus_item])
+
     def get_word_question(self, partial_lexeme, user):
         """Constructs and returns a new question based on the given word."""
         raise NotYetImplementedError
@@ -97,10 +114,14 @@ class QuestionFactoryI(object):
 
 class MultipleChoiceFactoryI(QuestionFactoryI):
     """An abstract factory for multiple choice questions."""
-    @classmethod
-    def build_question(cls, **kwargs):
-        kwargs.setdefault('question_type', cls.question_type)
-        kwargs.setdefault('question_plugin', cls.get_question_plugin())
+    def build_question(self, **kwargs):
+        """
+        Builds a new question of this factory's type. The question is saved
+        immediately unless a batch will store it later.
+        """
+        kwargs.setdefault('question_type', self.question_type)
+        kwargs.setdefault('question_plugin', self.get_question_plugin())
         question = models.MultipleChoiceQuestion(**kwargs)
-        question.save()
+        if self.batch is None:
+            question.save()
         return question
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+#
+#  pools.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-09.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+"""
+Precomputed distractor pools for syllabus items. For each kanji and word in
+a syllabus we store its possible answers, the readings and glosses which
+must be excluded from its distractors, and its contribution to the syllabus
+gloss pool. Pools are stored as ItemPool rows, rebuilt whenever the lexicon
+or syllabi change, and loaded by each process only when they have been
+rebuilt, so that questions can be built without touching the lexicon.
+"""
+
+import re
+import random
+
+import consoleLog
+from django.db import connection, transaction
+from django.utils import simplejson
+from simplestats.sequences import groups_of_n
+from checksum.models import Checksum
+
+from kanji_test.drill import models
+from kanji_test.lexicon import models as lexicon_models
+from kanji_test.user_model import models as usermodel_models
+from kanji_test import settings
+
+_log = consoleLog.default
+
+_dependencies = [__file__]
+_checksum_tag = 'pools'
+
+# Pools loaded by this process, keyed by syllabus id, each with the latest
+# stored row id it was loaded from. Rebuilding a syllabus's pools stores new
+# rows, so other processes notice the rebuild and reload them.
+_loaded_pools = {}
+
+class PoolsNotBuilt(Exception):
+    "Raised when a syllabus's pools are needed but haven't been built."
+    pass
+
+class SyllabusPools(object):
+    """The distractor pools for every item in a single syllabus."""
+    def __init__(self, syllabus_id, kanji_pools, word_pools):
+        self.syllabus_id = syllabus_id
+        self.kanji_pools = kanji_pools
+        self.word_pools = word_pools
+
+        self.homographs = {}
+        for word_pool in word_pools.itervalues():
+            self.homographs.update(word_pool['homographs'])
+
+        self.kanji_glosses = sorted(set(p['gloss'] for p in \
+                kanji_pools.itervalues()))
+        self.sense_glosses = [gloss for p in word_pools.itervalues() \
+                for gloss in p['glosses']]
+        self._kanji_gloss_index = None
+        self._sense_gloss_index = None
+
+    @property
+    def kanji_gloss_index(self):
+        "A GlossIndex over the glosses of every kanji in the syllabus."
+        if self._kanji_gloss_index is None:
+            self._kanji_gloss_index = GlossIndex(self.kanji_glosses)
+        return self._kanji_gloss_index
+
+    @property
+    def sense_gloss_index(self):
+        "A GlossIndex over the glosses of every word sense in the syllabus."
+        if self._sense_gloss_index is None:
+            self._sense_gloss_index = GlossIndex(self.sense_glosses)
+        return self._sense_gloss_index
+
+    @classmethod
+    def get(cls, syllabus):
+        """
+        Returns the pools for this syllabus, loading them on first use.
+        Building pools is too slow for a web request, so if they haven't
+        been built yet, PoolsNotBuilt is raised; see build_all().
+        """
+        version = cls._get_version(syllabus)
+        loaded = _loaded_pools.get(syllabus.id)
+        if loaded is not None and loaded[0] == version:
+            return loaded[1]
+
+        pools = None
+        if version is not None:
+            pools = cls.load(syllabus)
+        if pools is None:
+            raise PoolsNotBuilt('no distractor pools for syllabus %s; run '
+                    'the build command' % syllabus.tag)
+        _loaded_pools[syllabus.id] = (version, pools)
+        return pools
+
+    @classmethod
+    def load(cls, syllabus):
+        "Loads stored pools for this syllabus, or None if there are none."
+        kanji_pools = {}
+        word_pools = {}
+        for pivot_type, pivot_id, data in models.ItemPool.objects.filter(
+                syllabus=syllabus).values_list('pivot_type', 'pivot_id',
+                        'data'):
+            if pivot_type == 'k':
+                kanji_pools[pivot_id] = simplejson.loads(data)
+            else:
+                word_pools[pivot_id] = simplejson.loads(data)
+
+        if not kanji_pools and not word_pools:
+            return None
+        return cls(syllabus.id, kanji_pools, word_pools)
+
+    @classmethod
+    def build(cls, syllabus):
+        "Builds the pools for this syllabus from the lexicon."
+        return cls(syllabus.id, cls._build_kanji_pools(syllabus),
+                cls._build_word_pools(syllabus))
+
+    @transaction.commit_on_success
+    def store(self):
+        """
+        Replaces any stored pools for this syllabus with these ones, in a
+        single transaction.
+        """
+        models.ItemPool.objects.filter(syllabus=self.syllabus_id).delete()
+        rows = [(self.syllabus_id, 'k', pivot_id, simplejson.dumps(pool)) \
+                for (pivot_id, pool) in self.kanji_pools.iteritems()]
+        rows.extend((self.syllabus_id, 'w', pivot_id,
+                simplejson.dumps(pool)) for (pivot_id, pool) in \
+                self.word_pools.iteritems())
+
+        cursor = connection.cursor()
+        quote_name = connection.ops.quote_name
+        for row_set in groups_of_n(settings.N_ROWS_PER_INSERT, rows):
+            cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+                        quote_name(models.ItemPool._meta.db_table),
+                        ', '.join(map(quote_name, ['syllabus_id',
+                                'pivot_type', 'pivot_id', 'data'])),
+                        ', '.join(['%s'] * 4),
+                    ), row_set)
+        return
+
+    #------------------------------------------------------------------------#
+
+    @staticmethod
+    def _get_version(syllabus):
+        "Returns the latest stored pool row id, or None if there are none."
+        row_ids = models.ItemPool.objects.filter(syllabus=syllabus).order_by(
+                '-id').values_list('id', flat=True)[:1]
+        if not row_ids:
+            return None
+        return row_ids[0]
+
+    @staticmethod
+    def _build_kanji_pools(syllabus):
+        kanji_pools = {}
+        for partial_kanji_id, kanji, gloss in \
+                syllabus.partialkanji_set.values_list('id', 'kanji',
+                    'kanji__gloss'):
+            kanji_pools[partial_kanji_id] = {'kanji': kanji, 'gloss': gloss,
+                    'readings': [], 'all_readings': []}
+
+        all_readings = {}
+        for kanji, reading in lexicon_models.KanjiReading.objects.filter(
+                    kanji__partialkanji__syllabus=syllabus
+                ).values_list('kanji', 'reading'):
+            all_readings.setdefault(kanji, set()).add(reading)
+        for pool in kanji_pools.itervalues():
+            pool['all_readings'] = sorted(all_readings.get(pool['kanji'],
+                    []))
+
+        through = usermodel_models.PartialKanji.reading_set.through
+        for partial_kanji_id, reading in through.objects.filter(
+                    partialkanji__syllabus=syllabus
+                ).values_list('partialkanji', 'kanjireading__reading'):
+            kanji_pools[partial_kanji_id]['readings'].append(reading)
+
+        return kanji_pools
+
+    @staticmethod
+    def _build_word_pools(syllabus):
+        word_pools = {}
+        lexeme_items = {}
+        for partial_lexeme_id, lexeme_id in \
+                syllabus.partiallexeme_set.values_list('id', 'lexeme'):
+            word_pools[partial_lexeme_id] = {'lexeme': lexeme_id,
+                    'readings': [], 'surfaces': [], 'glosses': [],
+                    'first_gloss': None, 'alignments': [], 'homographs': {}}
+            lexeme_items.setdefault(lexeme_id, []).append(partial_lexeme_id)
+
+        reading_ids = {}
+        through = usermodel_models.PartialLexeme.reading_set.through
+        for partial_lexeme_id, reading_id, reading in through.objects.filter(
+                    partiallexeme__syllabus=syllabus
+                ).values_list('partiallexeme', 'lexemereading',
+                        'lexemereading__reading'):
+            word_pools[partial_lexeme_id]['readings'].append(reading)
+            reading_ids.setdefault(reading_id, []).append(partial_lexeme_id)
+
+        surface_ids = {}
+        through = usermodel_models.PartialLexeme.surface_set.through
+        for partial_lexeme_id, surface_id, surface, has_kanji in \
+                through.objects.filter(
+                    partiallexeme__syllabus=syllabus
+                ).values_list('partiallexeme', 'lexemesurface',
+                        'lexemesurface__surface', 'lexemesurface__has_kanji'):
+            word_pools[partial_lexeme_id]['surfaces'].append(
+                    (surface, has_kanji))
+            surface_ids.setdefault(surface_id, []).append(partial_lexeme_id)
+
+        for lexeme_id, gloss, is_first_sense in \
+                lexicon_models.LexemeSense.objects.filter(
+                    lexeme__partiallexeme__syllabus=syllabus
+                ).values_list('lexeme', 'gloss', 'is_first_sense'):
+            for partial_lexeme_id in lexeme_items[lexeme_id]:
+                pool = word_pools[partial_lexeme_id]
+                pool['glosses'].append(gloss)
+                if is_first_sense:
+                    pool['first_gloss'] = gloss
+
+        for reading_id, surface_id, reading, surface, alignment in \
+                syllabus.alignment_set.values_list('reading', 'surface',
+                    'reading__reading', 'surface__surface', 'alignment'):
+            for partial_lexeme_id in set(reading_ids.get(reading_id, [])
+                    ).intersection(surface_ids.get(surface_id, [])):
+                word_pools[partial_lexeme_id]['alignments'].append(
+                        (reading, surface, alignment))
+
+        # [339] Homographs share readings for the purposes of exclusion
+        homographs = {}
+        all_surfaces = set(surface for pool in word_pools.itervalues() \
+                for (surface, has_kanji) in pool['surfaces'])
+        for surface_set in groups_of_n(settings.N_ROWS_PER_INSERT,
+                sorted(all_surfaces)):
+            for surface, reading in \
+                    lexicon_models.LexemeSurface.objects.filter(
+                        surface__in=surface_set
+                    ).values_list('surface', 'lexeme__reading_set__reading'):
+                homographs.setdefault(surface, set()).add(reading)
+        for pool in word_pools.itervalues():
+            for surface, has_kanji in pool['surfaces']:
+                pool['homographs'][surface] = sorted(homographs.get(surface,
+                        []))
+
+        return word_pools
+
+#----------------------------------------------------------------------------#
+
+class GlossIndex(object):
+    """
+    The distinct glosses of a syllabus, held in memory so that distractor
+    glosses can be sampled without going back to the database. Samples are
+    drawn without replacement, either uniformly or ranked by how many words
+    they share with the answer gloss.
+    """
+    stop_words = frozenset(['a', 'an', 'and', 'as', 'at', 'be', 'by', 'for',
+            'in', 'of', 'on', 'one', 'or', 's', 'sth', 'the', 'to', 'with'])
+
+    def __init__(self, glosses):
+        self.glosses = sorted(set(glosses))
+        self._gloss_tokens = None
+        self._token_index = None
+
+    def __len__(self):
+        return len(self.glosses)
+
+    def sample(self, n, exclude_set=None, answer=None, ranked=False):
+        """
+        Returns n distinct glosses, none of which are in the exclude set. If
+        ranked is set, glosses which share the most words with the answer
+        are preferred, with any shortfall made up by uniform sampling.
+        """
+        exclude_set = exclude_set or set()
+        if answer is not None:
+            exclude_set = exclude_set.union([answer])
+
+        result = []
+        if ranked and answer is not None:
+            result = self._most_similar(answer, n, exclude_set)
+            exclude_set = exclude_set.union(result)
+
+        # Drawing extra indices guarantees enough survive the exclusions.
+        n_needed = n - len(result)
+        if n_needed > 0:
+            n_drawn = min(n_needed + len(exclude_set), len(self.glosses))
+            for i in random.sample(xrange(len(self.glosses)), n_drawn):
+                gloss = self.glosses[i]
+                if gloss not in exclude_set:
+                    result.append(gloss)
+                    if len(result) == n:
+                        break
+
+        if len(result) < n:
+            raise ValueError("don't have %d unique glosses to sample" % n)
+
+        return result
+
+    #------------------------------------------------------------------------#
+
+    def _most_similar(self, answer, n, exclude_set):
+        "Returns up to n glosses sharing words with the answer, best first."
+        if self._token_index is None:
+            self._build_token_index()
+
+        answer_tokens = self._tokenise(answer)
+        n_shared = {}
+        for token in answer_tokens:
+            for i in self._token_index.get(token, ()):
+                n_shared[i] = n_shared.get(i, 0) + 1
+
+        # Rank by Jaccard similarity, breaking ties randomly
+        ranked = []
+        for i, n_common in n_shared.iteritems():
+            n_union = len(self._gloss_tokens[i]) + len(answer_tokens) \
+                    - n_common
+            ranked.append((-float(n_common) / n_union, random.random(), i))
+        ranked.sort()
+
+        result = []
+        for _score, _tie_break, i in ranked:
+            gloss = self.glosses[i]
+            if gloss not in exclude_set:
+                result.append(gloss)
+                if len(result) == n:
+                    break
+        return result
+
+    def _build_token_index(self):
+        self._gloss_tokens = map(self._tokenise, self.glosses)
+        self._token_index = {}
+        for i, tokens in enumerate(self._gloss_tokens):
+            for token in tokens:
+                self._token_index.setdefault(token, []).append(i)
+
+    @classmethod
+    def _tokenise(cls, gloss):
+        return set(t for t in re.findall(r'[a-z]+', gloss.lower()) \
+                if t not in cls.stop_words)
+
+#----------------------------------------------------------------------------#
+
+def build_all(force=False):
+    """
+    Builds and stores the pools for every syllabus, unless they are up to
+    date with the lexicon and syllabi they were built from.
+    """
+    _log.start('Building distractor pools')
+    if not force and not Checksum.needs_update(_checksum_tag, _dependencies,
+            ['lexicon', 'syllabi']):
+        _log.finish('Already up-to-date')
+        return
+
+    syllabi = usermodel_models.Syllabus.objects.all()
+    for syllabus in syllabi:
+        _log.log(syllabus.tag)
+        SyllabusPools.build(syllabus).store()
+        _loaded_pools.pop(syllabus.id, None)
+    Checksum.store(_checksum_tag, _dependencies)
+    _log.finish()
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
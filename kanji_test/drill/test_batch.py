@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_batch.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-05.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+import unittest
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from kanji_test.user_model import models as usermodel_models
+from kanji_test.drill import models
+
+def suite():
+    testSuite = unittest.TestSuite((
+            unittest.makeSuite(TestSetBatchTest),
+        ))
+    return testSuite
+
+# The queries allowed per test set, besides its question inserts.
+_query_budget = 20
+
+def _count_queries(func, *args):
+    "Calls func, returning its result and the number of queries it issued."
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    start = len(connection.queries)
+    try:
+        result = func(*args)
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+    return result, len(connection.queries) - start
+
+def get_test_syllabus():
+    "Fetches the syllabus these tests use, building it if necessary."
+    try:
+        syllabus = usermodel_models.Syllabus.objects.get(tag='jlpt 3')
+    except usermodel_models.Syllabus.DoesNotExist:
+        from kanji_test.lexicon import load_lexicon
+        from kanji_test.user_model import add_syllabus
+        load_lexicon.load_lexicon()
+        add_syllabus.add_syllabus('jlpt_3')
+        syllabus = usermodel_models.Syllabus.objects.get(tag='jlpt 3')
+
+    if not models.ItemPool.objects.filter(syllabus=syllabus).exists():
+        from kanji_test.drill import pools
+        pools.SyllabusPools.build(syllabus).store()
+    return syllabus
+
+class TestSetBatchTest(unittest.TestCase):
+    def setUp(self):
+        User.objects.filter(username='test_user').delete()
+        test_user = User(username='test_user')
+        test_user.save()
+        self.syllabus = get_test_syllabus()
+        test_user.userprofile_set.create(syllabus=self.syllabus)
+        usermodel_models.ErrorDist.init_from_priors(test_user)
+        self.user = test_user
+
+    def test_query_budget(self):
+        """
+        Apart from one insert per question, which this Django can't batch,
+        test sets are generated with a fixed number of queries.
+        """
+        for n_questions in (10, 20):
+            test_set, n_queries = _count_queries(models.TestSet.from_user,
+                    self.user, n_questions)
+            self.assertEqual(len(test_set), n_questions)
+            self.assert_(n_queries - n_questions <= _query_budget, n_queries)
+
+        for question in test_set.questions.all():
+            options = list(question.options.all())
+            self.assertEqual(len([o for o in options if o.is_correct]), 1)
+            self.assertEqual(len(set(o.value for o in options)),
+                    len(options))
+
+    def tearDown(self):
+        for test_set in models.TestSet.objects.filter(user=self.user):
+            for question in test_set.questions.all():
+                question.options.all().delete()
+                question.delete()
+            test_set.delete()
+        self.user.delete()
+
+#----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    unittest.TextTestRunner(verbosity=1).run(suite())
+
+#----------------------------------------------------------------------------#
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+#  test_pools.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-17.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+import random
+import unittest
+
+from kanji_test.user_model import models as usermodel_models
+from kanji_test.drill import models
+from kanji_test.drill import pools
+
+def suite():
+    testSuite = unittest.TestSuite((
+            unittest.makeSuite(SyllabusPoolsTest),
+            unittest.makeSuite(GlossIndexTest),
+        ))
+    return testSuite
+
+class SyllabusPoolsTest(unittest.TestCase):
+    def setUp(self):
+        usermodel_models.Syllabus.objects.filter(tag='test pools').delete()
+        self.syllabus = usermodel_models.Syllabus.objects.create(
+                tag='test pools')
+
+    def test_rebuild_reloads(self):
+        "Pools rebuilt by another process replace the cached ones."
+        self._make_pools(u'dog').store()
+        self.assertEqual(
+                pools.SyllabusPools.get(self.syllabus).kanji_glosses,
+                [u'dog'])
+        self.assertEqual(
+                pools.SyllabusPools.get(self.syllabus).kanji_glosses,
+                [u'dog'])
+
+        # Stored directly, so this process's cache isn't told.
+        self._make_pools(u'cat').store()
+        self.assertEqual(
+                pools.SyllabusPools.get(self.syllabus).kanji_glosses,
+                [u'cat'])
+
+    def test_not_built(self):
+        "Pools are never built on demand."
+        self.assertRaises(pools.PoolsNotBuilt, pools.SyllabusPools.get,
+                self.syllabus)
+
+    def _make_pools(self, gloss):
+        return pools.SyllabusPools(self.syllabus.id, {1: {'kanji': u'犬',
+                'gloss': gloss, 'readings': [], 'all_readings': []}}, {})
+
+    def tearDown(self):
+        pools._loaded_pools.pop(self.syllabus.id, None)
+        models.ItemPool.objects.filter(syllabus=self.syllabus).delete()
+        self.syllabus.delete()
+
+_word_glosses = {
+        1: [u'dog', u'hound'],
+        2: [u'cat'],
+        3: [u'fish', u'sea fish'],
+        4: [u'big dog'],
+        5: [u'bird'],
+        6: [u'tree'],
+    }
+
+class GlossIndexTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+        word_pools = dict((pivot_id, {'glosses': glosses, 'homographs': {}}) \
+                for (pivot_id, glosses) in _word_glosses.iteritems())
+        self.pools = pools.SyllabusPools(1, {}, word_pools)
+        self.index = self.pools.sense_gloss_index
+
+    def test_sample(self):
+        "Distractors come from the syllabus and exclude the item's glosses."
+        syllabus_glosses = set(g for glosses in _word_glosses.itervalues() \
+                for g in glosses)
+        for i in xrange(50):
+            result = self.index.sample(4, exclude_set=set(_word_glosses[1]),
+                    answer=u'dog')
+            self.assertEqual(len(set(result)), 4)
+            self.assert_(set(result).issubset(syllabus_glosses))
+            self.assertFalse(set(result).intersection(_word_glosses[1]))
+
+    def test_ranked(self):
+        "Glosses sharing words with the answer are preferred."
+        for i in xrange(10):
+            result = self.index.sample(2, exclude_set=set([u'hound']),
+                    answer=u'dog', ranked=True)
+            self.assertEqual(result[0], u'big dog')
+            self.assertFalse(set(result).intersection([u'dog', u'hound']))
+
+    def test_exhausted(self):
+        self.assertRaises(ValueError, self.index.sample, 7,
+                exclude_set=set(_word_glosses[1]), answer=u'dog')
+
+#----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    unittest.TextTestRunner(verbosity=1).run(suite())
+
+#----------------------------------------------------------------------------#
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_updates.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-07.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+import random
+import unittest
+
+from django.contrib.auth.models import User
+from django.conf import settings
+
+from kanji_test.user_model import models as usermodel_models
+from kanji_test.drill import models
+from kanji_test.drill.test_batch import get_test_syllabus
+
+def suite():
+    testSuite = unittest.TestSuite((
+            unittest.makeSuite(PendingUpdateTest),
+        ))
+    return testSuite
+
+class PendingUpdateTest(unittest.TestCase):
+    def setUp(self):
+        # Fix the questions and options drawn for the test set.
+        random.seed(1234)
+        self.queue_updates = settings.QUEUE_MODEL_UPDATES
+        settings.QUEUE_MODEL_UPDATES = True
+        User.objects.filter(username='test_user').delete()
+        test_user = User(username='test_user')
+        test_user.save()
+        syllabus = get_test_syllabus()
+        test_user.userprofile_set.create(syllabus=syllabus)
+        usermodel_models.ErrorDist.init_from_priors(test_user)
+        self.user = test_user
+        self.test_set = models.TestSet.from_user(self.user, 5)
+
+    def test_apply_once(self):
+        "Each response is queued and applied exactly once."
+        models.PendingUpdate.apply_pending()
+        responses = self._respond()
+
+        pending = models.PendingUpdate.objects.filter(user=self.user,
+                applied_time=None)
+        self.assertEqual(pending.count(), len(responses))
+        self.assertEqual(
+                [o.response_id for o in pending.order_by('id')],
+                [o.id for o in responses],
+            )
+
+        error_pdfs = usermodel_models.ErrorPdf.objects.filter(
+                dist__user=self.user)
+        self.assertEqual(error_pdfs.count(), 0)
+        while models.PendingUpdate.apply_pending() > 0:
+            pass
+        self.assertEqual(pending.count(), 0)
+        # Choosing wrong answers changed the user's error model.
+        self.assert_(error_pdfs.count() > 0)
+
+        for response in responses:
+            models.PendingUpdate.enqueue(response)
+        self.assertEqual(pending.count(), 0)
+
+    def test_failed_update(self):
+        "Updates which fail are left pending while the rest are applied."
+        models.PendingUpdate.apply_pending()
+        responses = self._respond()
+        bad_id = responses[0].id
+
+        update_all = models.QuestionPlugin.__dict__['update_all']
+        models.QuestionPlugin.update_all = staticmethod(
+                lambda responses: [r for r in responses if r.id == bad_id])
+        try:
+            models.PendingUpdate.apply_pending()
+        finally:
+            models.QuestionPlugin.update_all = update_all
+
+        pending = models.PendingUpdate.objects.filter(user=self.user,
+                applied_time=None)
+        self.assertEqual([o.response_id for o in pending], [bad_id])
+
+    def _respond(self):
+        responses = []
+        for question in self.test_set.questions.all():
+            option = question.options.filter(is_correct=False)[0]
+            response = models.MultipleChoiceResponse(option=option,
+                    question=question, user=self.user)
+            response.save(update_model=True)
+            self.test_set.responses.add(response)
+            responses.append(response)
+        return responses
+
+    def tearDown(self):
+        settings.QUEUE_MODEL_UPDATES = self.queue_updates
+        for question in self.test_set.questions.all():
+            question.options.all().delete()
+            question.delete()
+        self.test_set.delete()
+        self.user.delete()
+
+#----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    unittest.TextTestRunner(verbosity=1).run(suite())
+
+#----------------------------------------------------------------------------#
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
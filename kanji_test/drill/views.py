@@ -71,6 +71,7 @@ class TestSetForm(forms.Form):
         chosen_option_ids = set()
         question_ids = []
         user_responses = {}
+        responses = []
         for key, value in self.cleaned_data.iteritems():
             if not key.startswith('question_'):
                 continue
@@ -79,11 +80,17 @@ class TestSetForm(forms.Form):
             question_id = int(key.split('_')[1])
             question_ids.append(question_id)
             user_responses[question_id] = option_id
-            self.test_set.responses.create(
+            response = models.MultipleChoiceResponse(
                     option_id=option_id,
                     question_id=question_id,
                     user_id=self.test_set.user_id,
                 )
+            response.save(update_model=False)
+            responses.append(response)
+
+        self.test_set.responses.add(*responses)
+        # Update the error models once for the whole set
+        models.MultipleChoiceResponse.update_models(responses)
 
         self.test_set.end_time = datetime.datetime.now()
         self.test_set.save()
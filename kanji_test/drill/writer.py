@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+#  writer.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-08.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+"""
+Bulk writing of multiple choice questions and their options.
+"""
+
+from django.db import connection, transaction
+
+from kanji_test.drill import models
+
+_question_fields = ['pivot', 'pivot_id', 'pivot_type', 'question_type',
+        'question_plugin_id', 'annotation']
+_option_fields = ['question_id', 'value', 'is_correct', 'annotation']
+
+class QuestionWriter(object):
+    """
+    Buffers unsaved multiple choice questions along with their pending
+    options, and writes them out in as few round trips as possible. Each
+    question still needs its own insert to obtain an id; everything else is
+    written with one executemany per table.
+    """
+    def __init__(self):
+        self.questions = []
+
+    def add(self, question):
+        "Buffers an unsaved question, which must already have its options."
+        if question.pk is not None:
+            raise ValueError('question already saved')
+        self.questions.append(question)
+
+    def flush(self, test_set=None):
+        """
+        Writes every buffered question and its options, adding them to the
+        given test set if there is one.
+        """
+        questions = self.questions
+        self.questions = []
+        if not questions:
+            return
+
+        cursor = connection.cursor()
+        quote_name = connection.ops.quote_name
+        question_table = models.Question._meta.db_table
+        question_sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                quote_name(question_table),
+                ', '.join(map(quote_name, _question_fields)),
+                ', '.join(['%s'] * len(_question_fields)),
+            )
+        for question in questions:
+            cursor.execute(question_sql, [getattr(question, f) for f in \
+                    _question_fields])
+            question.id = question.question_ptr_id = \
+                    connection.ops.last_insert_id(cursor, question_table,
+                            'id')
+
+        cursor.executemany('INSERT INTO %s (%s, %s) VALUES (%%s, %%s)' % (
+                    quote_name(models.MultipleChoiceQuestion._meta.db_table),
+                    quote_name('question_ptr_id'),
+                    quote_name('stimulus'),
+                ),
+                [(q.id, q.stimulus) for q in questions])
+
+        options = []
+        for question in questions:
+            for option in question.pending_options:
+                option.question = question
+                options.append(option)
+            question.pending_options = []
+        self._insert_options(cursor, options)
+
+        if test_set is not None:
+            through_meta = models.TestSet.questions.through._meta
+            cursor.executemany('INSERT INTO %s (%s, %s) VALUES (%%s, %%s)' % (
+                        quote_name(through_meta.db_table),
+                        quote_name(through_meta.get_field('testset').column),
+                        quote_name(through_meta.get_field(
+                                'multiplechoicequestion').column),
+                    ),
+                    [(test_set.id, q.id) for q in questions])
+
+        transaction.commit_unless_managed()
+        return
+
+    @staticmethod
+    def write_options(options):
+        "Writes the options of an already saved question in one round trip."
+        QuestionWriter._insert_options(connection.cursor(), options)
+        transaction.commit_unless_managed()
+
+    @staticmethod
+    def _insert_options(cursor, options):
+        if not options:
+            return
+        quote_name = connection.ops.quote_name
+        cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+                    quote_name(models.MultipleChoiceOption._meta.db_table),
+                    ', '.join(map(quote_name, _option_fields)),
+                    ', '.join(['%s'] * len(_option_fields)),
+                ),
+                [[getattr(o, f) for f in _option_fields] for o in options])
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
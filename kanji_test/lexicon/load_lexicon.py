@@ -8,14 +8,20 @@
 #  Copyright 2008-06-21 Lars Yencken. All rights reserved.
 # 
 
+import sys, optparse
+import time
+import hashlib
+import itertools
+import threading
+import Queue
 from os import path
 from xml.etree import cElementTree as ElementTree
 
-from django.db import connection
-from simplestats.sequences import groups_of_n_iter
+from django.db import connection, transaction
 from cjktools.common import sopen
 from cjktools import scripts
 import consoleLog
+from simplestats.sequences import groups_of_n, groups_of_n_iter
 from checksum.models import Checksum
 
 from kanji_test.lexicon import models
@@ -26,30 +32,54 @@ _jmdict_path = path.join(settings.DATA_DIR, 'JMdict.gz')
 _dependencies = [__file__, models]
 _checksum_tag = 'lexicon'
 
+class RebuildError(Exception): pass
+
 #----------------------------------------------------------------------------#
 
-def load_lexicon(filename=_jmdict_path):
-    " Reloads the lexicon into the database."
-    log.start('Rebuilding the lexicon', nSteps=5)
+def load_lexicon(filename=_jmdict_path, n_writers=None, incremental=True):
+    """
+    Brings the lexicon in the database up to date with JMdict. Unless
+    incremental is unset, a stored lexicon is refreshed entry by entry,
+    leaving unchanged lexemes, their rows and the kanji untouched, so that
+    syllabi built on them stay valid.
+
+    Otherwise, or if the lexicon has never been loaded with sequence
+    numbers, the kanji, probability distributions and lexicon are rebuilt
+    from scratch. With more than one writer, lexicon rows are then inserted
+    by that many threads while entries are still being parsed. Rebuilding
+    deletes every row which refers to the kanji or lexemes, such as the
+    partial kanji and lexemes of syllabi, so it is only done implicitly if
+    there are no such rows; otherwise RebuildError is raised, and the
+    rebuild must be asked for by unsetting incremental.
+    """
+    if n_writers is None:
+        n_writers = settings.N_LEXICON_WRITERS
+
+    log.start('Rebuilding the lexicon', nSteps=4)
     if not Checksum.needs_update(_checksum_tag, _dependencies + [filename]):
         log.finish('Already up-to-date')
         return
 
-    log.log('Loading probability distributions')
-    models.initialise()
-    
-    log.start('Loading JMdict', nSteps=2)
-    _clear_lexicon()
-    log.log('Reading from %s' % path.basename(filename))
-    iStream = sopen(filename, 'r', 'byte')
-    data = iStream.read()
-    iStream.close()
-    log.log('Parsing XML tree')
-    tree = ElementTree.fromstring(data)
-    del data
-    log.finish()
-    
-    _store_lexemes(tree.getchildren())
+    # Lexemes stored without sequence numbers can't be matched with their
+    # entries, so they can only be rebuilt.
+    if incremental and models.Lexeme.objects.all().exists() and \
+            not models.Lexeme.objects.filter(ent_seq__isnull=True).exists():
+        log.log('Keeping the existing kanji and distributions')
+        log.log('Refreshing from %s' % path.basename(filename))
+        _refresh_lexemes(_iter_entries(filename))
+    else:
+        if _has_dependents():
+            if incremental:
+                log.finish('Needs a rebuild')
+                raise RebuildError('the lexicon must be rebuilt, which '
+                        'discards the syllabus rows which refer to it; '
+                        'use --rebuild to go ahead')
+            log.log('Discarding syllabus rows which refer to the lexicon')
+        log.log('Loading probability distributions')
+        models.initialise()
+        _clear_lexicon()
+        log.log('Streaming from %s' % path.basename(filename))
+        _store_lexemes(_iter_entries(filename), n_writers)
 
     log.log('Storing checksum')
     Checksum.store(_checksum_tag, _dependencies + [filename])
@@ -58,6 +88,15 @@ def load_lexicon(filename=_jmdict_path):
 
 #----------------------------------------------------------------------------#
 
+def _has_dependents():
+    "Returns True if rows outside this app refer to the kanji or lexemes."
+    for model in (models.Kanji, models.Lexeme):
+        for related in model._meta.get_all_related_objects():
+            if related.model._meta.app_label != models.Kanji._meta.app_label \
+                    and related.model.objects.all().exists():
+                return True
+    return False
+
 def _clear_lexicon():
     cursor = connection.cursor()
     tables = [
@@ -76,8 +115,33 @@ def _clear_lexicon():
 
 #----------------------------------------------------------------------------#
 
-def _populate_stacks(lexeme_node, lexeme_id, lexeme_surface_stack,
-        lexeme_sense_stack, lexeme_reading_stack):
+def _iter_entries(filename):
+    """
+    Iterates over the entry nodes of a JMdict file as they are parsed. Each
+    entry is cleared away once the caller is done with it, so memory use
+    stays flat however large the dictionary grows.
+    """
+    i_stream = sopen(filename, 'r', 'byte')
+    try:
+        context = iter(ElementTree.iterparse(i_stream,
+                events=('start', 'end')))
+        _event, root = context.next()
+        for event, node in context:
+            if event == 'end' and node.tag == 'entry':
+                yield node
+                root.clear()
+    finally:
+        i_stream.close()
+
+def _get_ent_seq(lexeme_node):
+    "Returns the JMdict sequence number of an entry."
+    return int(lexeme_node.find('ent_seq').text)
+
+def _parse_entry(lexeme_node, lexeme_id):
+    """
+    Returns the surface, reading and sense rows for a single JMdict entry,
+    or None if the entry lacks crucial data.
+    """
     surface_set = set(n.find('keb').text.upper() for n in \
             lexeme_node.findall('k_ele'))
     reading_list = [n.find('reb').text for n in \
@@ -86,24 +150,25 @@ def _populate_stacks(lexeme_node, lexeme_id, lexeme_surface_stack,
 
     if not (reading_list and sense_list):
         print "Warning: lexeme is missing crucial data"
-        return
+        return None
 
     # If we have no kanji, the kana becomes the surface form
     if not surface_set:
         surface_set = set(reading_list)
 
+    surface_rows = []
     in_lexicon = True # All these surfaces are from the original lexicon
     for surface in sorted(surface_set):
-        lexeme_surface_stack.append((
+        surface_rows.append((
                 lexeme_id,
                 surface.upper(),
                 scripts.contains_script(scripts.Script.Kanji, surface),
                 in_lexicon,
             ))
-    
-    for reading in reading_list:
-        lexeme_reading_stack.append((lexeme_id, reading))
 
+    reading_rows = [(lexeme_id, reading) for reading in reading_list]
+
+    sense_rows = []
     is_first_sense = True
     for sense_node in sense_list:
         for gloss in sense_node.findall('gloss'):
@@ -111,14 +176,165 @@ def _populate_stacks(lexeme_node, lexeme_id, lexeme_surface_stack,
             lang = gloss.get(lang_key)
             if lang != 'eng':
                 continue
-            lexeme_sense_stack.append((lexeme_id, gloss.text, is_first_sense))
+            sense_rows.append((lexeme_id, gloss.text, is_first_sense))
             is_first_sense = False
-    return
+
+    return surface_rows, reading_rows, sense_rows
+
+#----------------------------------------------------------------------------#
+
+# Tables in the order their rows must be written, to satisfy foreign keys.
+_tables = ['lexicon_lexeme', 'lexicon_lexemesurface',
+        'lexicon_lexemereading', 'lexicon_lexemesense']
+
+_insert_sql = {
+    'lexicon_lexeme': """
+            INSERT INTO lexicon_lexeme (id, ent_seq, entry_hash)
+            VALUES (%s, %s, %s)
+        """,
+    'lexicon_lexemesurface': """
+            INSERT INTO lexicon_lexemesurface (lexeme_id, surface,
+                has_kanji, in_lexicon)
+            VALUES (%s, %s, %s, %s)
+        """,
+    'lexicon_lexemereading': """
+            INSERT INTO lexicon_lexemereading (lexeme_id, reading)
+            VALUES (%s, %s)
+        """,
+    'lexicon_lexemesense': """
+            INSERT INTO lexicon_lexemesense (lexeme_id, gloss,
+                    is_first_sense)
+            VALUES (%s, %s, %s)
+        """,
+}
+
+class LexiconWriter(object):
+    """
+    Buffers rows for the lexicon tables, writing them out in batches of
+    N_ROWS_PER_INSERT as they accumulate.
+    """
+    def __init__(self, cursor, max_rows=settings.N_ROWS_PER_INSERT):
+        self.cursor = cursor
+        self.max_rows = max_rows
+        self.buffers = dict((table, []) for table in _tables)
+        self.n_rows = 0
+
+    def add(self, table, rows):
+        "Buffers rows for a table, writing them if the buffer is full."
+        buffer = self.buffers[table]
+        buffer.extend(rows)
+        self.n_rows += len(rows)
+        if len(buffer) >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        "Writes every buffered row."
+        for table in _tables:
+            rows = self.buffers[table]
+            if rows:
+                self.cursor.executemany(_insert_sql[table], rows)
+                self.buffers[table] = []
+
+    def close(self):
+        "Writes any remaining rows."
+        self.flush()
+
+    def abort(self):
+        "Discards any buffered rows."
+        self.buffers = dict((table, []) for table in _tables)
+
+class ParallelLexiconWriter(LexiconWriter):
+    """
+    A LexiconWriter whose batches are inserted by a pool of writer threads,
+    each over its own database connection, so that parsing carries on while
+    rows are written. Lexeme rows are committed before the batches which
+    refer to them are queued, so foreign keys are always satisfied.
+    """
+    def __init__(self, cursor, n_workers, max_rows=settings.N_ROWS_PER_INSERT):
+        LexiconWriter.__init__(self, cursor, max_rows=max_rows)
+        # Bounded, so that a slow database holds back the parser instead of
+        # letting batches pile up in memory.
+        self.queue = Queue.Queue(2 * n_workers)
+        self.errors = []
+        self.aborted = False
+        self.workers = []
+        for i in xrange(n_workers):
+            worker = threading.Thread(target=self._write_batches)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def flush(self):
+        "Writes the buffered lexemes, then queues every other buffered row."
+        if self.errors:
+            raise self.errors[0]
+
+        lexeme_rows = self.buffers[_tables[0]]
+        if lexeme_rows:
+            self.cursor.executemany(_insert_sql[_tables[0]], lexeme_rows)
+            transaction.commit_unless_managed()
+            self.buffers[_tables[0]] = []
+
+        for table in _tables[1:]:
+            rows = self.buffers[table]
+            if rows:
+                self.queue.put((table, rows))
+                self.buffers[table] = []
+
+    def close(self):
+        """
+        Writes any remaining rows, and waits for the writers to finish and
+        close their connections.
+        """
+        try:
+            self.flush()
+        finally:
+            self._stop_workers()
+        if self.errors:
+            raise self.errors[0]
+
+    def abort(self):
+        """
+        Discards any buffered or queued rows, and waits for the writers to
+        close their connections.
+        """
+        LexiconWriter.abort(self)
+        self.aborted = True
+        self._stop_workers()
+
+    def _stop_workers(self):
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def _write_batches(self):
+        # Django keeps a separate database connection for each thread, which
+        # must be closed here or it is left open once the thread exits.
+        cursor = connection.cursor()
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    break
+                if self.errors or self.aborted:
+                    # Keep draining the queue so the parser isn't blocked.
+                    continue
+                table, rows = batch
+                try:
+                    cursor.executemany(_insert_sql[table], rows)
+                    transaction.commit_unless_managed()
+                except Exception, e:
+                    self.errors.append(e)
+        finally:
+            cursor.close()
+            connection.close()
 
 #----------------------------------------------------------------------------#
 
-def _store_lexemes(lexeme_nodes):
-    log.start('Storing lexemes', nSteps=6)
+def _store_lexemes(lexeme_nodes, n_writers=1):
+    log.start('Storing lexemes', nSteps=3)
     cursor = connection.cursor()
 
     log.log('Clearing tables')
@@ -126,55 +342,288 @@ def _store_lexemes(lexeme_nodes):
     cursor.execute('DELETE FROM lexicon_lexemesense')
     cursor.execute('DELETE FROM lexicon_lexemesurface')
     cursor.execute('DELETE FROM lexicon_lexeme')
-    cursor.execute('COMMIT')
-
-    next_lexeme_id = 1
-    lexeme_surface_stack = []
-    lexeme_sense_stack = []
-    lexeme_reading_stack = []
-
-    log.log('Building insert stacks')
-    for lexeme_node in lexeme_nodes:
-        _populate_stacks(lexeme_node, next_lexeme_id, lexeme_surface_stack,
-                lexeme_sense_stack, lexeme_reading_stack)
-        next_lexeme_id += 1
-
-    max_rows = settings.N_ROWS_PER_INSERT
-
-    log.log('Storing to lexicon_lexeme')
-    for lexeme_rows in groups_of_n_iter(max_rows, xrange(1, next_lexeme_id)):
-        cursor.executemany('INSERT INTO lexicon_lexeme (id) VALUES (%s)',
-                lexeme_rows)
-
-    log.log('Storing to lexicon_lexemesurface')
-    for lexeme_surface_rows in groups_of_n_iter(max_rows, lexeme_surface_stack):
-        cursor.executemany( """
-                INSERT INTO lexicon_lexemesurface (lexeme_id, surface,
-                    has_kanji, in_lexicon)
-                VALUES (%s, %s, %s, %s)
-            """, lexeme_surface_rows)
-
-    log.log('Storing to lexicon_lexemereading')
-    for lexeme_reading_rows in groups_of_n_iter(max_rows, lexeme_reading_stack):
-        cursor.executemany( """
-                INSERT INTO lexicon_lexemereading (lexeme_id, reading)
-                VALUES (%s, %s)
-            """, lexeme_reading_rows)
-
-    log.log('Storing to lexicon_lexemesense')
-    for lexeme_sense_rows in groups_of_n_iter(max_rows, lexeme_sense_stack):
-        cursor.executemany( """
-                INSERT INTO lexicon_lexemesense (lexeme_id, gloss,
-                        is_first_sense)
-                VALUES (%s, %s, %s)
-            """, lexeme_sense_rows)
-
-    connection._commit()
+    transaction.commit_unless_managed()
+
+    log.log('Parsing and storing entries ', newLine=False)
+    if n_writers > 1:
+        writer = ParallelLexiconWriter(cursor, n_writers)
+    else:
+        writer = LexiconWriter(cursor)
+    start_time = time.time()
+    lexeme_id = 0
+    try:
+        for lexeme_node in consoleLog.withProgress(lexeme_nodes, 1000):
+            lexeme_id += 1
+            _add_entry(writer, lexeme_id, lexeme_node)
+    except:
+        writer.abort()
+        raise
+    writer.close()
+    transaction.commit_unless_managed()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    log.log('Stored %d lexemes (%d rows) in %.1fs, %.0f lexemes/s' % (
+            lexeme_id, writer.n_rows, elapsed, lexeme_id / elapsed))
     log.finish()
     return
 
+def _add_entry(writer, lexeme_id, lexeme_node):
+    "Buffers the rows of a new lexeme for an entry."
+    rows = _parse_entry(lexeme_node, lexeme_id) or ([], [], [])
+    writer.add('lexicon_lexeme', [(lexeme_id, _get_ent_seq(lexeme_node),
+            _entry_key(*rows))])
+    surface_rows, reading_rows, sense_rows = rows
+    writer.add('lexicon_lexemesurface', surface_rows)
+    writer.add('lexicon_lexemereading', reading_rows)
+    writer.add('lexicon_lexemesense', sense_rows)
+
+#----------------------------------------------------------------------------#
+
+# The number of entries whose stored hashes are fetched, and whose changed
+# rows are updated, together.
+_n_entries_per_batch = 1000
+
+def _refresh_lexemes(lexeme_nodes):
+    """
+    Brings the stored lexemes up to date with the given entries, matching
+    them by their JMdict sequence numbers. Each entry is compared with the
+    hash stored for its lexeme, so that only the rows of changed entries
+    are read. New entries are inserted, changed ones have their rows
+    updated in place, and lexemes whose entries have gone are deleted along
+    with anything which refers to them. Lexemes stored without a hash are
+    treated as changed, and get one.
+    """
+    log.start('Refreshing lexemes', nSteps=2)
+    cursor = connection.cursor()
+
+    log.log('Comparing entries ', newLine=False)
+    writer = LexiconWriter(cursor)
+    cursor.execute('SELECT MAX(id) FROM lexicon_lexeme')
+    last_id = cursor.fetchone()[0] or 0
+    seen = set()
+    n_added = 0
+    n_changed = 0
+    start_time = time.time()
+    with transaction.commit_on_success():
+        # Clearing the parse tree's root leaves the entries themselves
+        # intact, so a batch of them can be held until it is compared.
+        for node_group in groups_of_n_iter(_n_entries_per_batch,
+                consoleLog.withProgress(lexeme_nodes, 1000)):
+            entries = [(_get_ent_seq(node), node) for node in node_group]
+            stored = _get_stored_hashes(cursor,
+                    [ent_seq for (ent_seq, node) in entries])
+            changed = []
+            for ent_seq, lexeme_node in entries:
+                seen.add(ent_seq)
+                if ent_seq not in stored:
+                    last_id += 1
+                    _add_entry(writer, last_id, lexeme_node)
+                    n_added += 1
+                    continue
+
+                lexeme_id, entry_hash = stored[ent_seq]
+                rows = _parse_entry(lexeme_node, lexeme_id) or ([], [], [])
+                new_hash = _entry_key(*rows)
+                if new_hash != entry_hash:
+                    changed.append((lexeme_id, new_hash, rows))
+
+            if changed:
+                _apply_changes(cursor, writer, changed)
+                n_changed += len(changed)
+        writer.close()
+
+        # Deleting through the ORM also removes partial lexemes and any
+        # other rows which refer to the lost lexemes.
+        cursor.execute('SELECT id, ent_seq FROM lexicon_lexeme')
+        removed_ids = [lexeme_id for (lexeme_id, ent_seq) in \
+                cursor.fetchall() if ent_seq not in seen]
+        for id_group in groups_of_n(settings.N_ROWS_PER_INSERT, removed_ids):
+            models.Lexeme.objects.filter(id__in=id_group).delete()
+
+    log.log('%d added, %d changed, %d removed in %.1fs' % (n_added,
+            n_changed, len(removed_ids), time.time() - start_time))
+    log.finish()
+    return
+
+def _get_stored_hashes(cursor, ent_seqs):
+    """
+    Returns a dictionary mapping each of the given sequence numbers which
+    has a stored lexeme to that lexeme's id and hash.
+    """
+    cursor.execute("""
+            SELECT ent_seq, id, entry_hash
+            FROM lexicon_lexeme
+            WHERE ent_seq IN (%s)
+        """ % ', '.join(['%s'] * len(ent_seqs)), ent_seqs)
+    return dict((ent_seq, (lexeme_id, entry_hash)) for (ent_seq, lexeme_id,
+            entry_hash) in cursor.fetchall())
+
+def _fetch_grouped(cursor, query, params=()):
+    """
+    Runs a query whose rows start with a lexeme id, returning a dictionary
+    of each lexeme's rows.
+    """
+    cursor.execute(query, params)
+    grouped = {}
+    for lexeme_id, rows in itertools.groupby(cursor.fetchall(),
+            lambda row: row[0]):
+        grouped[lexeme_id] = list(rows)
+    return grouped
+
+def _entry_key(surface_rows, reading_rows, sense_rows):
+    """
+    Returns a digest of a lexeme's rows, ignoring the order of its surfaces
+    and readings.
+    """
+    digest = hashlib.md5()
+    for rows in (sorted(surface_rows), sorted(reading_rows), sense_rows):
+        for row in rows:
+            # Skip the lexeme id, and store flags the same way whatever the
+            # database returned for them.
+            for value in row[1:]:
+                if isinstance(value, basestring):
+                    value = value.encode('utf8')
+                else:
+                    value = str(int(value))
+                digest.update(value)
+                digest.update('\0')
+            digest.update('\n')
+        digest.update('\f')
+    return digest.hexdigest()
+
+def _apply_changes(cursor, writer, changed):
+    """
+    Updates the stored rows and hashes of changed lexemes to match their
+    entries, given as (lexeme id, hash, rows) triples, keeping the ids of
+    rows which are still present. Stored rows are fetched, and changes
+    written, a table at a time; new rows go to the writer.
+    """
+    lexeme_ids = [lexeme_id for (lexeme_id, entry_hash, rows) in changed]
+    id_list = ', '.join(['%s'] * len(lexeme_ids))
+    stored_surfaces = _fetch_grouped(cursor, """
+            SELECT lexeme_id, id, surface, has_kanji, in_lexicon
+            FROM lexicon_lexemesurface
+            WHERE lexeme_id IN (%s)
+            ORDER BY lexeme_id
+        """ % id_list, lexeme_ids)
+    stored_readings = _fetch_grouped(cursor, """
+            SELECT lexeme_id, id, reading
+            FROM lexicon_lexemereading
+            WHERE lexeme_id IN (%s)
+            ORDER BY lexeme_id
+        """ % id_list, lexeme_ids)
+    stored_senses = _fetch_grouped(cursor, """
+            SELECT lexeme_id, id, gloss, is_first_sense
+            FROM lexicon_lexemesense
+            WHERE lexeme_id IN (%s)
+            ORDER BY lexeme_id, id
+        """ % id_list, lexeme_ids)
+
+    surface_deletes = []
+    surface_updates = []
+    reading_deletes = []
+    sense_deletes = []
+    sense_updates = []
+    for lexeme_id, entry_hash, (surface_rows, reading_rows, sense_rows) in \
+            changed:
+        new_surfaces = dict((surface, has_kanji) for (_id, surface,
+                has_kanji, _in_lexicon) in surface_rows)
+        for _id, row_id, surface, has_kanji, in_lexicon in \
+                stored_surfaces.get(lexeme_id, []):
+            if surface not in new_surfaces:
+                # Surfaces added to the lexicon by syllabi aren't in JMdict.
+                if in_lexicon:
+                    surface_deletes.append(row_id)
+                continue
+
+            new_has_kanji = new_surfaces.pop(surface)
+            if not in_lexicon or bool(has_kanji) != new_has_kanji:
+                surface_updates.append((new_has_kanji, True, row_id))
+        writer.add('lexicon_lexemesurface', [(lexeme_id, surface, has_kanji,
+                True) for (surface, has_kanji) in new_surfaces.iteritems()])
+
+        new_readings = set(reading for (_id, reading) in reading_rows)
+        for _id, row_id, reading in stored_readings.get(lexeme_id, []):
+            if reading in new_readings:
+                new_readings.remove(reading)
+            else:
+                reading_deletes.append(row_id)
+        writer.add('lexicon_lexemereading', [(lexeme_id, reading) \
+                for reading in new_readings])
+
+        # Senses have no natural key, so they are matched up by position.
+        senses = stored_senses.get(lexeme_id, [])
+        for (_id, row_id, gloss, is_first_sense), new_row in \
+                itertools.izip(senses, sense_rows):
+            _id, new_gloss, new_is_first_sense = new_row
+            if gloss != new_gloss or \
+                    bool(is_first_sense) != new_is_first_sense:
+                sense_updates.append((new_gloss, new_is_first_sense, row_id))
+        sense_deletes.extend(row[1] for row in senses[len(sense_rows):])
+        writer.add('lexicon_lexemesense', sense_rows[len(senses):])
+
+    # Deleting through the ORM also removes anything which refers to the
+    # lost rows, such as the partial lexemes of syllabi.
+    for model, row_ids in [(models.LexemeSurface, surface_deletes),
+            (models.LexemeReading, reading_deletes),
+            (models.LexemeSense, sense_deletes)]:
+        for id_group in groups_of_n(settings.N_ROWS_PER_INSERT, row_ids):
+            model.objects.filter(id__in=id_group).delete()
+
+    if surface_updates:
+        cursor.executemany("""
+                UPDATE lexicon_lexemesurface
+                SET has_kanji = %s, in_lexicon = %s
+                WHERE id = %s
+            """, surface_updates)
+    if sense_updates:
+        cursor.executemany("""
+                UPDATE lexicon_lexemesense
+                SET gloss = %s, is_first_sense = %s
+                WHERE id = %s
+            """, sense_updates)
+    cursor.executemany("""
+            UPDATE lexicon_lexeme
+            SET entry_hash = %s
+            WHERE id = %s
+        """, [(entry_hash, lexeme_id) for (lexeme_id, entry_hash, rows) in \
+            changed])
+
+#----------------------------------------------------------------------------#
+
+def _create_option_parser():
+    usage = \
+"""%prog [options] [JMdict.gz]
+
+Rebuilds the lexicon from JMdict."""
+
+    parser = optparse.OptionParser(usage)
+
+    parser.add_option('-r', '--rebuild', action='store_true',
+            dest='rebuild',
+            help='Rebuild the lexicon from scratch, instead of updating '
+                'only the entries which have changed [False]')
+
+    parser.add_option('-j', '--jobs', action='store', type='int',
+            dest='jobs', default=settings.N_LEXICON_WRITERS,
+            help='Writer threads for inserting rows [%default]')
+
+    return parser
+
+def main(argv):
+    parser = _create_option_parser()
+    (options, args) = parser.parse_args(argv)
+
+    if len(args) > 1:
+        parser.print_help()
+        sys.exit(1)
+
+    filename = args and args[0] or _jmdict_path
+    load_lexicon(filename, n_writers=max(1, options.jobs),
+            incremental=not options.rebuild)
+
 #----------------------------------------------------------------------------#
 
 if __name__ == '__main__':
-    load_lexicon()
+    main(sys.argv[1:])
 
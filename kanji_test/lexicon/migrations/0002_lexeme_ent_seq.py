@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from south.db import db
+from django.db import models
+
+class Migration:
+
+    def forwards(self, orm):
+
+        # Adding field 'Lexeme.ent_seq'
+        db.add_column('lexicon_lexeme', 'ent_seq', orm['lexicon.Lexeme:ent_seq'])
+
+    def backwards(self, orm):
+
+        # Deleting field 'Lexeme.ent_seq'
+        db.delete_column('lexicon_lexeme', 'ent_seq')
+
+
+    models = {
+        'lexicon.lexeme': {
+            'ent_seq': ('django.db.models.fields.IntegerField', [], {'unique': 'True', 'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'lexicon.lexemereading': {
+            'Meta': {'unique_together': "(('lexeme', 'reading'),)"},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'lexeme': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'reading_set'", 'to': "orm['lexicon.Lexeme']"}),
+            'priority_codes': ('django.db.models.fields.CharField', [], {'max_length': '60', 'null': 'True', 'blank': 'True'}),
+            'reading': ('django.db.models.fields.CharField', [], {'max_length': '60', 'db_index': 'True'})
+        },
+        'lexicon.lexemesense': {
+            'gloss': ('django.db.models.fields.CharField', [], {'max_length': '500'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_first_sense': ('django.db.models.fields.BooleanField', [], {'blank': 'True'}),
+            'lexeme': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'sense_set'", 'to': "orm['lexicon.Lexeme']"})
+        },
+        'lexicon.lexemesurface': {
+            'Meta': {'unique_together': "(('lexeme', 'surface'),)"},
+            'has_kanji': ('django.db.models.fields.BooleanField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'in_lexicon': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'blank': 'True'}),
+            'lexeme': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'surface_set'", 'to': "orm['lexicon.Lexeme']"}),
+            'priority_codes': ('django.db.models.fields.CharField', [], {'max_length': '60', 'null': 'True', 'blank': 'True'}),
+            'surface': ('django.db.models.fields.CharField', [], {'max_length': '60', 'db_index': 'True'})
+        }
+    }
+
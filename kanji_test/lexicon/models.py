@@ -10,11 +10,13 @@
 import random
 from os import path
 
-from django.db import models
+from django.db import models, connection, transaction
 from cjktools.resources import kanjidic
+from simplestats.sequences import groups_of_n
 from cjktools import scripts
 
 from kanji_test.util import probability
+from kanji_test.util import compiled_counts
 from kanji_test.util import models as prob_models
 from kanji_test import settings
 
@@ -22,6 +24,11 @@ from kanji_test import settings
 
 class Lexeme(models.Model):
     """A single word or phrase."""
+    ent_seq = models.IntegerField(null=True, unique=True,
+            help_text="The entry's sequence number in JMdict.")
+    entry_hash = models.CharField(max_length=32, null=True,
+            help_text="A digest of the entry's rows, to detect changes.")
+
     def _get_random_sense(self):
         return self.sense_set.order_by('?')[0]
     random_sense = property(_get_random_sense)
@@ -96,8 +103,8 @@ class LexemeSense(models.Model):
 
     @classmethod
     def sample_n(cls, n):
-        surface_set = LexemeSurfaceProb.sample_n(n)
-        return cls.objects.filter(lexeme__surface_set__in=surface_set,
+        surfaces = [row.symbol for row in LexemeSurfaceProb.sample_n(n)]
+        return cls.objects.filter(lexeme__surface_set__surface__in=surfaces,
                 is_first_sense=True)
 
 #----------------------------------------------------------------------------#        
@@ -117,7 +124,7 @@ class KanjiProb(prob_models.Prob):
 
     @classmethod
     def initialise(cls):
-        dist = probability.FreqDist.from_file(cls._freq_dist_file)
+        dist = compiled_counts.load_freq_dist(cls._freq_dist_file)
         cls.from_dist(dist)
     
     @classmethod
@@ -135,9 +142,8 @@ class KanjiReadingProb(prob_models.Prob):
     
     @classmethod
     def initialise(cls):
-        cond_dist = probability.ConditionalFreqDist.from_file(
-                cls._freq_dist_file, format='packed')
-        dist = cond_dist.without_condition()
+        dist = compiled_counts.load_freq_dist(cls._freq_dist_file,
+                format='packed')
         cls.from_dist(dist)
 
 class KanjiReadingCondProb(prob_models.CondProb):
@@ -168,7 +174,7 @@ class KanjiReadingCondProb(prob_models.CondProb):
     
     @classmethod
     def initialise(cls):
-        dist = probability.ConditionalFreqDist.from_file(cls._freq_dist_file,
+        dist = compiled_counts.load_cond_freq_dist(cls._freq_dist_file,
                 format='packed')
         cls.from_dist(dist)
     
@@ -199,7 +205,7 @@ class LexemeSurfaceProb(prob_models.Prob):
 
     @classmethod
     def initialise(cls):
-        dist = probability.FreqDist.from_file(cls._freq_dist_file)
+        dist = compiled_counts.load_freq_dist(cls._freq_dist_file)
         cls.from_dist(dist)
         
 class LexemeReadingProb(prob_models.CondProb):
@@ -236,21 +242,68 @@ class Kanji(models.Model):
     
     @classmethod
     def initialise(cls):
-        KanjiReading.objects.all().delete()
-        Kanji.objects.all().delete()
         kjd = kanjidic.Kanjidic.get_cached()
         max_gloss_len = [f for f in cls._meta.fields \
                 if f.name == 'gloss'][0].max_length
+        kanji_rows = []
+        reading_rows = []
         for entry in kjd.itervalues():
             truncated_gloss = ', '.join(entry.gloss)[:max_gloss_len]
-            kanji = Kanji(kanji=entry.kanji, gloss=truncated_gloss)
-            kanji.save()
+            kanji_rows.append((entry.kanji, truncated_gloss))
             for reading in cls._clean_readings(entry.on_readings):
-                kanji.reading_set.create(reading=reading, reading_type='o')
+                reading_rows.append((entry.kanji, reading, 'o'))
             for reading in cls._clean_readings(entry.kun_readings):
-                kanji.reading_set.create(reading=reading, reading_type='k')
+                reading_rows.append((entry.kanji, reading, 'k'))
+
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        with transaction.commit_on_success():
+            cls._clear(cursor)
+            for row_set in groups_of_n(settings.N_ROWS_PER_INSERT,
+                    kanji_rows):
+                cursor.executemany(
+                        """
+                        INSERT INTO %s (kanji, gloss)
+                        VALUES (%%s, %%s)
+                        """ % qn(Kanji._meta.db_table),
+                        row_set
+                    )
+            for row_set in groups_of_n(settings.N_ROWS_PER_INSERT,
+                    reading_rows):
+                cursor.executemany(
+                        """
+                        INSERT INTO %s (kanji_id, reading, reading_type)
+                        VALUES (%%s, %%s, %%s)
+                        """ % qn(KanjiReading._meta.db_table),
+                        row_set
+                    )
         return
     
+    @classmethod
+    def _clear(cls, cursor):
+        """
+        Deletes every kanji and reading, along with the rows which refer to
+        them, such as syllabus kanji. Raw DELETEs are used, since the ORM
+        would load every row in order to cascade.
+        """
+        tables = []
+        for related in cls._meta.get_all_related_objects():
+            if related.model is KanjiReading:
+                continue
+            tables.extend(f.rel.through._meta.db_table for f in \
+                    related.model._meta.many_to_many)
+            tables.append(related.model._meta.db_table)
+        tables.extend(o.field.rel.through._meta.db_table for o in \
+                KanjiReading._meta.get_all_related_many_to_many_objects())
+        tables.extend([KanjiReading._meta.db_table, cls._meta.db_table])
+
+        qn = connection.ops.quote_name
+        cleared = set()
+        for table in tables:
+            if table not in cleared:
+                cursor.execute('DELETE FROM %s' % qn(table))
+                cleared.add(table)
+
     @staticmethod
     def _clean_readings(reading_list):
         return set(
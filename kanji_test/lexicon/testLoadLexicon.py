@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+#  testLoadLexicon.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-17.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from django.test import TransactionTestCase
+from cjktools.common import sopen
+import consoleLog
+
+from kanji_test.lexicon import models
+from kanji_test.lexicon import load_lexicon
+
+def suite():
+    testSuite = unittest.TestSuite((
+            unittest.makeSuite(RefreshTest),
+        ))
+    return testSuite
+
+_old_entries = [
+        (1001, [u'日'], [u'ひ'], [u'day']),
+        (1002, [], [u'あ'], [u'ah']),
+        (1003, [u'本'], [u'ほん'], [u'book']),
+    ]
+
+_new_entries = [
+        (1001, [u'日'], [u'ひ', u'にち'], [u'sun', u'day']),
+        (1003, [u'本'], [u'ほん'], [u'book']),
+        (1004, [], [u'いぬ'], [u'dog']),
+    ]
+
+class RefreshTest(TransactionTestCase):
+    def setUp(self):
+        consoleLog.default.oStream = sopen('/dev/null', 'w')
+        self.temp_dir = tempfile.mkdtemp()
+        load_lexicon._store_lexemes(load_lexicon._iter_entries(
+                self._write_jmdict(_old_entries)))
+
+    def test_refresh(self):
+        "Only changed rows are touched, and syllabus surfaces survive."
+        day = models.Lexeme.objects.get(ent_seq=1001)
+        day_surface = day.surface_set.get()
+        day_sense = day.sense_set.get()
+        extra_surface = day.surface_set.create(surface=u'ヒ',
+                has_kanji=False, in_lexicon=False)
+        book_sense = models.Lexeme.objects.get(ent_seq=1003).sense_set.get()
+
+        load_lexicon._refresh_lexemes(load_lexicon._iter_entries(
+                self._write_jmdict(_new_entries)))
+
+        self.assertEqual(models.Lexeme.objects.get(ent_seq=1001).id, day.id)
+        self.assertEqual(
+                sorted((s.id, s.surface, s.in_lexicon) for s in
+                        day.surface_set.all()),
+                sorted([(day_surface.id, u'日', True),
+                        (extra_surface.id, u'ヒ', False)]),
+            )
+        self.assertEqual(set(r.reading for r in day.reading_set.all()),
+                set([u'ひ', u'にち']))
+        senses = list(day.sense_set.order_by('id'))
+        self.assertEqual([(s.gloss, s.is_first_sense) for s in senses],
+                [(u'sun', True), (u'day', False)])
+        self.assertEqual(senses[0].id, day_sense.id)
+
+        self.assertFalse(models.Lexeme.objects.filter(ent_seq=1002).exists())
+        self.assertEqual(models.Lexeme.objects.get(ent_seq=1003
+                ).sense_set.get(), book_sense)
+        self.assertEqual(models.Lexeme.objects.get(ent_seq=1004
+                ).reading_set.get().reading, u'いぬ')
+
+    def test_missing_hashes(self):
+        "Lexemes stored without hashes get them, and keep their rows."
+        hashes = dict(models.Lexeme.objects.values_list('id', 'entry_hash'))
+        row_ids = self._get_row_ids()
+        models.Lexeme.objects.update(entry_hash=None)
+
+        load_lexicon._refresh_lexemes(load_lexicon._iter_entries(
+                self._write_jmdict(_old_entries)))
+
+        self.assertEqual(
+                dict(models.Lexeme.objects.values_list('id', 'entry_hash')),
+                hashes)
+        self.assertEqual(self._get_row_ids(), row_ids)
+
+    def _get_row_ids(self):
+        return [sorted(model.objects.values_list('id', flat=True)) for model \
+                in (models.LexemeSurface, models.LexemeReading,
+                    models.LexemeSense)]
+
+    def _write_jmdict(self, entries):
+        filename = tempfile.mktemp(suffix='.xml.gz', dir=self.temp_dir)
+        o_stream = gzip.open(filename, 'w')
+        print >> o_stream, '<?xml version="1.0" encoding="UTF-8"?>'
+        print >> o_stream, '<JMdict>'
+        for ent_seq, surfaces, readings, glosses in entries:
+            parts = ['<entry><ent_seq>%d</ent_seq>' % ent_seq]
+            parts.extend(u'<k_ele><keb>%s</keb></k_ele>' % s \
+                    for s in surfaces)
+            parts.extend(u'<r_ele><reb>%s</reb></r_ele>' % r \
+                    for r in readings)
+            parts.append(u'<sense>')
+            parts.extend(u'<gloss xml:lang="eng">%s</gloss>' % g \
+                    for g in glosses)
+            parts.append(u'</sense></entry>')
+            print >> o_stream, u''.join(parts).encode('utf8')
+        print >> o_stream, '</JMdict>'
+        o_stream.close()
+        return filename
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -10,8 +10,6 @@
 from django.core.exceptions import ObjectDoesNotExist
 
 from kanji_test.drill import plugin_api, support
-from kanji_test.lexicon import models as lexicon_models
-from kanji_test.user_model import models as usermodel_models
 from kanji_test import settings
 
 #----------------------------------------------------------------------------#
@@ -32,23 +30,20 @@ class ReadingQuestionFactory(plugin_api.MultipleChoiceFactoryI):
 
     def get_word_question(self, partial_lexeme, user):
         "See parent."
+        batch = self.get_batch(partial_lexeme, user)
         try:
-            surface = partial_lexeme.random_kanji_surface
+            surface = batch.random_surface(partial_lexeme, kanji_only=True)
         except ObjectDoesNotExist:
             raise plugin_api.UnsupportedItem(partial_lexeme)
 
-        answer = partial_lexeme.reading_set.all().order_by('?')[0].reading
+        answer = batch.random_reading(partial_lexeme)
         question = self.build_question(pivot=surface, pivot_type='w',
                 pivot_id=partial_lexeme.id, stimulus=surface,
                 annotation=u'|'.join(surface))
         segments = list(surface)
         # [339] Include homographs in real reading set
-        real_readings = set([
-                r.reading for r in lexicon_models.LexemeReading.objects.filter( 
-                        lexeme__surface_set__surface=surface)
-            ])
-        error_dist = usermodel_models.ErrorDist.objects.get(user=user,
-                tag=self.uses_dist)
+        real_readings = set(batch.homograph_readings(surface))
+        error_dist = batch.error_dist(self.uses_dist)
         distractor_values, annotation_map = support.build_word_options(
                 segments, error_dist, adaptive=self.is_adaptive,
                 exclude_set=real_readings)
@@ -58,15 +53,13 @@ class ReadingQuestionFactory(plugin_api.MultipleChoiceFactoryI):
 
     def get_kanji_question(self, partial_kanji, user):
         "See parent."
-        real_readings = set([r.reading for r in \
-                partial_kanji.kanji.reading_set.all()])
-        answer = partial_kanji.reading_set.order_by('?')[0].reading
-        kanji = partial_kanji.kanji.kanji
+        batch = self.get_batch(partial_kanji, user)
+        real_readings = set(batch.kanji_readings(partial_kanji))
+        answer = batch.random_reading(partial_kanji)
+        kanji = partial_kanji.kanji_id
         question = self.build_question(pivot=kanji, pivot_id=partial_kanji.id,
                 pivot_type='k', stimulus=kanji, annotation=kanji)
-        question.save()
-        error_dist = usermodel_models.ErrorDist.objects.get(user=user,
-                tag=self.uses_dist)
+        error_dist = batch.error_dist(self.uses_dist)
         distractor_values, annotation_map = support.build_kanji_options(kanji,
                 error_dist, adaptive=self.is_adaptive,
                 exclude_set=real_readings)
@@ -85,31 +78,31 @@ class SurfaceQuestionFactory(plugin_api.MultipleChoiceFactoryI):
     verbose_name = 'random surfaces'
 
     def get_kanji_question(self, partial_kanji, user):
-        kanji_row = partial_kanji.kanji
-        kanji = kanji_row.kanji
-        error_dist = user.errordist_set.get(tag=self.uses_dist)
+        batch = self.get_batch(partial_kanji, user)
+        kanji = partial_kanji.kanji_id
+        error_dist = batch.error_dist(self.uses_dist)
         distractors, _annotations = support.build_kanji_options(
                 kanji, error_dist, exclude_set=set([kanji]))
         question = self.build_question(
                 pivot=kanji,
                 pivot_id=partial_kanji.id,
                 pivot_type='k',
-                stimulus=kanji_row.gloss,
+                stimulus=batch.kanji_gloss(partial_kanji),
             )
         question.add_options(distractors, kanji)
         return question
         
     def get_word_question(self, partial_lexeme, user):
-        lexeme = partial_lexeme.lexeme
+        batch = self.get_batch(partial_lexeme, user)
         try:
-            surface = partial_lexeme.random_kanji_surface
+            surface = batch.random_surface(partial_lexeme, kanji_only=True)
         except ObjectDoesNotExist:
             raise plugin_api.UnsupportedItem(partial_lexeme)
 
         # Assume the first sense is the most frequent
-        gloss = lexeme.sense_set.get(is_first_sense=True).gloss
+        gloss = batch.first_gloss(partial_lexeme)
 
-        error_dist = user.errordist_set.get(tag=self.uses_dist)
+        error_dist = batch.error_dist(self.uses_dist)
         distractors, _annotations = support.build_word_options(
                 list(surface), error_dist, exclude_set=set([surface]))
         question = self.build_question(
@@ -131,53 +124,37 @@ class GlossQuestionFactory(plugin_api.MultipleChoiceFactoryI):
     is_adaptive = False
     verbose_name = 'random glosses'
 
+    # Prefer distractors which share words with the answer gloss.
+    rank_by_similarity = False
+
     def get_kanji_question(self, partial_kanji, user):
-        kanji_row = partial_kanji.kanji
-        answer = kanji_row.gloss
-        syllabus = user.get_profile().syllabus
-        distractor_values = set()
-        while len(distractor_values) < settings.N_DISTRACTORS:
-            for kanji in lexicon_models.Kanji.objects.filter(
-                        partialkanji__syllabus=syllabus
-                    ).order_by('?')[:settings.N_DISTRACTORS]:
-                distractor = kanji.gloss
-                if distractor != answer:
-                    distractor_values.add(distractor)
-                    if len(distractor_values) > settings.N_DISTRACTORS:
-                        break
-
-        distractor_values = list(distractor_values)
+        batch = self.get_batch(partial_kanji, user)
+        kanji = partial_kanji.kanji_id
+        answer = batch.kanji_gloss(partial_kanji)
+        distractor_values = batch.pools.kanji_gloss_index.sample(
+                settings.N_DISTRACTORS, answer=answer,
+                ranked=self.rank_by_similarity)
         question = self.build_question(
-                pivot=kanji_row.kanji,
+                pivot=kanji,
                 pivot_id=partial_kanji.id,
                 pivot_type='k',
-                stimulus=kanji_row.kanji,
+                stimulus=kanji,
             )
         question.add_options(distractor_values, answer)
         return question
     
     def get_word_question(self, partial_lexeme, user):
+        batch = self.get_batch(partial_lexeme, user)
         try:
-            surface = partial_lexeme.random_surface
+            surface = batch.random_surface(partial_lexeme)
         except ObjectDoesNotExist:
-            surface = partial_lexeme.random_reading
+            surface = batch.random_reading(partial_lexeme)
 
-        word_row = partial_lexeme.lexeme
-        
-        answer = word_row.first_sense.gloss
-        syllabus = user.get_profile().syllabus
-
-        distractor_values = set()
-        exclude_set = set(s.gloss for s in word_row.sense_set.all())
-        while len(distractor_values) < settings.N_DISTRACTORS:
-            for sense in syllabus.sample_senses(settings.N_DISTRACTORS):
-                gloss = sense.gloss
-                if gloss not in exclude_set:
-                    distractor_values.add(gloss)
-                    if len(distractor_values) == settings.N_DISTRACTORS:
-                        break
-
-        distractor_values = list(distractor_values)
+        answer = batch.first_gloss(partial_lexeme)
+        distractor_values = batch.pools.sense_gloss_index.sample(
+                settings.N_DISTRACTORS, exclude_set=batch.glosses(
+                    partial_lexeme), answer=answer,
+                ranked=self.rank_by_similarity)
         question = self.build_question(
                 pivot=surface,
                 pivot_id=partial_lexeme.id,
@@ -12,15 +12,16 @@ A django app for modelling kanji reading alternations.
 """
 
 import consoleLog
-from django.db import connection
 from django.conf import settings
+from simplestats.sequences import groups_of_n
 
 from kanji_test.user_model import plugin_api as usermodel_api
 from kanji_test.user_model import models as usermodel_models
 from kanji_test.drill import plugin_api as drill_api
 from kanji_test.drill import support
-from kanji_test.util.probability import ProbDist
+from kanji_test.util.probability import ProbDist, AliasTable
 from kanji_test.lexicon import models as lexicon_models
+from kanji_test.plugins.reading_alt import models as reading_models
 
 _log = consoleLog.default
 
@@ -30,7 +31,7 @@ class KanjiReadingModel(usermodel_api.SegmentedSeqPlugin):
     def __init__(self):
         pass
 
-    def init_priors(self, syllabus, force=False):
+    def init_priors(self, syllabus, force=False, n_jobs=None):
         _log.start('Building %s dist' % self.dist_name, nSteps=4)
 
         # Ensure the reading database is pre-built
@@ -39,21 +40,25 @@ class KanjiReadingModel(usermodel_api.SegmentedSeqPlugin):
 
         prior_dist, created = usermodel_models.PriorDist.objects.get_or_create(
                 tag=self.dist_name, syllabus=syllabus)
-        if not created:
-            if force:
-                prior_dist.density.all().delete()
-            else:
-                return
+        if not created and not force:
+            return
 
         _log.log('Fetching syllabus kanji')
         kanji_set = self._fetch_syllabus_kanji(syllabus)
 
-        _log.log('Storing readings')
-        self._import_readings(prior_dist, kanji_set)
+        _log.log('Loading readings')
+        cond_dist = self._load_readings(kanji_set)
 
         _log.start('Padding reading lists', nSteps=1)
-        self._pad_readings(prior_dist)
+        self._pad_readings(cond_dist)
         _log.finish()
+
+        _log.log('Storing readings')
+        prior_dist.store_rows(((condition, symbol,
+                    cond_dist[condition][symbol]) \
+                for condition in sorted(cond_dist) \
+                for symbol in sorted(cond_dist[condition])),
+                replace=True)
     
         _log.finish()
 
@@ -67,63 +72,58 @@ class KanjiReadingModel(usermodel_api.SegmentedSeqPlugin):
             )
         return kanji_set
 
-    def _import_readings(self, prior_dist, kanji_set):
-        "Copies the reading database directly into an prior distribution."
-        cursor = connection.cursor()
-        quote_name = connection.ops.quote_name
-        fields_a = ', '.join(map(quote_name, ['dist_id', 'condition',
-                'symbol', 'pdf', 'cdf']))
-        fields_b = ', '.join(map(quote_name, ['condition', 'symbol', 'pdf',
-                'cdf']))
-        fields_c = quote_name('condition')
-        cursor.execute("""
-                INSERT INTO user_model_priorpdf (%s)
-                SELECT %s as `dist_id`, %s
-                FROM reading_alt_kanjireading
-                WHERE %s IN (%s)
-            """ % (fields_a, str(prior_dist.id), fields_b, fields_c,
-                    u', '.join(u'"%s"' % k for k in kanji_set)))
-        cursor.execute('COMMIT')
-        return
-
-    def _pad_readings(self, prior_dist):
+    def _load_readings(self, kanji_set):
+        "Loads the reading database's distribution for each kanji."
+        cond_dist = {}
+        for kanji_group in groups_of_n(settings.N_ROWS_PER_INSERT,
+                sorted(kanji_set)):
+            for condition, symbol, pdf in \
+                    reading_models.KanjiReading.objects.filter(
+                        condition__in=kanji_group
+                    ).values_list('condition', 'symbol', 'pdf'):
+                cond_dist.setdefault(condition, {})[symbol] = pdf
+        return cond_dist
+
+    def _pad_readings(self, cond_dist):
         """
-        Once the reading distribution has been copied over, we still have the
+        Once the reading distribution has been loaded, we still have the
         problem that there may not be enough erroneous readings to meet the
         minimum number of distractors we wish to generate.
 
-        To circumvent this problem, we pad with random distractors.
+        To circumvent this problem, we pad with random distractors. The
+        valid readings of each kanji and the global reading distribution are
+        each loaded once, and padding is drawn from an alias table over the
+        global distribution. Each kanji's distribution is replaced in
+        cond_dist by its padded and normalised copy.
         """
         _log.log('Padding results ', newLine=False)
-        conditions = set(o['condition'] for o in \
-                prior_dist.density.all().values('condition'))
-        for (condition,) in consoleLog.withProgress(conditions):
-            exclude_set = set(
-                    o.reading for o in \
-                    lexicon_models.KanjiReading.objects.filter(
-                        kanji__kanji=condition)
-                )
-            n_stored = prior_dist.density.filter(condition=condition).exclude(
-                    symbol__in=exclude_set).count()
-
-            sub_dist = ProbDist.from_query_set(prior_dist.density.filter(
-                    condition=condition))
-            exclude_set.update(sub_dist.keys())
+        valid_readings = {}
+        for kanji, reading in lexicon_models.KanjiReading.objects.filter(
+                    kanji__in=cond_dist.keys()
+                ).values_list('kanji', 'reading'):
+            valid_readings.setdefault(kanji, set()).add(reading)
+
+        reading_table = AliasTable(dict(
+                lexicon_models.KanjiReadingProb.objects.values_list('symbol',
+                    'pdf')))
+
+        for condition in consoleLog.withProgress(sorted(cond_dist)):
+            sub_dist = ProbDist(cond_dist[condition])
+            exclude_set = valid_readings.get(condition, set())
+            n_stored = len([s for s in sub_dist if s not in exclude_set])
+
+            exclude_set = exclude_set.union(sub_dist)
             n_needed = settings.MIN_TOTAL_DISTRACTORS - n_stored
             min_prob = min(sub_dist.itervalues()) / 2
             while n_needed > 0:
-                for row in lexicon_models.KanjiReadingProb.sample_n(n_needed):
-                    if row.symbol not in exclude_set:
-                        sub_dist[row.symbol] = min_prob
-                        exclude_set.add(row.symbol)
-                        n_needed -= 1
-
-                    if n_needed == 0:
-                        break
+                symbol = reading_table.sample()
+                if symbol not in exclude_set:
+                    sub_dist[symbol] = min_prob
+                    exclude_set.add(symbol)
+                    n_needed -= 1
 
             sub_dist.normalise()
-            sub_dist.save_to(prior_dist.density, condition=condition)
-
+            cond_dist[condition] = sub_dist
         return
 
 #----------------------------------------------------------------------------#
@@ -144,55 +144,47 @@ class ReadingAlternationQuestions(drill_api.MultipleChoiceFactoryI):
 
     def get_word_question(self, partial_lexeme, user):
         "See parent."
+        batch = self.get_batch(partial_lexeme, user)
         try:
-            alignment = partial_lexeme.alignments.order_by('?')[0]
+            answer_reading, surface, alignment_obj = \
+                    batch.random_alignment(partial_lexeme)
         except IndexError:
             raise drill_api.UnsupportedItem(partial_lexeme)
 
-        error_dist = usermodel_models.ErrorDist.objects.get(user=user,
-                tag=self.uses_dist)
-        surface = alignment.surface.surface
+        error_dist = batch.error_dist(self.uses_dist)
 
         # [339] Include homographs in real reading set
-        exclude_set = set([
-                r.reading for r in lexicon_models.LexemeReading.objects.filter( 
-                        lexeme__surface_set__surface=surface)
-            ])
-
-        answer_reading = alignment.reading.reading
-        pivot = alignment.surface.surface
+        exclude_set = set(batch.homograph_readings(surface))
         assert answer_reading in exclude_set
+
         question = self.build_question(
-                pivot=pivot,
+                pivot=surface,
                 pivot_id=partial_lexeme.id,
                 pivot_type='w',
                 stimulus=surface,
+                annotation=u'|'.join(alignment_obj.g_segs),
             )
-        alignment_obj = alignment.alignment_obj
         distractors, annotation_map = support.build_word_options(
                 alignment_obj.g_segs, error_dist,
                 exclude_set=exclude_set)
         annotation_map[answer_reading] = u'|'.join(alignment_obj.p_segs)
         question.add_options(distractors, answer_reading,
                 annotation_map=annotation_map)
-        question.annotation = u'|'.join(alignment_obj.g_segs)
-        question.save()
         return question
             
     def get_kanji_question(self, partial_kanji, user):
         "See parent."
-        error_dist = usermodel_models.ErrorDist.objects.get(user=user,
-                tag=self.uses_dist)
-        exclude_set = set(row['reading'] for row in \
-                partial_kanji.kanji.reading_set.values('reading'))
-        answer = partial_kanji.reading_set.order_by('?').values(
-                'reading')[0]['reading']
-        kanji = partial_kanji.kanji.kanji
+        batch = self.get_batch(partial_kanji, user)
+        error_dist = batch.error_dist(self.uses_dist)
+        exclude_set = set(batch.kanji_readings(partial_kanji))
+        answer = batch.random_reading(partial_kanji)
+        kanji = partial_kanji.kanji_id
         question = self.build_question(
                 pivot=kanji,
                 pivot_id=partial_kanji.id,
                 pivot_type='k',
                 stimulus=kanji,
+                annotation=kanji,       # No segments
             )
         distractors, annotation_map = support.build_kanji_options(
                 kanji, error_dist, exclude_set=exclude_set,
@@ -200,8 +192,6 @@ class ReadingAlternationQuestions(drill_api.MultipleChoiceFactoryI):
         annotation_map[answer] = answer         # No segments
         question.add_options(distractors, answer,
                 annotation_map=annotation_map)
-        question.annotation = kanji             # No segments
-        question.save()
         return question
     
 # vim: ts=4 sw=4 sts=4 et tw=78:
@@ -17,6 +17,7 @@ from cjktools.common import sopen
 from cjktools import scripts
 
 from kanji_test.util.probability import ConditionalFreqDist
+from kanji_test.util import compiled_counts
 import raw_reading_model
 
 #----------------------------------------------------------------------------#
@@ -36,7 +37,7 @@ class VoicingAndGeminationModel(object):
 
     def __init__(self):
         # Loads up the frequency distribution for P(r*|k).
-        self.normalized_freq_dist = ConditionalFreqDist.from_file(
+        self.normalized_freq_dist = compiled_counts.load_cond_freq_dist(
                 _reading_counts_file)
 
         # Load up the alternation probabilities P(r|r*).
@@ -11,9 +11,9 @@
 Plugin for visual similarity.
 """
 
+import multiprocessing
+
 import consoleLog
-from simplestats.comb import iunique_pairs
-from cjktools.exceptions import DomainError
 from django.core.exceptions import ObjectDoesNotExist
 
 from kanji_test.user_model import plugin_api as user_model_api
@@ -24,23 +24,24 @@ from kanji_test.lexicon import models as lexicon_models
 from kanji_test import settings
 
 import metrics
+import neighbours
 import threshold_graph
 
 _default_metric_name = 'stroke edit distance'
 _log = consoleLog.default
 
+# More shards than jobs keeps the workers evenly loaded.
+_shards_per_job = 8
+
 class VisualSimilarity(user_model_api.SegmentedSeqPlugin):
     dist_name = "kanji' | kanji"
 
-    def init_priors(self, syllabus, force=False):
+    def init_priors(self, syllabus, force=False, n_jobs=None):
         prior_dist, created = syllabus.priordist_set.get_or_create(
                 tag=self.dist_name)
-        if not created:
-            if not force:
-                # Keep the existing distribution.
-                return
-
-            prior_dist.priorpdf_set.all().delete()
+        if not created and not force:
+            # Keep the existing distribution.
+            return
 
         _log.start("Building %s dist" % self.dist_name, nSteps=3)
 
@@ -50,52 +51,79 @@ class VisualSimilarity(user_model_api.SegmentedSeqPlugin):
             partialkanji__syllabus=syllabus)])
 
         _log.log('Generating similarity graph ', newLine=False)
-        graph = self._build_graph(kanji_set)
+        graph = self._build_graph(kanji_set, n_jobs)
 
         _log.log('Storing priors')
         self._store_graph(graph, prior_dist)
 
         _log.finish()
 
-    def _build_graph(self, kanji_set):
+    def _build_graph(self, kanji_set, n_jobs=None):
+        """
+        Builds the similarity graph over the given kanji. The pairs are
+        sharded by row, and with more than one job the shards are built in
+        a pool of worker processes and merged, giving the same graph as a
+        serial build. Pairs which can't be among either kanji's nearest
+        neighbours are pruned without being compared.
+
+        If N_CACHED_NEIGHBOURS is set, links are instead taken from the
+        cached nearest neighbours of every kanji, which are computed once
+        and reused across syllabi.
+        """
+        n_jobs = n_jobs or settings.N_GRAPH_JOBS
         metric = metrics.metric_library[_default_metric_name]
-        graph = threshold_graph.ThresholdGraph(settings.MAX_GRAPH_DEGREE)
-        ignore_set = set()
-        for kanji_a, kanji_b in consoleLog.withProgress(
-                    iunique_pairs(kanji_set), 100):
-            if kanji_a in ignore_set or kanji_b in ignore_set:
-                continue
 
-            try:
-                weight = metric(kanji_a, kanji_b)
-            except DomainError, e:
-                kanji = e.message
-                ignore_set.add(kanji)
-                continue
+        # Kanji without a stroke signature get no links to other kanji.
+        kanji_list = sorted(k for k in kanji_set if k in metric.signatures)
 
-            graph.connect(kanji_a, kanji_b, weight)
+        if settings.N_CACHED_NEIGHBOURS:
+            cache = neighbours.NeighbourCache.get(metric,
+                    settings.N_CACHED_NEIGHBOURS)
+            graph = cache.build_graph(kanji_list, settings.MAX_GRAPH_DEGREE)
+        else:
+            graph = self._build_links(kanji_list, n_jobs)
 
         for kanji in kanji_set:
             graph.connect(kanji, kanji, 0.0)
 
         return graph
 
+    def _build_links(self, kanji_list, n_jobs):
+        if n_jobs <= 1:
+            # A single shard keeps the thresholds from every pair, so it
+            # prunes the most.
+            return _build_shard((kanji_list, 0, 1))
+
+        n_shards = min(max(1, len(kanji_list)), n_jobs * _shards_per_job)
+        shards = [(kanji_list, i, n_shards) for i in xrange(n_shards)]
+        graph = threshold_graph.ThresholdGraph(settings.MAX_GRAPH_DEGREE)
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            for shard_graph in consoleLog.withProgress(
+                    pool.imap_unordered(_build_shard, shards), 1):
+                graph.merge(shard_graph)
+        except:
+            pool.terminate()
+            pool.join()
+            raise
+
+        pool.close()
+        pool.join()
+        return graph
+
     def _store_graph(self, graph, prior_dist):
-        for label, edge_seq in graph._heaps.iteritems():
-            total_weight = 0.0
-            for weight, neighbour_label in edge_seq:
-                total_weight += 1.0 - weight
-
-            cdf = 0.0
-            for weight, neighbour_label in edge_seq:
-                pdf = (1.0 - weight) / total_weight
-                cdf += pdf
-                prior_dist.density.create(
-                        condition=label,
-                        symbol=neighbour_label,
-                        pdf=pdf,
-                        cdf=cdf,
-                    )
+        prior_dist.store_rows(graph.normalised_edges(), replace=True)
+
+def _build_shard(shard):
+    """
+    Builds the part of the similarity graph for every pair whose first kanji
+    (in the neighbour index's order) has an index congruent to i_shard. Run
+    in a worker process.
+    """
+    kanji_list, i_shard, n_shards = shard
+    metric = metrics.metric_library[_default_metric_name]
+    index = neighbours.NeighbourIndex(metric, kanji_list)
+    return index.build_graph(settings.MAX_GRAPH_DEGREE, i_shard, n_shards)
 
 #----------------------------------------------------------------------------#
 
@@ -108,40 +136,39 @@ class VisualSimilarityDrills(drill_api.MultipleChoiceFactoryI):
     verbose_name = 'visual similarity'
 
     def get_kanji_question(self, partial_kanji, user):
-        self.error_dist = usermodel_models.ErrorDist.objects.get(user=user,
-                tag=self.uses_dist)
-
-        kanji_row = partial_kanji.kanji
-        kanji = kanji_row.kanji
+        batch = self.get_batch(partial_kanji, user)
+        kanji = partial_kanji.kanji_id
         question = self.build_question(
                 pivot=kanji,
                 pivot_id=partial_kanji.id,
                 pivot_type='k',
-                stimulus=kanji_row.gloss,
+                stimulus=batch.kanji_gloss(partial_kanji),
+                annotation=kanji,
             )
-        self._add_distractors(question, user)
+        self._add_distractors(question, batch)
         return question
         
     def get_word_question(self, partial_lexeme, user):
-        lexeme = partial_lexeme.lexeme
+        batch = self.get_batch(partial_lexeme, user)
         try:
-            surface = partial_lexeme.random_kanji_surface
+            surface = batch.random_surface(partial_lexeme, kanji_only=True)
         except ObjectDoesNotExist:
             raise drill_api.UnsupportedItem(partial_lexeme)
 
         # Assume the first sense is the dominant sense
-        gloss = lexeme.sense_set.get(is_first_sense=True).gloss
+        gloss = batch.first_gloss(partial_lexeme)
 
         question = self.build_question(
                 pivot=surface,
                 pivot_id=partial_lexeme.id,
                 pivot_type='w',
                 stimulus=gloss,
+                annotation=u'|'.join(surface),
             )
-        self._add_distractors(question, user)
+        self._add_distractors(question, batch)
         return question
 
-    def _add_distractors(self, question, user):
+    def _add_distractors(self, question, batch):
         """
         Builds distractors for the question with appropriate annotations so
         that we can easily update the error model afterwards.   
@@ -150,7 +177,7 @@ class VisualSimilarityDrills(drill_api.MultipleChoiceFactoryI):
         since the richer GP segments need not be supported by this error
         distribution.
         """
-        error_dist = user.errordist_set.get(tag=self.uses_dist)
+        error_dist = batch.error_dist(self.uses_dist)
         pivot = question.pivot
         segments = list(pivot) # Simple segments
         if question.pivot_type == 'w':
@@ -162,6 +189,4 @@ class VisualSimilarityDrills(drill_api.MultipleChoiceFactoryI):
         annotation_map[pivot] = u'|'.join(segments)
         question.add_options(distractors, question.pivot,
                 annotation_map=annotation_map)
-        question.annotation = u'|'.join(segments)
-        question.save()
         return
@@ -1,110 +1,291 @@
-# 
+#
 #  stroke.pyx
 #  kanji_test
-#  
+#
 #  Created by Lars Yencken on 2008-09-15.
 #  Copyright 2008 Lars Yencken. All rights reserved.
-# 
+#
 
 """
 Optimised Levenstein distance calculation between stroke signatures for two
 kanji.
+
+Signatures are compiled into a single binary block: a header, the offsets
+and lengths of each kanji's signature, every signature end to end, and
+finally the kanji and stroke type names as utf8 text. The block is cached on
+disk keyed by a checksum of the strokes file, and memory-mapped on load.
 """
 
 #----------------------------------------------------------------------------#
 
 import os
+import heapq
+import mmap
+import struct
+from array import array
 
 from cjktools.exceptions import DomainError
 from cjktools.common import sopen
 
 from kanji_test import settings
+from kanji_test.util import data_cache
 
 #----------------------------------------------------------------------------#
 
+cdef extern from "stdlib.h":
+    void *malloc(int size)
+    void free(void *ptr)
+
+cdef extern from "Python.h":
+    ctypedef int Py_ssize_t
+    int PyObject_AsReadBuffer(object obj, void **buffer,
+            Py_ssize_t *buffer_len) except -1
+
 _strokes_file = os.path.join(settings.DATA_DIR, 'structure', 'strokes_ulrich')
 
+_magic = 0x4b525453 # 'STRK'
+_header_format = '4i'
+
 cdef class StrokeEditDistance:
-    """The edit distance between stroke sequences for both kanji."""
-    cdef readonly signatures
+    """
+    The edit distance between stroke sequences for both kanji. Signatures
+    are packed end to end into a single C buffer, so that distances from one
+    kanji to many others can be computed without touching Python objects.
+    """
+    cdef readonly object source_file
+    cdef readonly object kanji
     cdef readonly object stroke_types
     cdef readonly int n_stroke_types
+    cdef readonly object indices
+    cdef object _data
+    cdef object _signatures
+    cdef int *strokes
+    cdef int *offsets
+    cdef int *lengths
+    cdef int *row
+
+    def __init__(self, use_cache=True):
+        self.source_file = _strokes_file
+        data = None
+        if use_cache:
+            cache_file = data_cache.cache_path(_strokes_file, '.strokes')
+            data = _load_cached(cache_file)
+
+        if data is None:
+            data = compile_signatures(_strokes_file)
+            if use_cache:
+                data_cache.store(cache_file, data)
+
+        self._attach(data)
 
-    def __init__(self):
+    def __dealloc__(self):
+        free(self.row)
+
+    cdef _attach(self, data):
+        "Points our arrays into a compiled block of signatures."
+        cdef void *buffer
+        cdef Py_ssize_t buffer_len
+        cdef int *header
+        cdef int i, n_kanji, n_strokes, n_text, text_start, max_length
+
+        PyObject_AsReadBuffer(data, &buffer, &buffer_len)
+        if buffer_len < struct.calcsize(_header_format):
+            raise ValueError, 'bad stroke signature data'
+        header = <int *> buffer
+        n_kanji = header[1]
+        n_strokes = header[2]
+        n_text = header[3]
+        text_start = sizeof(int) * (4 + 2 * n_kanji + n_strokes)
+        if header[0] != _magic or buffer_len != text_start + n_text:
+            raise ValueError, 'bad stroke signature data'
+
+        self._data = data
+        self.offsets = header + 4
+        self.lengths = self.offsets + n_kanji
+        self.strokes = self.lengths + n_kanji
+
+        kanji_text, type_text = data[text_start:text_start + n_text].decode(
+                'utf8').split(u'\0')
+        self.kanji = kanji_text.split(u'\n')
+        self.indices = {}
+        for i from 0 <= i < n_kanji:
+            self.indices[self.kanji[i]] = i
         self.stroke_types = {}
-        self.n_stroke_types = 0
-
-        # Convert stroke sequence to integer sequences by constructing a 
-        # mapping from stroke types to integers.
-        self.signatures = {}
-        i_stream = sopen(_strokes_file)
-        for i, line in enumerate(i_stream):
-            kanji, raw_strokes = line.rstrip().split()
-            raw_strokes = raw_strokes.split(',')
-            strokes = []
-            for raw_stroke in raw_strokes:
-                strokes.append(self._get_stroke_type(raw_stroke))
-            self.signatures[kanji] = strokes
-        i_stream.close()
+        for stroke_type_name in type_text.split(u'\n'):
+            self.stroke_types[stroke_type_name] = len(self.stroke_types)
+        self.n_stroke_types = len(self.stroke_types)
 
-    cdef _get_stroke_type(self, stroke):
-        try:
-            return self.stroke_types[stroke]
-        except KeyError:
-            pass
+        max_length = 0
+        for i from 0 <= i < n_kanji:
+            if self.lengths[i] > max_length:
+                max_length = self.lengths[i]
+        self.row = <int *> malloc(sizeof(int) * (max_length + 1))
+        if self.row == NULL:
+            raise MemoryError
 
-        self.stroke_types[stroke] = self.n_stroke_types
-        self.n_stroke_types = self.n_stroke_types + 1
+    property signatures:
+        "A dictionary mapping each kanji to its list of stroke types."
+        def __get__(self):
+            cdef int i, j
+            if self._signatures is None:
+                signatures = {}
+                for i from 0 <= i < len(self.kanji):
+                    signature = []
+                    for j from 0 <= j < self.lengths[i]:
+                        signature.append(self.strokes[self.offsets[i] + j])
+                    signatures[self.kanji[i]] = signature
+                self._signatures = signatures
+            return self._signatures
+
+    #------------------------------------------------------------------------#
+    # Pairwise distances
+    #------------------------------------------------------------------------#
 
-        return self.n_stroke_types - 1
-    
     def raw_distance(self, kanji_a, kanji_b):
+        return self._raw_distance(self._index(kanji_a), self._index(kanji_b))
+
+    def __call__(self, kanji_a, kanji_b):
+        return self._distance(self._index(kanji_a), self._index(kanji_b))
+
+    #------------------------------------------------------------------------#
+    # Batch distances
+    #------------------------------------------------------------------------#
+
+    def distances_from(self, kanji, candidates, raw=False):
+        """
+        Returns the list of distances from the kanji to each candidate, in
+        the same order as the candidates.
+        """
+        cdef int i, j, n
+        cdef int *candidate_indices
+
+        i = self._index(kanji)
+        n = len(candidates)
+        candidate_indices = self._lookup(candidates)
+        result = []
         try:
-            s_py = self.signatures[kanji_a]
-            t_py = self.signatures[kanji_b]
-        except KeyError, e:
-            raise DomainError, e
+            for j from 0 <= j < n:
+                if raw:
+                    result.append(self._raw_distance(i,
+                            candidate_indices[j]))
+                else:
+                    result.append(self._distance(i, candidate_indices[j]))
+        finally:
+            free(candidate_indices)
 
-        return edit_distance(s_py, t_py)
+        return result
 
-    def __call__(self, kanji_a, kanji_b):
+    def distance_matrix(self, kanji_seq_a, kanji_seq_b, raw=False):
+        """
+        Returns the block of distances between two sequences of kanji, as a
+        list of rows, one for each kanji in the first sequence.
+        """
+        cdef int i, j, n_a, n_b
+        cdef int *indices_a
+        cdef int *indices_b
+
+        n_a = len(kanji_seq_a)
+        n_b = len(kanji_seq_b)
+        indices_a = self._lookup(kanji_seq_a)
+        try:
+            indices_b = self._lookup(kanji_seq_b)
+        except:
+            free(indices_a)
+            raise
+
+        matrix = []
         try:
-            s_py = self.signatures[kanji_a]
-            t_py = self.signatures[kanji_b]
+            for i from 0 <= i < n_a:
+                row = []
+                for j from 0 <= j < n_b:
+                    if raw:
+                        row.append(self._raw_distance(indices_a[i],
+                                indices_b[j]))
+                    else:
+                        row.append(self._distance(indices_a[i],
+                                indices_b[j]))
+                matrix.append(row)
+        finally:
+            free(indices_a)
+            free(indices_b)
+
+        return matrix
+
+    def nearest_neighbours(self, kanji, candidates, n):
+        """
+        Returns the n candidates closest to the kanji, as a sorted list of
+        (distance, candidate) pairs.
+        """
+        candidates = list(candidates)
+        return heapq.nsmallest(n, zip(self.distances_from(kanji,
+                candidates), candidates))
+
+    #------------------------------------------------------------------------#
+
+    def _index(self, kanji):
+        try:
+            return self.indices[kanji]
         except KeyError, e:
             raise DomainError, e
 
-        result = edit_distance(s_py, t_py)
-        return float(result) / max(len(s_py), len(t_py))
+    cdef int *_lookup(self, kanji_seq) except NULL:
+        "Returns a newly allocated array of indices for the kanji given."
+        cdef int i, n
+        cdef int *result
+
+        kanji_seq = list(kanji_seq)
+        n = len(kanji_seq)
+        result = <int *> malloc(sizeof(int) * (n + 1))
+        if result == NULL:
+            raise MemoryError
+        try:
+            for i from 0 <= i < n:
+                result[i] = self._index(kanji_seq[i])
+        except:
+            free(result)
+            raise
+
+        return result
+
+    cdef int _raw_distance(self, int i, int j):
+        return edit_distance(self.strokes + self.offsets[i], self.lengths[i],
+                self.strokes + self.offsets[j], self.lengths[j], self.row)
+
+    cdef double _distance(self, int i, int j):
+        cdef int max_length
+        max_length = self.lengths[i]
+        if self.lengths[j] > max_length:
+            max_length = self.lengths[j]
+        return <double> self._raw_distance(i, j) / max_length
 
 #----------------------------------------------------------------------------#
 
-cdef edit_distance(s_py, t_py):
-    cdef int m, n, i, j
-    cdef int table[50][50]
-    cdef int s[50]
-    cdef int t[50]
-    cdef int up, left, diag, cost
-
-    s_len = len(s_py)
-    t_len = len(t_py)
-    if s_len > 49 or t_len > 49:
-        raise ValueError, "stroke sequences too long"
-
-    # Copy s_py to s
-    for i from 0 <= i < s_len:
-        table[i][0] = i
-        s[i] = s_py[i]
-    table[s_len][0] = s_len
-
-    # Copy t_py to t
-    for j from 0 <= j < t_len:
-        table[0][j] = j
-        t[j] = t_py[j]
-    table[0][t_len] = t_len
-
-    # Perform edit distance
+cdef int edit_distance(int *s, int s_len, int *t, int t_len, int *row):
+    """
+    The Levenstein distance between two stroke sequences, keeping a single
+    row of the table over the shorter sequence. The row must have space for
+    at least min(s_len, t_len) + 1 entries.
+    """
+    cdef int i, j, up, left, diag, cost, previous
+    cdef int *tmp
+
+    # Make t the shorter sequence
+    if t_len > s_len:
+        tmp = s
+        s = t
+        t = tmp
+        i = s_len
+        s_len = t_len
+        t_len = i
+
+    for j from 0 <= j <= t_len:
+        row[j] = j
+
+    # Perform edit distance; row[j] holds table[i-1][j] until overwritten
+    # with table[i][j], and diag holds table[i-1][j-1].
     for i from 1 <= i <= s_len:
+        diag = row[0]
+        row[0] = i
         for j from 1 <= j <= t_len:
             if s[i-1] == t[j-1]:
                 cost = 0
@@ -113,20 +294,84 @@ cdef edit_distance(s_py, t_py):
                 cost = 1
 
             # table[i][j] = min(up, left, diag)
-            up = table[i-1][j] + 1
-            left = table[i][j-1] + 1
-            diag = table[i-1][j-1] + cost
+            previous = row[j]
+            up = previous + 1
+            left = row[j-1] + 1
+            diag = diag + cost
             if up <= left:
                 if up <= diag:
-                    table[i][j] = up
+                    row[j] = up
                 else:
-                    table[i][j] = diag
+                    row[j] = diag
             else:
                 if left <= diag:
-                    table[i][j] = left
+                    row[j] = left
                 else:
-                    table[i][j] = diag
+                    row[j] = diag
+            diag = previous
+
+    return row[t_len]
+
+#----------------------------------------------------------------------------#
+
+def compile_signatures(filename):
+    """
+    Parses a strokes file, converting each stroke sequence to an integer
+    sequence by constructing a mapping from stroke types to integers, and
+    returns the compiled block of signatures.
+    """
+    stroke_types = {}
+    stroke_type_names = []
+    signatures = {}
+    i_stream = sopen(filename)
+    for line in i_stream:
+        kanji, raw_strokes = line.rstrip().split()
+        signature = []
+        for raw_stroke in raw_strokes.split(','):
+            stroke_type = stroke_types.get(raw_stroke)
+            if stroke_type is None:
+                stroke_type = stroke_types[raw_stroke] = len(stroke_types)
+                stroke_type_names.append(raw_stroke)
+            signature.append(stroke_type)
+        signatures[kanji] = signature
+    i_stream.close()
+
+    kanji_list = sorted(signatures)
+    offsets = array('i')
+    lengths = array('i')
+    strokes = array('i')
+    for kanji in kanji_list:
+        offsets.append(len(strokes))
+        lengths.append(len(signatures[kanji]))
+        strokes.extend(signatures[kanji])
+
+    text = (u'\n'.join(kanji_list) + u'\0' + u'\n'.join(stroke_type_names)
+            ).encode('utf8')
+    header = struct.pack(_header_format, _magic, len(kanji_list),
+            len(strokes), len(text))
+    return ''.join([header, offsets.tostring(), lengths.tostring(),
+            strokes.tostring(), text])
+
+def _load_cached(filename):
+    "Memory-maps a cached block of signatures, or returns None."
+    try:
+        i_stream = open(filename, 'rb')
+    except IOError:
+        return None
+
+    try:
+        try:
+            data = mmap.mmap(i_stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            return None
+    finally:
+        i_stream.close()
+
+    if len(data) < struct.calcsize(_header_format) or \
+            struct.unpack(_header_format,
+                data[:struct.calcsize(_header_format)])[0] != _magic:
+        return None
 
-    return table[s_len][t_len]
+    return data
 
 #----------------------------------------------------------------------------#
@@ -58,6 +58,25 @@ class StrokeTestCase(unittest.TestCase):
         self.assertAlmostEqual(0.4, self.dist(shiro, me))
         self.assertAlmostEqual(0.4, self.dist(me, shiro))
     
+    def testBatch(self):
+        """Checks the batch methods against pairwise distances."""
+        kanji = [u'日', u'目', u'白', u'木', u'森']
+        for raw in (False, True):
+            if raw:
+                pairwise = self.dist.raw_distance
+            else:
+                pairwise = self.dist
+            matrix = self.dist.distance_matrix(kanji, kanji, raw=raw)
+            for kanji_a, row in zip(kanji, matrix):
+                self.assertEqual(row, self.dist.distances_from(kanji_a,
+                        kanji, raw=raw))
+                for kanji_b, distance in zip(kanji, row):
+                    self.assertEqual(pairwise(kanji_a, kanji_b), distance)
+
+        neighbours = self.dist.nearest_neighbours(u'日', kanji, 3)
+        self.assertEqual([(0.0, u'日'), (0.2, u'白'), (0.2, u'目')],
+                neighbours)
+
     def tearDown(self):
         pass
 
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+#  neighbours.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-12.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+"""
+Pruned nearest neighbour search over stroke signatures. The stroke edit
+distance between two kanji is at least the number of strokes of some type
+which one has and the other lacks, so comparing stroke type histograms
+gives a cheap lower bound on it. Pairs whose bound shows they can't make
+the nearest neighbours of either kanji are never compared.
+"""
+
+import heapq
+import struct
+import itertools
+from array import array
+
+import consoleLog
+import numpy
+
+from kanji_test.util import data_cache
+
+import threshold_graph
+
+_log = consoleLog.default
+
+class NeighbourIndex(object):
+    """
+    Stroke length and stroke type histograms for a set of kanji, ordered by
+    length, used to find nearest neighbours under a stroke edit distance.
+    """
+    def __init__(self, metric, kanji_seq):
+        self.metric = metric
+        signatures = metric.signatures
+        self.kanji = sorted((k for k in kanji_seq if k in signatures),
+                key=lambda k: (len(signatures[k]), k))
+        self._positions = dict((k, i) for (i, k) in enumerate(self.kanji))
+
+        self.lengths = numpy.array([len(signatures[k]) for k in self.kanji],
+                dtype=float)
+        self.histograms = numpy.zeros((len(self.kanji),
+                metric.n_stroke_types), dtype=int)
+        for i, kanji in enumerate(self.kanji):
+            for stroke_type in signatures[kanji]:
+                self.histograms[i, stroke_type] += 1
+
+    def __len__(self):
+        return len(self.kanji)
+
+    def build_graph(self, max_degree, i_shard=0, n_shards=1):
+        """
+        Builds the graph of each kanji's max_degree nearest neighbours. Only
+        pairs whose earlier kanji (in length order) falls in the given shard
+        are considered, so that shards can be built separately and merged.
+
+        The links kept are exactly those of comparing every pair, but the
+        graph's link statistics only count the pairs actually compared.
+        """
+        graph = threshold_graph.ThresholdGraph(max_degree)
+        n = len(self.kanji)
+        thresholds = numpy.empty(n)
+        thresholds.fill(numpy.inf)
+        for i in xrange(i_shard, n, n_shards):
+            # Candidates are no shorter than this kanji, so the length bound
+            # only limits how long they can be.
+            end = n
+            max_threshold = thresholds.max()
+            if max_threshold < 1.0:
+                max_length = self.lengths[i] / (1.0 - max_threshold) + 1e-6
+                end = numpy.searchsorted(self.lengths, max_length,
+                        side='right')
+            candidates = numpy.arange(i + 1, end)
+            if not len(candidates):
+                continue
+
+            bounds = self._lower_bounds(i, candidates)
+            order = numpy.argsort(bounds, kind='mergesort')
+            candidates = candidates[order]
+            bounds = bounds[order]
+
+            # Fill this kanji's links from its most promising candidates,
+            # then compare only those which could still be kept at either
+            # end.
+            self._connect(graph, thresholds, i, candidates[:max_degree])
+            candidates = candidates[max_degree:]
+            bounds = bounds[max_degree:]
+            is_needed = (bounds <= thresholds[i]) | \
+                    (bounds <= thresholds[candidates])
+            self._connect(graph, thresholds, i, candidates[is_needed])
+
+        return graph
+
+    def nearest(self, kanji, n, ties=False):
+        """
+        Returns the n kanji nearest to the given one, as a sorted list of
+        (distance, kanji) pairs. If ties is set, any further kanji as near
+        as the nth are also returned.
+        """
+        i = self._positions[kanji]
+        candidates = numpy.array([j for j in xrange(len(self.kanji)) \
+                if j != i], dtype=int)
+        if not len(candidates):
+            return []
+
+        bounds = self._lower_bounds(i, candidates)
+        order = numpy.argsort(bounds, kind='mergesort')
+        candidates = candidates[order]
+        bounds = bounds[order]
+
+        nearest = self._distances(i, candidates[:n])
+        if len(nearest) == n:
+            worst = max(nearest)[0]
+            nearest.extend(self._distances(i,
+                    candidates[n:][bounds[n:] <= worst]))
+
+        if ties and len(nearest) > n:
+            nearest.sort()
+            worst = nearest[n - 1][0]
+            return [(d, k) for (d, k) in nearest if d <= worst]
+        return heapq.nsmallest(n, nearest)
+
+    #------------------------------------------------------------------------#
+
+    def _lower_bounds(self, i, candidates):
+        """
+        Lower bounds on the distance from the ith kanji to each candidate.
+        Every edit fixes at most one stroke missing from a signature and one
+        stroke in excess of it, so the distance is at least the larger of
+        the two counts.
+        """
+        diff = self.histograms[candidates] - self.histograms[i]
+        n_edits = numpy.maximum(numpy.maximum(diff, 0).sum(axis=1),
+                numpy.maximum(-diff, 0).sum(axis=1))
+        return n_edits / numpy.maximum(self.lengths[candidates],
+                self.lengths[i])
+
+    def _distances(self, i, candidates):
+        neighbours = [self.kanji[j] for j in candidates]
+        return zip(self.metric.distances_from(self.kanji[i], neighbours),
+                neighbours)
+
+    def _connect(self, graph, thresholds, i, candidates):
+        kanji = self.kanji[i]
+        for j, (weight, neighbour) in itertools.izip(candidates,
+                self._distances(i, candidates)):
+            graph.connect(kanji, neighbour, weight)
+            thresholds[j] = graph[neighbour].threshold()
+        thresholds[i] = graph[kanji].threshold()
+
+#----------------------------------------------------------------------------#
+
+class NeighbourCache(object):
+    """
+    The nearest neighbours of every kanji with a stroke signature, cached on
+    disk. Each kanji's neighbours include any ties with its furthest one,
+    so they are exactly the kanji within some distance of it. Its links
+    within any kanji set are then recovered exactly from the cache whenever
+    enough of its neighbours fall in that set.
+
+    The cache file holds a header, the offset of each kanji's neighbours,
+    then the neighbours and their distances, and is memory-mapped on load.
+    Kanji are numbered as in the metric's signature data, and the file is
+    keyed by the same checksum.
+    """
+    magic = 0x5352424e # 'NBRS'
+    header_format = '4i'
+
+    def __init__(self, metric, offsets, neighbours, distances):
+        self.metric = metric
+        self.offsets = offsets
+        self.neighbours = neighbours
+        self.distances = distances
+
+    @classmethod
+    def get(cls, metric, n_neighbours):
+        "Loads the cache for this metric, building it if necessary."
+        filename = data_cache.cache_path(metric.source_file, '.neighbours',
+                n_neighbours)
+        cache = cls.load(metric, filename)
+        if cache is None:
+            cache = cls.build(metric, n_neighbours)
+            data_cache.store(filename, cache.to_string())
+        return cache
+
+    @classmethod
+    def load(cls, metric, filename):
+        "Memory-maps a stored cache, or returns None if there isn't one."
+        header_size = struct.calcsize(cls.header_format)
+        try:
+            i_stream = open(filename, 'rb')
+            try:
+                header = i_stream.read(header_size)
+            finally:
+                i_stream.close()
+        except IOError:
+            return None
+
+        if len(header) < header_size:
+            return None
+        magic, n_kanji, n_links, _n_neighbours = struct.unpack(
+                cls.header_format, header)
+        if magic != cls.magic or n_kanji != len(metric.kanji):
+            return None
+
+        offset = header_size
+        offsets = numpy.memmap(filename, dtype=numpy.int32, mode='r',
+                offset=offset, shape=(n_kanji + 1,))
+        offset += offsets.nbytes
+        neighbours = numpy.memmap(filename, dtype=numpy.int32, mode='r',
+                offset=offset, shape=(n_links,))
+        offset += neighbours.nbytes
+        distances = numpy.memmap(filename, dtype=numpy.float64, mode='r',
+                offset=offset, shape=(n_links,))
+        return cls(metric, offsets, neighbours, distances)
+
+    @classmethod
+    def build(cls, metric, n_neighbours):
+        "Finds the nearest neighbours of every kanji."
+        index = NeighbourIndex(metric, metric.kanji)
+        offsets = array('i', [0])
+        neighbours = array('i')
+        distances = array('d')
+        _log.start('Caching %d nearest neighbours' % n_neighbours)
+        _log.log('Searching ', newLine=False)
+        for kanji in consoleLog.withProgress(metric.kanji, 100):
+            for distance, neighbour in index.nearest(kanji, n_neighbours,
+                    ties=True):
+                neighbours.append(metric.indices[neighbour])
+                distances.append(distance)
+            offsets.append(len(neighbours))
+        _log.finish()
+
+        return cls(metric, numpy.frombuffer(offsets, dtype=numpy.int32),
+                numpy.frombuffer(neighbours, dtype=numpy.int32),
+                numpy.frombuffer(distances, dtype=numpy.float64))
+
+    def to_string(self):
+        "Returns the cache in its stored form."
+        n_neighbours = 0
+        if len(self.offsets) > 1:
+            n_neighbours = int(numpy.diff(self.offsets).min())
+        header = struct.pack(self.header_format, self.magic,
+                len(self.offsets) - 1, len(self.neighbours), n_neighbours)
+        return ''.join([header, self.offsets.tostring(),
+                self.neighbours.tostring(), self.distances.tostring()])
+
+    def build_graph(self, kanji_list, max_degree):
+        """
+        Builds the graph of each kanji's max_degree nearest neighbours within
+        the given kanji, searching afresh for any kanji which doesn't have
+        enough of its cached neighbours amongst them.
+        """
+        graph = threshold_graph.ThresholdGraph(max_degree)
+        kanji_set = set(kanji_list)
+        all_kanji = self.metric.kanji
+        missing = []
+        for kanji in kanji_list:
+            i = self.metric.indices[kanji]
+            start, end = self.offsets[i], self.offsets[i + 1]
+            links = [(all_kanji[j], float(d)) for (j, d) in itertools.izip(
+                    self.neighbours[start:end], self.distances[start:end]) \
+                    if all_kanji[j] in kanji_set]
+            if len(links) < max_degree:
+                missing.append(kanji)
+                continue
+
+            for neighbour, weight in links:
+                graph[kanji].add(neighbour, weight)
+
+        if missing:
+            index = NeighbourIndex(self.metric, kanji_list)
+            for kanji in missing:
+                for weight, neighbour in index.nearest(kanji, max_degree,
+                        ties=True):
+                    graph[kanji].add(neighbour, weight)
+
+        return graph
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
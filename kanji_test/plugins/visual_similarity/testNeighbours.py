@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+#  testNeighbours.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-12.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+import unittest
+
+from simplestats.comb import iunique_pairs
+
+from metrics import stroke
+import neighbours
+import threshold_graph
+
+#----------------------------------------------------------------------------#
+
+def suite():
+    testSuite = unittest.TestSuite((
+            unittest.makeSuite(NeighbourIndexTestCase),
+        ))
+    return testSuite
+
+#----------------------------------------------------------------------------#
+
+class NeighbourIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.metric = stroke.StrokeEditDistance()
+        self.kanji = sorted(self.metric.signatures)[:300]
+        self.index = neighbours.NeighbourIndex(self.metric, self.kanji)
+
+    def testGraph(self):
+        """Checks that pruning keeps exactly the links of a full build."""
+        expected = threshold_graph.ThresholdGraph(5)
+        for kanji_a, kanji_b in iunique_pairs(self.kanji):
+            expected.connect(kanji_a, kanji_b, self.metric(kanji_a, kanji_b))
+
+        for n_shards in (1, 3):
+            graph = threshold_graph.ThresholdGraph(5)
+            for i_shard in xrange(n_shards):
+                graph.merge(self.index.build_graph(5, i_shard, n_shards))
+            for kanji in self.kanji:
+                self.assertEqual(sorted(expected[kanji]),
+                        sorted(graph[kanji]))
+
+    def testNearest(self):
+        """Compares nearest neighbours against a brute force search."""
+        for kanji in self.kanji[:20]:
+            others = [k for k in self.kanji if k != kanji]
+            self.assertEqual(
+                    self.metric.nearest_neighbours(kanji, others, 5),
+                    self.index.nearest(kanji, 5),
+                )
+
+    def tearDown(self):
+        pass
+
+#----------------------------------------------------------------------------#
+
+if __name__ == "__main__":
+    unittest.TextTestRunner(verbosity=1).run(suite())
+
+#----------------------------------------------------------------------------#
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
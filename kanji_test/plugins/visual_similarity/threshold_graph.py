@@ -34,6 +34,21 @@ class ThresholdLinkset(object):
 
     def get_links(self):
         return self._heap
+
+    def threshold(self):
+        """
+        Returns the weight above which new links are discarded, which is
+        infinite until the linkset is full.
+        """
+        if len(self._heap) < self._max_degree:
+            return float('inf')
+        return -self._heap[0][0]
+
+    def __getstate__(self):
+        return self._max_degree, self._heap
+
+    def __setstate__(self, state):
+        self._max_degree, self._heap = state
     
     def __iter__(self):
         for neg_weight, label in self._heap:
@@ -60,6 +75,21 @@ class ThresholdGraph(object):
         self._sum += weight
         self._sum_squared += weight * weight
 
+    def merge(self, other):
+        """
+        Adds the links from another graph built over a disjoint set of edges.
+        Each node keeps its lowest weight links whatever order they arrive
+        in, so merging partial graphs gives the same links as building the
+        whole graph at once.
+        """
+        for label, linkset in other._heaps.iteritems():
+            heap = self[label]
+            for weight, neighbour_label in linkset:
+                heap.add(neighbour_label, weight)
+        self._n_links += other._n_links
+        self._sum += other._sum
+        self._sum_squared += other._sum_squared
+
     def __getitem__(self, label):
         heap = self._heaps.get(label)
         return heap or self._heaps.setdefault(
@@ -68,4 +98,17 @@ class ThresholdGraph(object):
             )
     
     def labels(self):
-        return self.heaps.labels()
+        return self._heaps.keys()
+
+    def normalised_edges(self):
+        """
+        Iterates over (label, neighbour_label, pdf) for every link, where
+        each node's link weights are turned into similarities and normalised
+        to sum to one. Nodes come in sorted order, and each node's links in
+        order of increasing weight.
+        """
+        for label in sorted(self._heaps):
+            edges = sorted(self._heaps[label])
+            total_weight = sum(1.0 - weight for (weight, _n) in edges)
+            for weight, neighbour_label in edges:
+                yield label, neighbour_label, (1.0 - weight) / total_weight
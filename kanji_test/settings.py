@@ -32,6 +32,9 @@ DATABASE_PORT = ''             # Set to empty string for default. Not used with
 # Location of any additional resources 
 #DATA_DIR = ''
 
+# Location for compiled copies of data files, by default DATA_DIR/cache
+#CACHE_DIR = ''
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -151,14 +154,28 @@ USER_MODEL_PLUGINS = (
 # auth
 AUTH_PROFILE_MODULE = 'user_profile.userprofile'
 
+# user_model; the per-process cache of user error distributions is capped by
+# the total number of symbols held across all cached conditions
+ERROR_DIST_CACHE_SYMBOLS = 500000
+
 # drill; drill_plugins
 N_DISTRACTORS = 5
 QUESTIONS_PER_SET = 10
 QUESTIONS_PER_PAGE = 5
 
+# drill; when True, responses only queue their error model updates, which are
+# then applied by the update_error_models command. Only enable this if that
+# command is running (e.g. with --poll), or user models will stop updating.
+QUEUE_MODEL_UPDATES = False
+MODEL_UPDATE_BATCH_SIZE = 100
+
 # visual_similarity
 MIN_TOTAL_DISTRACTORS = 15
 MAX_GRAPH_DEGREE = MIN_TOTAL_DISTRACTORS
+N_GRAPH_JOBS = 1 # worker processes for building the similarity graph
+# If non-zero, the nearest neighbours of every kanji are cached on disk and
+# reused between builds; must be at least MAX_GRAPH_DEGREE to be of use
+N_CACHED_NEIGHBOURS = 0
 
 # reading_alt
 ALTERNATION_ALPHA = 0.5
@@ -171,6 +188,9 @@ UTF8_BYTES_PER_CHAR = 3 # For cjk chars
 ACCOUNT_ACTIVATION_DAYS = 15
 
 N_ROWS_PER_INSERT = 10000
+# lexicon; if more than one, rows are inserted by this many threads, each with
+# its own connection, while JMdict is parsed; needs a database server
+N_LEXICON_WRITERS = 1
 DEFAULT_LANGUAGE_CODE = 'eng'
 UPDATE_EPSILON = 0.2
 
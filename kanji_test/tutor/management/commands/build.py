@@ -35,9 +35,13 @@ class Command(NoArgsCommand):
             if hasattr(app_module, 'build'):
                 apps_with_build.append((app_path, app_module))
 
-        _log.start('Building kanji_test', nSteps=len(apps_with_build))
+        _log.start('Building kanji_test', nSteps=len(apps_with_build) + 1)
         for app_path, app_module in apps_with_build:
             app_module.build()
+
+        # Needs every syllabus to have been added first
+        from kanji_test.drill import pools
+        pools.build_all()
         _log.finish()
 
 # vim: ts=4 sw=4 sts=4 et tw=78:
@@ -20,6 +20,7 @@ from checksum.models import Checksum
 from kanji_test.lexicon import models as lexicon_models
 from kanji_test.user_model import models as usermodel_models
 from kanji_test.user_model import plugin_api
+from kanji_test import settings
 
 import bundle
 
@@ -38,7 +39,7 @@ def list_syllabi():
 
 #----------------------------------------------------------------------------#
 
-def add_all_syllabi(force=False):
+def add_all_syllabi(force=False, n_jobs=None):
     syllabi = bundle.list_names()
     _log.start('Adding all syllabi', nSteps=len(syllabi))
 
@@ -52,14 +53,17 @@ def add_all_syllabi(force=False):
         return
         
     for syllabus_name in syllabi:
-        add_syllabus(syllabus_name, force=force)
+        add_syllabus(syllabus_name, force=force, n_jobs=n_jobs)
     Checksum.store('syllabi', dependencies)
     _log.finish()
 
 #----------------------------------------------------------------------------#
 
-def add_syllabus(syllabus_name, force=False):
-    """Adds the given syllabus to the database."""
+def add_syllabus(syllabus_name, force=False, n_jobs=None):
+    """
+    Adds the given syllabus to the database, building its priors with up to
+    n_jobs worker processes (N_GRAPH_JOBS by default).
+    """
     _log.start('Adding syllabus %s' % syllabus_name)
 
     _log.log('Loading bundle')
@@ -73,7 +77,7 @@ def add_syllabus(syllabus_name, force=False):
     _store_word_surfaces(syllabus, syllabus_bundle)
 
     _log.start('Adding error models')
-    plugin_api.load_priors(syllabus, force=force)
+    plugin_api.load_priors(syllabus, force=force, n_jobs=n_jobs)
     _log.finish()
 
     _log.finish()
@@ -329,12 +333,18 @@ available, or -a to just install them all."""
     parser.add_option('-u', '--user', action='store', dest='user',
             help='Manually initialise error distributions for a user.')
 
+    parser.add_option('-j', '--jobs', action='store', type='int',
+            dest='jobs', default=settings.N_GRAPH_JOBS,
+            help='Worker processes for building priors [%default]')
+
     return parser
 
 def main(argv):
     parser = _create_option_parser()
     (options, args) = parser.parse_args(argv)
 
+    n_jobs = max(1, options.jobs)
+
     if options.list_syllabi:
         list_syllabi()
 
@@ -342,11 +352,12 @@ def main(argv):
         add_per_user_models(options.user)
 
     elif options.all:
-        add_all_syllabi(force=bool(options.force))
+        add_all_syllabi(force=bool(options.force), n_jobs=n_jobs)
 
     elif len(args) == 1:
         syllabus_name = args[0]
-        add_syllabus(syllabus_name, force=bool(options.force))
+        add_syllabus(syllabus_name, force=bool(options.force),
+                n_jobs=n_jobs)
 
     else:
         parser.print_help()
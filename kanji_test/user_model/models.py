@@ -8,16 +8,19 @@
 # 
 
 import random
+from array import array
 
-from django.db import models, connection
+from django.db import models, connection, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
 from cjktools import scripts
+from simplestats.sequences import groups_of_n_iter
 
 from kanji_test.lexicon import models as lexicon_models
 from kanji_test.util import models as util_models
 from kanji_test.util.probability import ProbDist, SeqDist
+from kanji_test.util.lru_cache import LRUCache
 from kanji_test.util import alignment
 
 class Syllabus(models.Model):
@@ -37,9 +40,11 @@ class Syllabus(models.Model):
     def get_random_item(self):
         "Returns a random item from this syllabus, either kanji or lexeme."
         if random.random() < self._get_word_proportion():
-            return self.partiallexeme_set.order_by('?')[0]
+            return self._fetch_random(self.partiallexeme_set,
+                    self.index.word_ids, 1)[0]
         else:
-            return self.partialkanji_set.order_by('?')[0]
+            return self._fetch_random(self.partialkanji_set,
+                    self.index.kanji_ids, 1)[0]
 
     def get_random_items(self, n):
         if n < 1:
@@ -55,41 +60,52 @@ class Syllabus(models.Model):
 
         items = []
         if n_words > 0:
-            items.extend(self.partiallexeme_set.order_by('?')[:n_words])
+            items.extend(self._fetch_random(self.partiallexeme_set,
+                    self.index.word_ids, n_words))
 
         if n_kanji > 0:
-            items.extend(self.partialkanji_set.order_by('?')[:n_kanji])
+            items.extend(self._fetch_random(self.partialkanji_set,
+                    self.index.kanji_ids, n_kanji))
 
         return items
 
     def sample_senses(self, n):
-        return lexicon_models.LexemeSense.objects.filter(
-                lexeme__partiallexeme__syllabus=self).order_by('?')[:n]
+        return self._fetch_random(lexicon_models.LexemeSense.objects,
+                self.index.sense_ids, n)
 
     def get_random_kanji_item(self):
         if random.random() < self._get_kanji_word_proportion():
-            return self.partiallexeme_set.filter(
-                    surface_set__has_kanji=True).order_by('?')[0]
+            return self._fetch_random(self.partiallexeme_set,
+                    self.index.kanji_word_ids, 1)[0]
         else:
-            return self.partialkanji_set.order_by('?')[0]
+            return self._fetch_random(self.partialkanji_set,
+                    self.index.kanji_ids, 1)[0]
+
+    def index(self):
+        "The cached index of this syllabus's item ids."
+        index = _syllabus_indices.get(self.id)
+        if index is None:
+            index = SyllabusIndex(self)
+            _syllabus_indices[self.id] = index
+        return index
+    index = property(index)
+
+    def _fetch_random(self, query_set, ids, n):
+        "Fetches up to n distinct random rows with ids from the given array."
+        sample_ids = SyllabusIndex.sample_ids(ids, n)
+        rows = query_set.in_bulk(sample_ids)
+        return [rows[i] for i in sample_ids if i in rows]
 
     def _get_word_proportion(self):
         "Determine the raw proportion of syllabus items which are words."
-        if not hasattr(self, '_cached_word_prop'):
-            n_words = self.partiallexeme_set.count()
-            n_kanji = self.partialkanji_set.count()
-            self._cached_word_prop = float(n_words) / (n_words + n_kanji)
-        
-        return self._cached_word_prop
+        n_words = len(self.index.word_ids)
+        n_kanji = len(self.index.kanji_ids)
+        return float(n_words) / (n_words + n_kanji)
 
     def _get_kanji_word_proportion(self):
-        if not hasattr(self, '_cached_kanji_word_prop'):
-            n_words = self.partiallexeme_set.filter(
-                    surface_set__has_kanji=True).count()
-            n_kanji = self.partialkanji_set.count()
-            self._cached_kanji_word_prop = float(n_words) / (n_words + n_kanji)
-
-        return self._cached_kanji_word_prop
+        n_words = len(self.index.kanji_word_ids)
+        n_kanji = len(self.index.kanji_ids)
+        return float(n_words) / (n_words + n_kanji)
 
     @classmethod
     def validate(cls):
@@ -104,6 +120,35 @@ class Syllabus(models.Model):
                             ).issubset(kanji_set):
                         raise Exception('invalid surface')
 
+# Item indices for each syllabus, keyed by syllabus id. Syllabi don't change
+# once built, so these live for the lifetime of the process.
+_syllabus_indices = {}
+
+class SyllabusIndex(object):
+    """
+    Compact arrays of the ids of a syllabus's items, split by kind, from
+    which random items can be picked without sorting the whole table.
+    """
+    def __init__(self, syllabus):
+        self.kanji_ids = self._id_array(syllabus.partialkanji_set.all())
+        self.word_ids = self._id_array(syllabus.partiallexeme_set.all())
+        self.kanji_word_ids = self._id_array(
+                syllabus.partiallexeme_set.filter(
+                    surface_set__has_kanji=True).distinct())
+        self.sense_ids = self._id_array(
+                lexicon_models.LexemeSense.objects.filter(
+                    lexeme__partiallexeme__syllabus=syllabus))
+
+    @staticmethod
+    def sample_ids(ids, n):
+        "Picks up to n distinct ids at random from the given array."
+        return [ids[i] for i in random.sample(xrange(len(ids)),
+                min(n, len(ids)))]
+
+    @staticmethod
+    def _id_array(query_set):
+        return array('l', query_set.values_list('id', flat=True))
+
 class Alignment(models.Model):
     """A segmentation of a lexeme reading."""
     syllabus = models.ForeignKey(Syllabus)
@@ -156,19 +201,21 @@ class PartialLexeme(models.Model):
 
     def random_surface(self):
         try:
-            return self.surface_set.all().order_by('?')[0].surface
+            return random.choice(list(self.surface_set.values_list(
+                    'surface', flat=True)))
         except IndexError:
             raise ObjectDoesNotExist
     random_surface = property(random_surface)
 
     def random_reading(self):
-        return self.reading_set.order_by('?')[0].reading
+        return random.choice(list(self.reading_set.values_list(
+                'reading', flat=True)))
     random_reading = property(random_reading)
 
     def random_kanji_surface(self):
         try:
-            return self.surface_set.filter(has_kanji=True).order_by(
-                '?')[0].surface
+            return random.choice(list(self.surface_set.filter(
+                    has_kanji=True).values_list('surface', flat=True)))
         except IndexError:
             raise ObjectDoesNotExist
     random_kanji_surface = property(random_kanji_surface)
@@ -210,6 +257,14 @@ class PartialKanji(models.Model):
 
 #----------------------------------------------------------------------------#
 
+# Decoded conditional distributions, keyed by ('error', dist id, condition)
+# for user error distributions and by ('prior', dist id, condition) for the
+# shared syllabus priors. This cache is local to each process, and is only
+# invalidated by writes made within that process; ErrorDist.prefetch_dists()
+# reloads a user's entries when their next test set is generated. Updates
+# never start from cached values, see ErrorDist.fetch_dist().
+_dist_cache = LRUCache(settings.ERROR_DIST_CACHE_SYMBOLS)
+
 class PriorDist(models.Model):
     "A syllabus-specific prior distribution."
     syllabus = models.ForeignKey(Syllabus)
@@ -224,22 +279,62 @@ class PriorDist(models.Model):
         return '%s (%d)' % (self.tag, self.syllabus_id)
 
     def from_dist(self, dist):
-        rows = []
-        for condition in dist.keys():
-            sub_dist = dist[condition]
-            cdf = 0.0
-            for symbol in sub_dist.keys():
-                pdf = sub_dist[symbol]
-                cdf += pdf
-                rows.append((self.id, condition, symbol, pdf, cdf))
+        "Stores the densities of a conditional distribution."
+        self.store_rows((condition, symbol, pdf) \
+                for condition in dist.keys() \
+                for (symbol, pdf) in dist[condition].iteritems())
+
+    def store_rows(self, rows, replace=False):
+        """
+        Stores densities from an iterator of (condition, symbol, pdf) rows,
+        whose rows for each condition must be contiguous. Cdfs are computed
+        as rows stream past, and rows are inserted in batches within a
+        single transaction. If replace is set, any existing densities are
+        deleted within the same transaction.
+        """
         cursor = connection.cursor()
-        cursor.executemany("""
-                INSERT INTO user_model_priorpdf
-                (dist, condition, symbol, pdf, cdf)
-                VALUES (%s, %s, %s, %s, %s)
-        """, rows)
-        cursor.execute('COMMIT')
-        return
+        quote_name = connection.ops.quote_name
+        insert_sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                quote_name(PriorPdf._meta.db_table),
+                ', '.join(map(quote_name, ['dist_id', 'condition', 'symbol',
+                        'pdf', 'cdf'])),
+                ', '.join(['%s'] * 5),
+            )
+        with transaction.commit_on_success():
+            if replace:
+                cursor.execute('DELETE FROM %s WHERE %s = %%s' % (
+                            quote_name(PriorPdf._meta.db_table),
+                            quote_name('dist_id'),
+                        ), [self.id])
+            for row_set in groups_of_n_iter(settings.N_ROWS_PER_INSERT,
+                    self._with_cdfs(rows)):
+                cursor.executemany(insert_sql, row_set)
+
+        _dist_cache.discard_if(lambda key: key[:2] == ('prior', self.id))
+
+    def _with_cdfs(self, rows):
+        last_condition = None
+        cdf = 0.0
+        for condition, symbol, pdf in rows:
+            if condition != last_condition:
+                last_condition = condition
+                cdf = 0.0
+            cdf += pdf
+            yield (self.id, condition, symbol, pdf, cdf)
+
+    def get_dist(self, condition):
+        """
+        Returns the distribution over symbols for the given condition. The
+        result is shared between all users of this syllabus, so copy it
+        before modifying it.
+        """
+        key = ('prior', self.id, condition)
+        dist = _dist_cache.get(key)
+        if dist is None:
+            dist = ProbDist.from_query_set(self.density.filter(
+                    condition=condition))
+            _dist_cache.put(key, dist, size=max(len(dist), 1))
+        return dist
 
 class PriorPdf(util_models.CondProb):
     "Individual densities for a prior distribution."
@@ -252,12 +347,19 @@ class PriorPdf(util_models.CondProb):
 #----------------------------------------------------------------------------#
 
 class ErrorDist(models.Model):
-    "A user-specific prior disribution."
+    """
+    A user-specific error distribution. Densities are only stored for the
+    conditions which the user's responses have changed; every other
+    condition reads through to the syllabus prior distribution.
+    """
     user = models.ForeignKey(User)
     tag = models.CharField(max_length=100)
 
     def prior_dist(self):
-        return PriorDist.objects.get(tag=self.tag)
+        if not hasattr(self, '_prior_dist'):
+            self._prior_dist = PriorDist.objects.get(tag=self.tag,
+                    syllabus__userprofile__user=self.user_id)
+        return self._prior_dist
     prior_dist = property(prior_dist)
 
     def differs_from_priors(self):
@@ -287,40 +389,195 @@ class ErrorDist(models.Model):
 
     @classmethod
     def init_from_priors(cls, user):
-        """Initialise user copies of prior dists."""
+        """
+        Initialise empty user error distributions, one per prior distribution
+        of the user's syllabus. Prior densities are never copied in bulk:
+        each condition is copied by store_dist the first time the user's
+        responses change it, so this costs the same for any syllabus size.
+        """
+        old_ids = set(user.errordist_set.values_list('id', flat=True))
+        cursor = connection.cursor()
+        cursor.execute("""
+                DELETE FROM user_model_errorpdf
+                WHERE dist_id IN (
+                    SELECT id FROM user_model_errordist WHERE user_id = %s
+                )
+            """, [user.id])
         user.errordist_set.all().delete()
+        _dist_cache.discard_if(lambda key: key[0] == 'error' and \
+                key[1] in old_ids)
         prior_dists = PriorDist.objects.filter(
                 syllabus=user.get_profile().syllabus)
         for prior_dist in prior_dists:
-            user_dist = user.errordist_set.create(tag=prior_dist.tag)
-            for prior_pdf in prior_dist.density.all():
-                user_dist.density.create(
-                        pdf=prior_pdf.pdf,
-                        cdf=prior_pdf.cdf,
-                        condition=prior_pdf.condition,
-                        symbol=prior_pdf.symbol,
-                    )
+            user.errordist_set.create(tag=prior_dist.tag)
+        transaction.commit_unless_managed()
+
+    def get_dist(self, condition):
+        """
+        Returns the distribution over symbols for the given condition, falling
+        back to the prior distribution if the user has no densities of their
+        own. The result is shared with other callers, so copy it before
+        modifying it.
+        """
+        key = ('error', self.id, condition)
+        dist = _dist_cache.get(key)
+        if dist is None:
+            dist = ProbDist.from_query_set(self.density.filter(
+                    condition=condition))
+            if not dist:
+                dist = self.prior_dist.get_dist(condition)
+            _dist_cache.put(key, dist, size=max(len(dist), 1))
+        return dist
+
+    def fetch_dist(self, condition):
+        """
+        Reads the distribution for the given condition from the database,
+        bypassing the cache, which may hold values from before another
+        process's update. The result is a fresh copy the caller may modify.
+        """
+        dist = ProbDist.from_query_set(self.density.filter(
+                condition=condition))
+        if not dist:
+            dist = ProbDist.from_query_set(self.prior_dist.density.filter(
+                    condition=condition))
+        return dist
+
+    @classmethod
+    def prefetch_dists(cls, error_dists, conditions):
+        """
+        Fetches the distribution for each condition of each error
+        distribution into the cache, using one query for the users' own
+        densities and one for any prior densities not already cached. The
+        users' own densities are always reloaded, so that updates applied by
+        other processes are picked up.
+        """
+        conditions = set(conditions)
+        error_dists = list(error_dists)
+        if not error_dists or not conditions:
+            return
+
+        user_rows = {}
+        for dist_id, condition, symbol, pdf in ErrorPdf.objects.filter(
+                    dist__in=[d.id for d in error_dists],
+                    condition__in=conditions,
+                ).values_list('dist', 'condition', 'symbol', 'pdf'):
+            user_rows.setdefault((dist_id, condition), ProbDist())[symbol] = \
+                    pdf
+
+        prior_dists = dict((d.id, d.prior_dist) for d in error_dists)
+        prior_conditions = set(c for d in prior_dists.itervalues() \
+                for c in conditions if ('prior', d.id, c) not in _dist_cache)
+        prior_rows = {}
+        if prior_conditions:
+            for dist_id, condition, symbol, pdf in PriorPdf.objects.filter(
+                        dist__in=[d.id for d in prior_dists.itervalues()],
+                        condition__in=prior_conditions,
+                    ).values_list('dist', 'condition', 'symbol', 'pdf'):
+                prior_rows.setdefault((dist_id, condition),
+                        ProbDist())[symbol] = pdf
+
+        for error_dist in error_dists:
+            prior_dist = prior_dists[error_dist.id]
+            for condition in conditions:
+                prior_key = ('prior', prior_dist.id, condition)
+                dist = _dist_cache.get(prior_key)
+                if dist is None:
+                    dist = prior_rows.get((prior_dist.id, condition),
+                            ProbDist())
+                    dist.normalise()
+                    _dist_cache.put(prior_key, dist, size=max(len(dist), 1))
+
+                user_dist = user_rows.get((error_dist.id, condition))
+                if user_dist:
+                    user_dist.normalise()
+                    dist = user_dist
+                _dist_cache.put(('error', error_dist.id, condition), dist,
+                        size=max(len(dist), 1))
+        return
+
+    def store_dist(self, condition, dist):
+        """
+        Replaces the stored distribution for the given condition. Once the
+        user has their own rows for exactly these symbols, they are
+        rewritten in place with a single CASE-based UPDATE; otherwise the
+        condition's rows are replaced in full.
+        """
+        if not dist:
+            raise ValueError('cannot store an empty distribution')
+
+        rows = []
+        cdf = 0.0
+        for symbol in sorted(dist.iterkeys()):
+            pdf = dist[symbol]
+            cdf += pdf
+            rows.append((symbol, pdf, cdf))
+        symbols = [symbol for (symbol, pdf, cdf) in rows]
+
+        cursor = connection.cursor()
+        quote_name = connection.ops.quote_name
+        table_name = quote_name(ErrorPdf._meta.db_table)
+        symbol_field = quote_name('symbol')
+        symbols_sql = ', '.join(['%s'] * len(rows))
+
+        # MySQL reports changed rather than matched rows for an UPDATE, so
+        # count the stored rows first instead of trusting its rowcount.
+        cursor.execute("""
+                SELECT COUNT(*),
+                    SUM(CASE WHEN %s IN (%s) THEN 1 ELSE 0 END)
+                FROM %s
+                WHERE %s = %%s AND %s = %%s
+            """ % (symbol_field, symbols_sql, table_name,
+                    quote_name('dist_id'), quote_name('condition')),
+                symbols + [self.id, condition])
+        n_stored, n_matched = cursor.fetchone()
+
+        if n_stored == len(rows) and int(n_matched or 0) == len(rows):
+            case_sql = 'CASE %s %s END' % (symbol_field,
+                    ' '.join(['WHEN %s THEN %s'] * len(rows)))
+            cursor.execute("""
+                    UPDATE %s
+                    SET %s = %s, %s = %s
+                    WHERE %s = %%s AND %s = %%s
+                """ % (table_name, quote_name('pdf'), case_sql,
+                        quote_name('cdf'), case_sql, quote_name('dist_id'),
+                        quote_name('condition')),
+                    [v for (symbol, pdf, cdf) in rows for v in (symbol, pdf)] +
+                    [v for (symbol, pdf, cdf) in rows for v in (symbol, cdf)] +
+                    [self.id, condition])
+        else:
+            # First write for this condition, so copy it in full.
+            if n_stored:
+                cursor.execute("""
+                        DELETE FROM %s WHERE %s = %%s AND %s = %%s
+                    """ % (table_name, quote_name('dist_id'),
+                            quote_name('condition')),
+                        [self.id, condition])
+            cursor.executemany("""
+                    INSERT INTO %s (%s, %s, %s, %s, %s)
+                    VALUES (%%s, %%s, %%s, %%s, %%s)
+                """ % (table_name, quote_name('dist_id'),
+                        quote_name('condition'), symbol_field,
+                        quote_name('pdf'), quote_name('cdf')),
+                    [(self.id, condition, symbol, pdf, cdf) \
+                        for (symbol, pdf, cdf) in rows])
+
+        transaction.commit_unless_managed()
+        _dist_cache.discard(('error', self.id, condition))
 
     def sample(self, condition):
         "Samples a single symbol using the underlying distribution."
-        target_cdf = random.random()
-        return self.density.filter(condition=condition,
-            cdf__gte=target_cdf).order_by('cdf')[0].symbol
+        return self.get_dist(condition).sample()
 
     def sample_n(self, condition, n, exclude_set=None):
         "Samples n symbols without replacement from the distribution."
-        dist = ProbDist.from_query_set(self.density.filter(
-                condition=condition))
-        return dist.sample_n(n, exclude_set=exclude_set)
+        return self.get_dist(condition).sample_n(n, exclude_set=exclude_set)
 
     def sample_seq_n(self, condition_segments, n, exclude_set=None):
         dists = []
         kanji_script = scripts.Script.Kanji
         for segment in condition_segments:
             if scripts.script_type(segment) == kanji_script:
-                seg_dist = ProbDist.from_query_set(self.density.filter(
-                    condition=segment))
-                dists.append(seg_dist)
+                dists.append(self.get_dist(segment))
             else:
                 dists.append(segment)
         
@@ -337,11 +594,9 @@ class ErrorDist(models.Model):
             result_seg_sets = []
             for segment in condition_segments:
                 if scripts.script_type(segment) == kanji_script:
-                    result_seg_sets.append(
-                            [o['symbol'] for o in self.density.filter(
-                                    condition=segment).order_by('?').values(
-                                    'symbol')[:n]]
-                        )
+                    symbols = self.get_dist(segment).keys()
+                    result_seg_sets.append(random.sample(symbols,
+                            min(n, len(symbols))))
                 else:
                     result_seg_sets.append([segment] * n)
             for result_segs in zip(*result_seg_sets):
@@ -354,30 +609,27 @@ class ErrorDist(models.Model):
 
     def sample_uniform(self, condition, exclude_set=None):
         "Samples a single symbol assuming a uniform distribution."
-        base_query = self.density.filter(condition=condition)
-        if exclude_set:
-            base_query.exclude(symbol__in=exclude_set)
-        return base_query.order_by('?')[0]
+        return self.sample_n_uniform(condition, 1, exclude_set)[0]
 
     def sample_n_uniform(self, condition, n, exclude_set=None):
         """
         Samples n symbols without replacement assuming a uniform distribution.
         """
-        return [o['symbol'] for o in self.density.filter(
-                condition=condition).exclude(
-                symbol__in=exclude_set
-            ).order_by('?').values('symbol')[:n]]
+        exclude_set = exclude_set or set()
+        symbols = [s for s in self.get_dist(condition) \
+                if s not in exclude_set]
+        return random.sample(symbols, min(n, len(symbols)))
 
     @classmethod
     def from_dist(cls):
         raise Exception('not supported')
 
+    @transaction.commit_on_success
     def update(self, condition, symbol, symbol_set):
-        query = self.density.filter(condition=condition)
-        whole_dist = ProbDist.from_query_set(query)
-
-        sub_dist = ProbDist.from_query_set(query.filter(
-                symbol__in=symbol_set))
+        whole_dist = self.fetch_dist(condition)
+        sub_dist = ProbDist((s, whole_dist[s]) for s in symbol_set \
+                if s in whole_dist)
+        sub_dist.normalise()
         assert sub_dist
         m = max(v for (s, v) in sub_dist.iteritems() if s != symbol) + \
                 settings.UPDATE_EPSILON
@@ -395,7 +647,7 @@ class ErrorDist(models.Model):
             whole_dist[s] = sub_dist[s] * sub_dist_mass
 
         assert abs(sum(whole_dist.values()) - 1.0) < 1e-6
-        whole_dist.save_to(self.density, condition=condition)
+        self.store_dist(condition, whole_dist)
         return
 
 class ErrorPdf(util_models.CondProb):
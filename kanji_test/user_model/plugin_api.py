@@ -16,7 +16,10 @@ from kanji_test import settings
 from kanji_test.user_model import models
 
 class UpdateError(Exception):
-    pass
+    "An error model update which couldn't be applied for a response."
+    def __init__(self, message, response=None):
+        Exception.__init__(self, message)
+        self.response = response
 
 class UserModelPlugin(object):
     """
@@ -24,14 +27,32 @@ class UserModelPlugin(object):
     of user error.
     """
     
-    def init_priors(self):
-        "Initialises the prior distributions that this plugin provides."
+    def init_priors(self, syllabus, force=False, n_jobs=None):
+        """
+        Initialises the prior distributions that this plugin provides, using
+        up to n_jobs worker processes where the plugin supports them.
+        """
         raise Exception('not implemented')
 
     def update(self, _response):
         "Updates this error model from a user's response."
         raise Exception('not implemented')
 
+    def update_all(self, responses):
+        """
+        Updates this error model from a sequence of responses, in order,
+        returning an UpdateError for each response which couldn't be applied.
+        Plugins which can coalesce their writes should override this.
+        """
+        errors = []
+        for response in responses:
+            try:
+                self.update(response)
+            except UpdateError, e:
+                e.response = response
+                errors.append(e)
+        return errors
+
 class SegmentedSeqPlugin(UserModelPlugin):
     """
     A plugin which uses annotated segments in its options. Requires its
@@ -44,8 +65,50 @@ class SegmentedSeqPlugin(UserModelPlugin):
     """
     def update(self, response):
         "Update our error model from a user's response."
-        error_dist = models.ErrorDist.objects.get(user=response.user,
-                tag=self.dist_name)
+        errors = self.update_all([response])
+        if errors:
+            raise errors[0]
+
+    def update_all(self, responses):
+        """
+        Update our error model from a sequence of responses, such as a whole
+        test set. Each response's boosts are applied in order to an in-memory
+        copy of the conditions it touches, read fresh from the database, and
+        each touched condition is then written back once. Responses which
+        can't be applied are skipped, and an UpdateError is returned for each.
+        """
+        error_dists = {}
+        sub_dists = {}
+        dirty_keys = set()
+        errors = []
+        for response in responses:
+            error_dist = error_dists.get(response.user_id)
+            if error_dist is None:
+                error_dist = models.ErrorDist.objects.get(
+                        user=response.user_id, tag=self.dist_name)
+                error_dists[response.user_id] = error_dist
+
+            try:
+                changed = self._boost(response, error_dist, sub_dists)
+            except UpdateError, e:
+                e.response = response
+                errors.append(e)
+                continue
+
+            sub_dists.update(changed)
+            dirty_keys.update(changed)
+
+        for key in sorted(dirty_keys):
+            user_id, base_seg = key
+            error_dists[user_id].store_dist(base_seg, sub_dists[key])
+        return errors
+
+    def _boost(self, response, error_dist, sub_dists):
+        """
+        Returns copies of the distributions changed by a single response,
+        keyed by (user id, condition), leaving sub_dists untouched unless the
+        whole response can be applied.
+        """
         question = response.question
         base_segs = question.annotation.split(u'|')
         response_segs = response.option.annotation.split(u'|')
@@ -57,32 +120,38 @@ class SegmentedSeqPlugin(UserModelPlugin):
             ))
         assert len(base_segs) == len(response_segs) == len(distractor_sets)
 
+        changed = {}
         for base_seg, response_seg, distractor_segs in \
                     izip(base_segs, response_segs, distractor_sets):
             if scripts.script_types(base_seg) != scripts.Script.Kanji:
                 continue
-            sub_dist = models.ProbDist.from_query_set(
-                    error_dist.density.filter(condition=base_seg))
+            key = (response.user_id, base_seg)
+            sub_dist = changed.get(key)
+            if sub_dist is None:
+                if key not in sub_dists:
+                    sub_dists[key] = error_dist.fetch_dist(base_seg)
+                sub_dist = sub_dists[key].copy()
             e = settings.UPDATE_EPSILON
 
             try:
                 m = max(imap(sub_dist.__getitem__, distractor_segs)) + e
                 existing_score = sub_dist[response_seg]
             except KeyError:
-                raise UpdateError(
-                    u'for user %s, dist %s, response %d: no entry for %s|%s' % (
+                raise UpdateError(u'for user %s, dist %s, response %d: '
+                        u'no entry for %s|%s' % (
                             response.user.username,
                             self.dist_name,
                             response.id,
                             response_seg,
                             base_seg,
-                    ))
+                        ))
 
             if m > existing_score:
                 sub_dist[response_seg] = m
                 sub_dist.normalise()
-                sub_dist.save_to(error_dist.density, condition=base_seg)
-        return
+                changed[key] = sub_dist
+
+        return changed
 
 _cached_plugins = None
 
@@ -108,7 +177,7 @@ def load_plugins():
     
     return _cached_plugins
 
-def load_priors(syllabus, force=False):
+def load_priors(syllabus, force=False, n_jobs=None):
     "Loads the prior distributions represented by each plugin."
     log = consoleLog.default
     log.start('Loading prior distributions', nSteps=2)
@@ -118,7 +187,7 @@ def load_priors(syllabus, force=False):
   
     log.start('Initialising prior distributions', nSteps=len(plugins))
     for plugin_obj in plugins.itervalues():
-        plugin_obj.init_priors(syllabus, force=force)
+        plugin_obj.init_priors(syllabus, force=force, n_jobs=n_jobs)
     log.finish()
 
     log.finish()
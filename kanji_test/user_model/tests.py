@@ -12,23 +12,59 @@ from django.test import TestCase
 from django.contrib.auth import models as auth_models
 
 from kanji_test.user_model import models
+from kanji_test.user_model import plugin_api
+from kanji_test.util.probability import ProbDist
 
 class RegistrationTest(TestCase):
     fixtures = ['test_register']
+    def setUp(self):
+        # Fixtures reuse ids, so drop anything cached by earlier tests.
+        models._dist_cache.clear()
+
     def test_registration(self):
         user = auth_models.User.objects.get(username="dummy")
         models.ErrorDist.init_from_priors(user)
         prior_dist = models.PriorDist.objects.get(tag="dummy")
         error_dist = models.ErrorDist.objects.get(user=user, tag="dummy")
 
+        # Nothing is copied until the user's responses change a condition.
+        self.assertEqual(error_dist.density.count(), 0)
         for prior_row in prior_dist.density.all():
-            error_row = error_dist.density.get(condition=prior_row.condition,
-                    symbol=prior_row.symbol)
-            self.assertEqual(prior_row.cdf, error_row.cdf)
-            self.assertEqual(prior_row.pdf, error_row.pdf)
+            error_sub_dist = error_dist.get_dist(prior_row.condition)
+            self.assertAlmostEqual(prior_row.pdf,
+                    error_sub_dist[prior_row.symbol])
+
+    def test_copy_on_write(self):
+        user = auth_models.User.objects.get(username="dummy")
+        models.ErrorDist.init_from_priors(user)
+        error_dist = models.ErrorDist.objects.get(user=user, tag="dummy")
+        error_dist.update("land", "kangaroo", ["cat", "kangaroo", "koala"])
+        self.assertEqual(set(o['condition'] for o in
+                error_dist.density.values('condition')), set(["land"]))
+        self.assertAlmostEqual(error_dist.density.get(condition="land",
+                symbol="kangaroo").pdf, 0.36666667)
+        self.assertAlmostEqual(error_dist.get_dist("sea")["fish"], 1.0)
+        prior_dist = models.PriorDist.objects.get(tag="dummy")
+        self.assertAlmostEqual(prior_dist.density.get(condition="land",
+                symbol="kangaroo").pdf, 0.3)
+
+    def test_store_rows(self):
+        prior_dist = models.PriorDist.objects.get(tag="dummy")
+        prior_dist.density.all().delete()
+        prior_dist.store_rows(iter([("sky", "bird", 0.75),
+                ("sky", "bat", 0.25), ("sea", "fish", 1.0)]))
+        self.assertAlmostEqual(prior_dist.get_dist("sky")["bird"], 0.75)
+        self.assertAlmostEqual(prior_dist.density.get(condition="sky",
+                symbol="bat").cdf, 1.0)
+        self.assertAlmostEqual(prior_dist.density.get(condition="sea",
+                symbol="fish").cdf, 1.0)
 
 class UpdateTest(TestCase):
     fixtures = ['test_update']
+    def setUp(self):
+        # Fixtures reuse ids, so drop anything cached by earlier tests.
+        models._dist_cache.clear()
+
     def test_update(self):
         user = auth_models.User.objects.get(username="dummy")
         error_dist = models.ErrorDist.objects.get(user=user, tag="dummy")
@@ -42,7 +78,143 @@ class UpdateTest(TestCase):
         self.assertAlmostEqual(error_dist.density.get(condition="land",
                 symbol="dog").pdf, 0.3) 
         self.assertAlmostEqual(error_dist.density.get(condition="sea",
-                symbol="fish").pdf, 1.0) 
+                symbol="fish").pdf, 1.0)
+
+    def test_repeated_update(self):
+        user = auth_models.User.objects.get(username="dummy")
+        error_dist = models.ErrorDist.objects.get(user=user, tag="dummy")
+        n_rows = error_dist.density.filter(condition="land").count()
+        for i in xrange(3):
+            error_dist.update("land", "kangaroo", ["cat", "kangaroo",
+                    "koala"])
+        self.assertEqual(error_dist.density.filter(condition="land").count(),
+                n_rows)
+        self.assertAlmostEqual(error_dist.density.filter(condition="land"
+                ).order_by('-cdf')[0].cdf, 1.0)
+        self.assertAlmostEqual(sum(o.pdf for o in
+                error_dist.density.filter(condition="land")), 1.0)
+
+    def test_update_invalidates_cache(self):
+        user = auth_models.User.objects.get(username="dummy")
+        error_dist = models.ErrorDist.objects.get(user=user, tag="dummy")
+        self.assertAlmostEqual(error_dist.get_dist("land")["kangaroo"], 0.3)
+        error_dist.update("land", "kangaroo", ["cat", "kangaroo", "koala"])
+        self.assertAlmostEqual(error_dist.get_dist("land")["kangaroo"],
+                0.36666667)
+
+    def test_store_in_place(self):
+        "Rows for the same symbols are rewritten with a single UPDATE."
+        user = auth_models.User.objects.get(username="dummy")
+        error_dist = models.ErrorDist.objects.get(user=user, tag="dummy")
+        row_ids = set(error_dist.density.filter(condition="land"
+                ).values_list('id', flat=True))
+        dist = ProbDist(dog=0.1, cat=0.2, kangaroo=0.3, koala=0.4)
+        self.assertNumQueries(2, error_dist.store_dist, "land", dist)
+        self.assertEqual(set(error_dist.density.filter(condition="land"
+                ).values_list('id', flat=True)), row_ids)
+        self.assertAlmostEqual(error_dist.density.get(condition="land",
+                symbol="koala").cdf, 1.0)
+
+        # A different set of symbols replaces the rows in full.
+        dist = ProbDist(dog=0.5, wombat=0.5)
+        self.assertNumQueries(3, error_dist.store_dist, "land", dist)
+        self.assertEqual(sorted(error_dist.density.filter(condition="land"
+                ).values_list('symbol', flat=True)), ["dog", "wombat"])
+
+    def test_stale_cache(self):
+        "Updates from two processes both survive."
+        user = auth_models.User.objects.get(username="dummy")
+        error_dist = models.ErrorDist.objects.get(user=user, tag="dummy")
+        expected = self._apply_both(error_dist, stale=False)
+        error_dist.density.all().delete()
+        error_dist.store_dist("land", ProbDist(dog=0.3, cat=0.3,
+                kangaroo=0.3, koala=0.1))
+        actual = self._apply_both(error_dist, stale=True)
+        for symbol, pdf in expected.iteritems():
+            self.assertAlmostEqual(actual[symbol], pdf)
+
+    def _apply_both(self, error_dist, stale):
+        models._dist_cache.clear()
+        stale_dist = error_dist.get_dist("land")
+        error_dist.update("land", "kangaroo", ["cat", "kangaroo", "koala"])
+        if stale:
+            # The first process's cache never saw the second's update.
+            models._dist_cache.put(('error', error_dist.id, "land"),
+                    stale_dist, size=len(stale_dist))
+        else:
+            models._dist_cache.clear()
+        error_dist.update("land", "koala", ["dog", "koala"])
+        models._dist_cache.clear()
+        return error_dist.get_dist("land")
+
+class _Stub(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class _Options(object):
+    def __init__(self, annotations):
+        self.annotations = annotations
+
+    def values(self, *fields):
+        return [{'annotation': a} for a in self.annotations]
+
+class SegmentedSeqTest(TestCase):
+    fixtures = ['test_update']
+    def setUp(self):
+        models._dist_cache.clear()
+        self.user = auth_models.User.objects.get(username="dummy")
+        self.error_dist = models.ErrorDist.objects.get(user=self.user,
+                tag="dummy")
+        self.prior = ProbDist({u'ひ': 0.4, u'に': 0.3, u'じつ': 0.2,
+                u'にち': 0.1})
+        self.error_dist.store_dist(u'日', self.prior)
+        self.plugin = plugin_api.SegmentedSeqPlugin()
+        self.plugin.dist_name = "dummy"
+        self.responses = [
+                self._response(1, u'に'),
+                self._response(2, u'じつ'),
+                self._response(3, u'に'),
+            ]
+
+    def test_coalesced(self):
+        "Coalesced updates match applying each response in turn."
+        self.plugin.update_all(self.responses)
+        coalesced = self._get_dist()
+
+        self.error_dist.store_dist(u'日', self.prior)
+        for response in self.responses:
+            self.plugin.update(response)
+        sequential = self._get_dist()
+
+        self.assertNotEqual(coalesced, self.prior)
+        for symbol, pdf in sequential.iteritems():
+            self.assertAlmostEqual(coalesced[symbol], pdf)
+
+    def test_bad_response(self):
+        "A response which can't be applied doesn't stop the others."
+        bad_response = self._response(4, u'ぬ')
+        errors = self.plugin.update_all(self.responses[:2] + [bad_response] +
+                self.responses[2:])
+        self.assertEqual([e.response for e in errors], [bad_response])
+        self.assertRaises(plugin_api.UpdateError, self.plugin.update,
+                bad_response)
+        coalesced = self._get_dist()
+
+        self.error_dist.store_dist(u'日', self.prior)
+        self.plugin.update_all(self.responses)
+        expected = self._get_dist()
+        for symbol, pdf in expected.iteritems():
+            self.assertAlmostEqual(coalesced[symbol], pdf)
+
+    def _get_dist(self):
+        return self.error_dist.fetch_dist(u'日')
+
+    def _response(self, response_id, chosen):
+        annotations = [u'ひ', u'に', u'じつ', chosen]
+        question = _Stub(annotation=u'日',
+                multiplechoicequestion=_Stub(options=_Options(annotations)))
+        return _Stub(id=response_id, user_id=self.user.id, user=self.user,
+                question=question, option=_Stub(annotation=chosen))
 
 class AddSyllabusTest(TestCase):
     def test_add(self):
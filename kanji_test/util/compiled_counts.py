@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+#  compiled_counts.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-16.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+"""
+Corpus frequency counts compiled into a compact binary form. Each counts
+file is parsed once, and its compiled copy is memory-mapped on later loads,
+so processes share its pages. Distributions are filled from the mapped
+arrays in bulk, though each process still holds its own copy of them.
+"""
+
+import struct
+
+import numpy
+
+from kanji_test.util import data_cache
+from kanji_test.util import probability
+
+def load_freq_dist(filename, format='freq'):
+    """
+    Loads a FreqDist from a counts file, via its compiled copy. Counts from
+    a conditional file are summed over their conditions.
+    """
+    return CompiledCounts.get(filename, format).to_freq_dist()
+
+def load_cond_freq_dist(filename, format='row'):
+    "Loads a ConditionalFreqDist from a counts file, via its compiled copy."
+    return CompiledCounts.get(filename, format).to_cond_freq_dist()
+
+#----------------------------------------------------------------------------#
+
+class CompiledCounts(object):
+    """
+    The counts from a single corpus file. Symbols and conditions are
+    interned into one table, and the counts are kept in flat arrays, those
+    for each condition lying between consecutive offsets.
+
+    The compiled file holds a header, the symbol table, then the counts,
+    symbol ids, condition ids and condition offsets. It is keyed by the
+    checksum of the file it was compiled from and its format, which is one
+    of 'freq', 'row' or 'packed'.
+    """
+    magic = 0x53544e43 # 'CNTS'
+    header_format = '5i'
+
+    def __init__(self, symbols, counts, symbol_ids, conditions, offsets):
+        self.symbols = symbols
+        self.counts = counts
+        self.symbol_ids = symbol_ids
+        self.conditions = conditions
+        self.offsets = offsets
+
+    @classmethod
+    def get(cls, filename, format='freq'):
+        "Loads the compiled counts for a file, compiling it if necessary."
+        cache_file = data_cache.cache_path(filename, '.counts', format)
+        compiled = cls.load(cache_file)
+        if compiled is None:
+            compiled = cls.compile(filename, format)
+            data_cache.store(cache_file, compiled.to_string())
+        return compiled
+
+    @classmethod
+    def load(cls, filename):
+        "Memory-maps stored counts, or returns None if there aren't any."
+        header_size = struct.calcsize(cls.header_format)
+        try:
+            i_stream = open(filename, 'rb')
+            try:
+                header = i_stream.read(header_size)
+            finally:
+                i_stream.close()
+        except IOError:
+            return None
+
+        if len(header) < header_size:
+            return None
+        magic, n_symbols, table_size, n_conditions, n_entries = \
+                struct.unpack(cls.header_format, header)
+        if magic != cls.magic:
+            return None
+
+        offset = header_size
+        table = _map(filename, numpy.uint8, offset, table_size)
+        symbols = []
+        if n_symbols:
+            symbols = table.tostring().decode('utf8').split(u'\0')
+        offset = _align(offset + table_size)
+
+        counts = _map(filename, numpy.int64, offset, n_entries)
+        offset += counts.nbytes
+        symbol_ids = _map(filename, numpy.int32, offset, n_entries)
+        offset += symbol_ids.nbytes
+        conditions = _map(filename, numpy.int32, offset, n_conditions)
+        offset += conditions.nbytes
+        offsets = _map(filename, numpy.int32, offset, n_conditions + 1)
+        return cls(symbols, counts, symbol_ids, conditions, offsets)
+
+    @classmethod
+    def compile(cls, filename, format='freq'):
+        "Parses a counts file in the given format."
+        if format == 'freq':
+            dist = probability.FreqDist.from_file(filename)
+            cond_dists = [(None, dist)]
+        else:
+            cond_dist = probability.ConditionalFreqDist.from_file(filename,
+                    format=format)
+            cond_dists = [(c, cond_dist[c]) for c in cond_dist.conditions()]
+
+        symbols = []
+        symbol_index = {}
+        def intern(symbol):
+            symbol_id = symbol_index.get(symbol)
+            if symbol_id is None:
+                symbol_id = symbol_index[symbol] = len(symbols)
+                symbols.append(symbol)
+            return symbol_id
+
+        counts = []
+        symbol_ids = []
+        conditions = []
+        offsets = [0]
+        for condition, dist in cond_dists:
+            for symbol in dist.samples():
+                symbol_ids.append(intern(symbol))
+                counts.append(dist[symbol])
+            if condition is not None:
+                conditions.append(intern(condition))
+                offsets.append(len(counts))
+
+        return cls(symbols,
+                numpy.array(counts, dtype=numpy.int64),
+                numpy.array(symbol_ids, dtype=numpy.int32),
+                numpy.array(conditions, dtype=numpy.int32),
+                numpy.array(offsets, dtype=numpy.int32))
+
+    def to_string(self):
+        "Returns the counts in their stored form."
+        table = u'\0'.join(self.symbols).encode('utf8')
+        header = struct.pack(self.header_format, self.magic,
+                len(self.symbols), len(table), len(self.conditions),
+                len(self.counts))
+        padding = '\0' * (_align(len(header) + len(table)) - len(header) -
+                len(table))
+        return ''.join([header, table, padding, self.counts.tostring(),
+                self.symbol_ids.tostring(), self.conditions.tostring(),
+                self.offsets.tostring()])
+
+    def to_freq_dist(self):
+        "Returns the counts as a FreqDist, summed over any conditions."
+        symbol_ids = self.symbol_ids
+        counts = self.counts
+        if len(self.conditions):
+            totals = numpy.bincount(symbol_ids, weights=counts)
+            is_present = numpy.zeros(len(totals), dtype=bool)
+            is_present[symbol_ids] = True
+            symbol_ids = numpy.flatnonzero(is_present)
+            counts = totals[symbol_ids].round().astype(numpy.int64)
+        return probability.FreqDist.from_counts(
+                self._get_symbols(symbol_ids), counts.tolist())
+
+    def to_cond_freq_dist(self):
+        "Returns the counts as a ConditionalFreqDist."
+        dist = probability.ConditionalFreqDist()
+        offsets = self.offsets.tolist()
+        for i, condition_id in enumerate(self.conditions.tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            dist.fill_condition(self.symbols[condition_id],
+                    self._get_symbols(self.symbol_ids[start:end]),
+                    self.counts[start:end].tolist())
+        return dist
+
+    def _get_symbols(self, symbol_ids):
+        symbols = self.symbols
+        return [symbols[i] for i in symbol_ids.tolist()]
+
+#----------------------------------------------------------------------------#
+
+def _align(offset, n_bytes=8):
+    "Rounds an offset up to the next multiple of n_bytes."
+    return (offset + n_bytes - 1) // n_bytes * n_bytes
+
+def _map(filename, dtype, offset, length):
+    # Empty arrays can't be mapped.
+    if not length:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(filename, dtype=dtype, mode='r', offset=offset,
+            shape=(length,))
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+#  data_cache.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-13.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+"""
+Compiled copies of data files, cached on disk. Each copy is named by a
+checksum of the file it was compiled from, so a changed source file is
+never matched with a stale copy. Checksums are remembered in the cache
+along with the size and modification time of their file, and are only
+recomputed once either changes.
+"""
+
+import os
+import hashlib
+import tempfile
+
+from kanji_test import settings
+
+# The process's file creation mask, which can only be read by setting it.
+_umask = os.umask(0)
+os.umask(_umask)
+
+def get_cache_dir():
+    "Returns the directory cached files are kept in."
+    return getattr(settings, 'CACHE_DIR', None) or \
+            os.path.join(settings.DATA_DIR, 'cache')
+
+def file_checksum(filename):
+    "Returns the md5 hex digest of a file's contents."
+    digest = hashlib.md5()
+    i_stream = open(filename, 'rb')
+    try:
+        for chunk in iter(lambda: i_stream.read(1 << 16), ''):
+            digest.update(chunk)
+    finally:
+        i_stream.close()
+    return digest.hexdigest()
+
+def source_checksum(filename):
+    """
+    Returns the md5 hex digest of a source file's contents, reusing the
+    digest stored for it if the file's size and modification time haven't
+    changed since.
+    """
+    stat = os.stat(filename)
+    file_stamp = '%d %r' % (stat.st_size, stat.st_mtime)
+    stamp_file = os.path.join(get_cache_dir(), '%s.%s.stamp' % (
+            os.path.basename(filename),
+            hashlib.md5(os.path.abspath(filename)).hexdigest()))
+    try:
+        i_stream = open(stamp_file, 'rb')
+        try:
+            stored_stamp, checksum = i_stream.read().rsplit(' ', 1)
+        finally:
+            i_stream.close()
+        if stored_stamp == file_stamp:
+            return checksum
+    except (IOError, ValueError):
+        pass
+
+    checksum = file_checksum(filename)
+    store(stamp_file, '%s %s' % (file_stamp, checksum))
+    return checksum
+
+def cache_path(source_file, suffix, *keys):
+    """
+    Returns the path for a cached compilation of the source file, keyed by
+    the source file's checksum and any further keys given.
+    """
+    name = '.'.join([os.path.basename(source_file), source_checksum(
+            source_file)] + map(str, keys)) + suffix
+    return os.path.join(get_cache_dir(), name)
+
+def store(filename, data):
+    """
+    Atomically writes data to a cache file, so that readers never see a
+    partial file. Returns False if the cache couldn't be written.
+    """
+    try:
+        cache_dir = os.path.dirname(filename)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmp_filename = tempfile.mkstemp(dir=cache_dir)
+        o_stream = os.fdopen(fd, 'wb')
+        try:
+            o_stream.write(data)
+        finally:
+            o_stream.close()
+        # mkstemp() makes the file private to us, but other users, such as
+        # the web server, need to read the cache too.
+        os.chmod(tmp_filename, 0666 & ~_umask)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError):
+        return False
+    return True
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+#  lru_cache.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-02.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+"""
+A size-bounded, least-recently-used cache.
+"""
+
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    A process-local cache which evicts its least recently used entries once
+    the total size of its values exceeds a fixed capacity. Each value is
+    stored along with its size, so that capacity can be measured in whatever
+    unit best approximates the memory used by the cached values.
+
+    >>> cache = LRUCache(3)
+    >>> cache.put('a', 1, size=2)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    >>> cache.size
+    3
+    """
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError(capacity)
+        self.capacity = capacity
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        "Fetches the value for key, marking it as recently used."
+        self._lock.acquire()
+        try:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = (value, size)
+            return value
+        finally:
+            self._lock.release()
+
+    def put(self, key, value, size=1):
+        """
+        Stores a value, evicting the least recently used entries until the
+        cache is back within capacity. Values larger than the whole cache are
+        not stored.
+        """
+        self._lock.acquire()
+        try:
+            self._discard(key)
+            if size > self.capacity:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.capacity:
+                _key, (_value, old_size) = self._entries.popitem(last=False)
+                self.size -= old_size
+        finally:
+            self._lock.release()
+
+    def discard(self, key):
+        "Removes the entry for key, if there is one."
+        self._lock.acquire()
+        try:
+            self._discard(key)
+        finally:
+            self._lock.release()
+
+    def discard_if(self, predicate):
+        "Removes every entry whose key matches the given predicate."
+        self._lock.acquire()
+        try:
+            for key in filter(predicate, self._entries.keys()):
+                self._discard(key)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
+
+    def keys(self):
+        return self._entries.keys()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -11,13 +11,102 @@
 Abstract models for probability distributions.
 """
 
+import math
+import heapq
 import random
+from itertools import izip
 
+import numpy
 from django.db import models, connection
 from simplestats.sequences import groups_of_n
 
 from kanji_test.settings import N_ROWS_PER_INSERT
 
+# Sampling indices for probability tables, loaded once per process and keyed
+# by model. from_dist() discards the index for its table, and sample_n()
+# reloads an index whose rows have been rebuilt by another process.
+_cdf_indices = {}
+
+# Rounds of rejection sampling before sample_ids() falls back to an exact
+# method, for skewed distributions where rejection rarely finds a new row.
+_max_rejection_rounds = 8
+
+# Attempts sample_n() makes before giving up on a table which keeps being
+# rebuilt underneath it.
+_max_sample_attempts = 3
+
+class CdfIndex(object):
+    """
+    The sorted cdf column of a probability table along with its row ids,
+    so that rows can be sampled without a query per draw.
+    """
+    def __init__(self, rows):
+        "Builds the index from (cdf, id) pairs sorted by cdf."
+        if not rows:
+            raise ValueError('no rows to sample from')
+        self.cdfs = numpy.array([cdf for (cdf, row_id) in rows], dtype=float)
+        self.ids = numpy.array([row_id for (cdf, row_id) in rows])
+
+        # Rows with zero probability share an earlier row's cdf, so can
+        # never be drawn.
+        self.n_nonzero = int((numpy.diff(self.cdfs) > 0).sum()) + \
+                int(self.cdfs[0] > 0)
+
+    @classmethod
+    def get(cls, model):
+        "Returns the index for this model, loading it on first use."
+        index = _cdf_indices.get(model)
+        if index is None:
+            rows = list(model.objects.order_by('cdf').values_list('cdf',
+                    'id'))
+            index = _cdf_indices[model] = cls(rows)
+        return index
+
+    def sample_ids(self, n, replace=False):
+        "Samples the ids of n rows, with or without replacement."
+        if replace:
+            return self._draw(n)
+
+        if n > self.n_nonzero:
+            raise ValueError("don't have %d unique values" % n)
+
+        result = []
+        seen = set()
+        for i in xrange(_max_rejection_rounds):
+            for row_id in self._draw(2 * (n - len(result))):
+                if row_id not in seen:
+                    seen.add(row_id)
+                    result.append(row_id)
+                    if len(result) == n:
+                        return result
+
+        # Rejection has stalled, so draw the remainder exactly.
+        result.extend(self._draw_exact(n - len(result), seen))
+        return result
+
+    def _draw(self, n):
+        # Each draw picks the first row whose cdf reaches the target. Targets
+        # come from the random module, so that seeding it fixes the draws.
+        targets = numpy.array([random.random() for i in xrange(n)]) * \
+                self.cdfs[-1]
+        positions = numpy.minimum(numpy.searchsorted(self.cdfs, targets),
+                len(self.cdfs) - 1)
+        return self.ids[positions].tolist()
+
+    def _draw_exact(self, n, exclude_set):
+        """
+        Draws n rows without replacement from those not excluded, using the
+        keys of Efraimidis and Spirakis: each row gets the key log(u) / pdf
+        for a uniform u, and the rows with the n largest keys are a weighted
+        sample, in the order drawn.
+        """
+        pdfs = numpy.diff(numpy.concatenate(([0.0], self.cdfs)))
+        keys = []
+        for row_id, pdf in izip(self.ids.tolist(), pdfs.tolist()):
+            if pdf > 0 and row_id not in exclude_set:
+                keys.append((math.log(1.0 - random.random()) / pdf, row_id))
+        return [row_id for (key, row_id) in heapq.nlargest(n, keys)]
+
 class ProbI(models.Model):
     """A probabilty distribution."""
     pdf = models.FloatField()
@@ -34,22 +123,25 @@ class ProbI(models.Model):
         return result
 
     @classmethod
-    def sample_n(cls, n):
+    def sample_n(cls, n, replace=False):
+        """
+        Samples n rows from this distribution, with or without replacement,
+        and returns them in the order drawn.
+        """
         if n < 1:
             raise ValueError(n)
 
-        target_cdfs = [random.random() for i in xrange(n)]
-        quote_name = connection.ops.quote_name
-        table_name = quote_name(cls._meta.db_table)
-        id_field = '%s.%s' % (table_name, quote_name('id'))
-        cdf_field = '%s.%s' % (table_name, quote_name('cdf'))
+        for i in xrange(_max_sample_attempts):
+            ids = CdfIndex.get(cls).sample_ids(n, replace=replace)
+            rows = cls.objects.in_bulk(list(set(ids)))
+            if len(rows) == len(set(ids)):
+                return [rows[row_id] for row_id in ids]
+
+            # The table was rebuilt after its index was loaded, so sample
+            # again from a fresh index.
+            _cdf_indices.pop(cls, None)
 
-        sql = ' OR '.join(
-                ['%s = (select %s from %s where %s >= %f limit 1)' % (
-                        id_field, id_field, table_name, cdf_field, cdf
-                    ) for cdf in target_cdfs]
-            )
-        return cls.objects.extra(where=[sql])
+        raise ValueError('%s changed while being sampled' % cls.__name__)
 
 class Prob(ProbI):
     """A basic probability distribution."""
@@ -67,6 +159,7 @@ class Prob(ProbI):
         table_name = cls._meta.db_table
         cursor = connection.cursor()
         cursor.execute('DELETE FROM %s' % table_name)
+        _cdf_indices.pop(cls, None)
 
         rows = []
         cdf = 0.0
@@ -114,6 +207,7 @@ class CondProb(ProbI):
         table_name = cls._meta.db_table
         cursor = connection.cursor()
         cursor.execute('DELETE FROM %s' % table_name)
+        _cdf_indices.pop(cls, None)
 
         rows = []
         for condition in cond_prob_dist.conditions():
@@ -7,7 +7,11 @@
 #  Copyright 2008 Lars Yencken. All rights reserved.
 # 
 
+import math
+import heapq
+import bisect
 import random
+from itertools import izip
 
 from nltk import probability as nltk_prob
 from cjktools.common import sopen
@@ -31,6 +35,16 @@ class FreqDist(nltk_prob.FreqDist):
         self[key] -= n
         self._N -= n
 
+    @classmethod
+    def from_counts(cls, samples, counts):
+        """
+        Builds a distribution from parallel sequences of distinct samples and
+        their counts, in bulk rather than with an inc() per sample.
+        """
+        dist = cls()
+        _fill(dist, samples, counts)
+        return dist
+
     def remove(self, key):
         self.dec(key, self[key])
         del self[key]
@@ -146,6 +160,23 @@ class ConditionalFreqDist(nltk_prob.ConditionalFreqDist):
         for condition, symbol, count in other_dist.itercounts():
             self[condition].inc(symbol, count)
 
+    def fill_condition(self, condition, samples, counts):
+        """
+        Sets the counts for a new condition from parallel sequences of
+        distinct samples and their counts, in bulk rather than with an inc()
+        per sample. The condition must not have any counts yet.
+        """
+        _fill(self[condition], samples, counts)
+
+def _fill(dist, samples, counts):
+    # Setting the dict entries and total directly skips inc()'s per-sample
+    # bookkeeping; dist must start empty.
+    counts = list(counts)
+    dict.update(dist, izip(samples, counts))
+    dist._N += sum(counts)
+
+_neg_infinity = float('-inf')
+
 class UnsupportedMethodError(Exception):
     pass
 
@@ -185,9 +216,7 @@ class ProbDist(dict):
         return dist
 
     def copy(self):
-        new_dist = ProbDist(self)
-        new_dist._cdf = self._cdf[:]
-        return new_dist
+        return ProbDist(self)
 
     def __eq__(self, rhs):
         return set(self.items()) == set(rhs.items())
@@ -213,49 +242,99 @@ class ProbDist(dict):
         return
 
     def sample(self):
-        target_cdf = random.random()
-        for cdf, symbol in self._cdf:
-            if cdf >= target_cdf:
-                return symbol
-        raise RuntimeError("couldn't sample successfully")
+        "Samples a single symbol by bisecting the precomputed cdf."
+        if not self._cdf or self._cdf[-1] <= 0:
+            raise RuntimeError("couldn't sample successfully")
+        target_cdf = random.random() * self._cdf[-1]
+        i = bisect.bisect_right(self._cdf, target_cdf)
+        return self._cdf_symbols[min(i, len(self._cdf_symbols) - 1)]
 
     def sample_n(self, n, exclude_set=None):
+        """
+        Samples n symbols without replacement. Rather than renormalising
+        after every draw, each symbol is given the random key u ** (1 / pdf)
+        and the n largest keys are kept, which is equivalent to drawing
+        symbols one at a time from the remaining mass (Efraimidis and
+        Spirakis, 2006).
+        """
         exclude_set = exclude_set or set()
 
-        include_set = set(self.keys()).difference(exclude_set)
-        if n > len(include_set):
+        include_list = [(symbol, pdf) for (symbol, pdf) in self.iteritems()
+                if symbol not in exclude_set]
+        if n > len(include_list):
             raise ValueError("don't have %d unique values" % n)
 
-        elif n == len(include_set):
-            result = list(include_set)
+        elif n == len(include_list):
+            result = [symbol for (symbol, pdf) in include_list]
             random.shuffle(result)
             return result
 
-        tmp_dist = self.copy()
-        for symbol in tmp_dist.keys():
-            if symbol not in include_set:
-                del tmp_dist[symbol]
-        tmp_dist.normalise()
-
-        result = set()
-        while len(result) < n:
-            symbol = tmp_dist.sample()
-            result.add(symbol)
-            del tmp_dist[symbol]
-            tmp_dist.normalise()
+        keyed_list = []
+        for symbol, pdf in include_list:
+            if pdf > 0:
+                # Compare log keys, which avoids underflow for small pdfs.
+                key = math.log(1.0 - random.random()) / pdf
+            else:
+                key = _neg_infinity
+            keyed_list.append((key, symbol))
 
-        result = list(result)
+        result = [symbol for (key, symbol) in heapq.nlargest(n, keyed_list)]
         random.shuffle(result)
         return result
 
     def _refresh_cdf(self):
         cdf_seq = []
+        symbol_seq = []
         cdf = 0.0
         for symbol, pdf in self.iteritems():
             cdf += pdf
-            cdf_seq.append((cdf, symbol))
+            cdf_seq.append(cdf)
+            symbol_seq.append(symbol)
 
         self._cdf = cdf_seq
+        self._cdf_symbols = symbol_seq
+
+class AliasTable(object):
+    """
+    Walker's alias method for drawing symbols from a fixed distribution in
+    constant time per draw, after linear time setup (Vose, 1991).
+
+    >>> table = AliasTable({'a': 0.5, 'b': 0.5, 'c': 0.0})
+    >>> table.sample() in ('a', 'b')
+    True
+    """
+    def __init__(self, dist):
+        self.symbols = list(dist.iterkeys())
+        n = len(self.symbols)
+        total = float(sum(dist.itervalues()))
+        if n == 0 or total <= 0:
+            raise ValueError('need a non-empty distribution')
+
+        scaled = [dist[symbol] * n / total for symbol in self.symbols]
+        self._probs = [1.0] * n
+        self._aliases = range(n)
+        small = [i for i in xrange(n) if scaled[i] < 1.0]
+        large = [i for i in xrange(n) if scaled[i] >= 1.0]
+        while small and large:
+            i_small = small.pop()
+            i_large = large.pop()
+            self._probs[i_small] = scaled[i_small]
+            self._aliases[i_small] = i_large
+            scaled[i_large] += scaled[i_small] - 1.0
+            if scaled[i_large] < 1.0:
+                small.append(i_large)
+            else:
+                large.append(i_large)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def sample(self):
+        "Samples a single symbol."
+        i = random.randrange(len(self.symbols))
+        if random.random() < self._probs[i]:
+            return self.symbols[i]
+        return self.symbols[self._aliases[i]]
 
 # XXX Doesn't match NLTK interface.
 class CondProbDist(dict):
@@ -286,44 +365,98 @@ class CondProbDist(dict):
             sub_dist_kwargs['condition'] = condition
             sub_dist.save_to(manager, **sub_dist_kwargs)
 
-class SeqDist(ProbDist):
+class SeqDist(ProbDistI):
     """
-    A distribution constructed as a sequence of smaller distributions.
+    A distribution over segmented sequences, constructed as a sequence of
+    independent smaller distributions. Any segment which isn't a ProbDist is
+    treated as fixed.
+
+    The full product of the segment distributions is never built. Sequences
+    are sampled one segment at a time, and if rejection sampling stalls
+    (because most of the mass is excluded or already drawn), we fall back to
+    enumerating sequences in decreasing order of probability.
     """
+    # The number of rejection samples to try per requested sequence.
+    rejection_factor = 10
+
     def __init__(self, *dists):
-        dict.__init__(self)
-        old_dist = {(): 1.0}
         if not dists:
             raise ValueError("cannot be constructed empty")
-
-        for new_dist in dists:
-            if isinstance(new_dist, ProbDist):
-                current = {} 
-                for old_seq, old_pdf in old_dist.iteritems():
-                    for new_symbol, new_pdf in new_dist.iteritems():
-                        current[old_seq + (new_symbol,)] = old_pdf * new_pdf
-                old_dist = current
-            else:
-                fixed_char = new_dist
-                old_dist = dict((k + (fixed_char,), v) for (k,v) in \
-                        old_dist.iteritems())
-
-        self._segments = {}
-        for segments, pdf in old_dist.iteritems():
-            flat = u''.join(segments)
-            # Overwrite alternative segmentations (simplification)
-            self._segments[flat] = segments
-            self[flat] = self.get(flat, 0.0) + pdf
-        self.normalise()
+        self._dists = dists
 
     def sample(self):
         "Samples a segmented sequence from this distribution."
-        return self._segments[ProbDist.sample(self)]
+        segments = []
+        for dist in self._dists:
+            if isinstance(dist, ProbDist):
+                segments.append(dist.sample())
+            else:
+                segments.append(dist)
+        return tuple(segments)
 
     def sample_n(self, n, exclude_set=None):
-        "Samples n segmented sequences from this distribution."
-        return map(
-                self._segments.__getitem__,
-                ProbDist.sample_n(self, n, exclude_set),
-            )
+        """
+        Samples n segmented sequences without replacement, such that none of
+        their flattened forms are in the exclude_set.
+        """
+        used_set = set(exclude_set or [])
+        result = []
+        self._add_unique(result, n, used_set, (self.sample() for i in \
+                xrange(self.rejection_factor * n)))
+        if len(result) < n:
+            self._add_unique(result, n, used_set, self._iter_most_probable())
+            if len(result) < n:
+                raise ValueError("don't have %d unique values" % n)
+
+        random.shuffle(result)
+        return result
+
+    def _add_unique(self, result, n, used_set, segments_seq):
+        "Adds unused sequences to the result until it has n of them."
+        for segments in segments_seq:
+            if len(result) >= n:
+                break
+            flat = u''.join(segments)
+            if flat not in used_set:
+                used_set.add(flat)
+                result.append(segments)
+
+    def _iter_most_probable(self):
+        """
+        Yields segmented sequences in decreasing order of probability, using
+        a heap over positions in each segment's ranked symbol list.
+        """
+        ranked_lists = []
+        for dist in self._dists:
+            if isinstance(dist, ProbDist):
+                ranked_lists.append(sorted(
+                        [(pdf, symbol) for (symbol, pdf) in dist.iteritems()],
+                        reverse=True,
+                    ))
+            else:
+                ranked_lists.append([(1.0, dist)])
+            if not ranked_lists[-1]:
+                return
+
+        def neg_prob(position):
+            pdf = 1.0
+            for ranked_list, i in izip(ranked_lists, position):
+                pdf *= ranked_list[i][0]
+            return -pdf
+
+        start = (0,) * len(ranked_lists)
+        heap = [(neg_prob(start), start)]
+        seen = set([start])
+        while heap:
+            _neg_pdf, position = heapq.heappop(heap)
+            yield tuple([ranked_list[i][1] for (ranked_list, i) in
+                    izip(ranked_lists, position)])
+            for j in xrange(len(position)):
+                if position[j] + 1 < len(ranked_lists[j]):
+                    next_position = position[:j] + (position[j] + 1,) + \
+                            position[j + 1:]
+                    if next_position not in seen:
+                        seen.add(next_position)
+                        heapq.heappush(heap, (neg_prob(next_position),
+                                next_position))
 
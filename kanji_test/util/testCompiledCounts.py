@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  testCompiledCounts.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-16.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+import os
+import shutil
+import unittest
+import tempfile
+
+from cjktools.common import sopen
+
+from kanji_test import settings
+from kanji_test.util import compiled_counts
+
+def suite():
+    testSuite = unittest.TestSuite((
+            unittest.makeSuite(CompiledCountsTest),
+        ))
+    return testSuite
+
+class CompiledCountsTest(unittest.TestCase):
+    def setUp(self):
+        self.old_cache_dir = getattr(settings, 'CACHE_DIR', None)
+        self.temp_dir = tempfile.mkdtemp()
+        settings.CACHE_DIR = os.path.join(self.temp_dir, 'cache')
+
+    def test_freq_format(self):
+        filename = self._write_file(u'日 5\n本 3\n日 2\n')
+        for i in xrange(2):
+            dist = compiled_counts.load_freq_dist(filename)
+            self.assertEqual(dict(dist), {u'日': 7, u'本': 3})
+            self.assertEqual(dist.N(), 10)
+
+    def test_packed_format(self):
+        filename = self._write_file(u'日 に:9,ひ:1\n本 ほん:10,ひ:2\n')
+        for i in xrange(2):
+            cond_dist = compiled_counts.load_cond_freq_dist(filename,
+                    format='packed')
+            self.assertEqual(set(cond_dist.conditions()),
+                    set([u'日', u'本']))
+            self.assertEqual(dict(cond_dist[u'本']), {u'ほん': 10, u'ひ': 2})
+            self.assertEqual(cond_dist[u'日'].N(), 10)
+
+            dist = compiled_counts.load_freq_dist(filename, format='packed')
+            self.assertEqual(dict(dist), {u'に': 9, u'ひ': 3, u'ほん': 10})
+            self.assertEqual(dist.N(), 22)
+
+        # The second load came from the compiled copy.
+        self.assertEqual(len([f for f in os.listdir(settings.CACHE_DIR) \
+                if f.endswith('.counts')]), 1)
+
+    def test_row_format(self):
+        filename = self._write_file(u'日 に 9\n日 ひ 1\n本 ほん 10\n')
+        for i in xrange(2):
+            cond_dist = compiled_counts.load_cond_freq_dist(filename)
+            self.assertEqual(set(cond_dist.conditions()),
+                    set([u'日', u'本']))
+            self.assertEqual(dict(cond_dist[u'日']), {u'に': 9, u'ひ': 1})
+            self.assertEqual(cond_dist[u'日'].N(), 10)
+            self.assertEqual(dict(cond_dist[u'本']), {u'ほん': 10})
+
+    def test_changed_source(self):
+        "A changed source file is compiled again."
+        filename = self._write_file(u'日 5\n')
+        self.assertEqual(dict(compiled_counts.load_freq_dist(filename)),
+                {u'日': 5})
+        filename = self._write_file(u'本 30\n')
+        os.utime(filename, (0, 0))
+        self.assertEqual(dict(compiled_counts.load_freq_dist(filename)),
+                {u'本': 30})
+
+    def _write_file(self, data):
+        filename = os.path.join(self.temp_dir, 'counts')
+        o_stream = sopen(filename, 'w')
+        o_stream.write(data)
+        o_stream.close()
+        return filename
+
+    def tearDown(self):
+        settings.CACHE_DIR = self.old_cache_dir
+        shutil.rmtree(self.temp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  testLruCache.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-02.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+import unittest
+
+from kanji_test.util.lru_cache import LRUCache
+
+def suite():
+    testSuite = unittest.TestSuite((
+            unittest.makeSuite(LRUCacheTest),
+        ))
+    return testSuite
+
+class LRUCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = LRUCache(10)
+
+    def test_evicts_least_recently_used(self):
+        for key in 'abcde':
+            self.cache.put(key, key.upper(), size=2)
+        self.assertEqual(self.cache.size, 10)
+        self.assertEqual(self.cache.get('a'), 'A')
+
+        self.cache.put('f', 'F', size=3)
+        self.assertEqual(set(self.cache.keys()), set('adef'))
+        self.assertEqual(self.cache.size, 9)
+
+    def test_oversized_values_are_not_stored(self):
+        self.cache.put('a', 'A')
+        self.cache.put('b', 'B', size=11)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertEqual(self.cache.get('a'), 'A')
+
+    def test_replace_and_discard(self):
+        self.cache.put('a', 'A', size=4)
+        self.cache.put('a', 'AA', size=6)
+        self.assertEqual(self.cache.size, 6)
+        self.assertEqual(self.cache.get('a'), 'AA')
+
+        self.cache.put(('dog', 1), 'bark')
+        self.cache.put(('cat', 1), 'meow')
+        self.cache.discard_if(lambda key: key[0] == 'dog')
+        self.cache.discard('a')
+        self.assertEqual(self.cache.keys(), [('cat', 1)])
+        self.assertEqual(self.cache.size, 1)
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  testModels.py
+#  kanji_test
+#
+#  Created by Lars Yencken on 2012-03-17.
+#  Copyright 2012 Lars Yencken. All rights reserved.
+#
+
+import random
+import unittest
+
+from django.test import TestCase
+
+from kanji_test.util import models
+from kanji_test.lexicon.models import KanjiProb
+
+def suite():
+    testSuite = unittest.TestSuite((
+            unittest.makeSuite(CdfIndexTest),
+            unittest.makeSuite(ProbSampleTest),
+        ))
+    return testSuite
+
+class CdfIndexTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+        # Row 4 has zero probability.
+        self.index = models.CdfIndex([(0.5, 1), (0.8, 2), (0.95, 3),
+                (0.95, 4), (1.0, 5)])
+
+    def test_seeded(self):
+        "Seeding the random module fixes the draws."
+        random.seed(42)
+        first = self.index.sample_ids(20, replace=True)
+        random.seed(42)
+        self.assertEqual(self.index.sample_ids(20, replace=True), first)
+
+    def test_sample_ids(self):
+        counts = dict.fromkeys(xrange(1, 6), 0)
+        n_samples = 10000
+        for row_id in self.index.sample_ids(n_samples, replace=True):
+            counts[row_id] += 1
+        self.assertEqual(counts[4], 0)
+        for row_id, pdf in [(1, 0.5), (2, 0.3), (3, 0.15), (5, 0.05)]:
+            self.assertAlmostEqual(float(counts[row_id]) / n_samples, pdf,
+                    places=1)
+
+    def test_without_replacement(self):
+        for i in xrange(50):
+            result = self.index.sample_ids(4)
+            self.assertEqual(sorted(result), [1, 2, 3, 5])
+        self.assertRaises(ValueError, self.index.sample_ids, 5)
+
+    def test_empty(self):
+        self.assertRaises(ValueError, models.CdfIndex, [])
+
+    def test_skewed(self):
+        "Rows with tiny probability are still found without replacement."
+        index = models.CdfIndex([(1.0 - 2e-12, 1), (1.0 - 1e-12, 2),
+                (1.0, 3)])
+        for i in xrange(10):
+            result = index.sample_ids(3)
+            self.assertEqual(sorted(result), [1, 2, 3])
+            self.assertEqual(result[0], 1)
+
+class ProbSampleTest(TestCase):
+    def setUp(self):
+        random.seed(1234)
+        models._cdf_indices.clear()
+        KanjiProb.objects.all().delete()
+        self._store([(u'日', 0.5, 0.5), (u'本', 0.3, 0.8),
+                (u'人', 0.2, 1.0)])
+
+    def test_sample_n(self):
+        for i in xrange(20):
+            result = KanjiProb.sample_n(3, replace=False)
+            self.assertEqual(sorted(o.symbol for o in result),
+                    sorted([u'日', u'本', u'人']))
+        self.assertRaises(ValueError, KanjiProb.sample_n, 4)
+
+    def test_seeded(self):
+        random.seed(42)
+        first = [o.symbol for o in KanjiProb.sample_n(2)]
+        random.seed(42)
+        self.assertEqual([o.symbol for o in KanjiProb.sample_n(2)], first)
+
+    def test_rebuilt(self):
+        "Tables rebuilt behind the index's back are reloaded."
+        KanjiProb.sample_n(1)
+        KanjiProb.objects.all().delete()
+        self._store([(u'月', 0.6, 0.6), (u'山', 0.4, 1.0)])
+        result = KanjiProb.sample_n(2, replace=False)
+        self.assertEqual(sorted(o.symbol for o in result),
+                sorted([u'月', u'山']))
+
+    def _store(self, rows):
+        for symbol, pdf, cdf in rows:
+            KanjiProb.objects.create(symbol=symbol, pdf=pdf, cdf=cdf)
+
+    def tearDown(self):
+        models._cdf_indices.clear()
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim: ts=4 sw=4 sts=4 et tw=78:
@@ -9,6 +9,7 @@
 # 
 
 import os
+import random
 import unittest
 import tempfile
 
@@ -19,6 +20,9 @@ from kanji_test.util import probability
 def suite():
     testSuite = unittest.TestSuite((
             unittest.makeSuite(CondFreqDistTest),
+            unittest.makeSuite(ProbDistTest),
+            unittest.makeSuite(SeqDistTest),
+            unittest.makeSuite(AliasTableTest),
         ))
     return testSuite
 
@@ -58,5 +62,91 @@ class CondFreqDistTest(unittest.TestCase):
                 os.remove(filename)
             raise        
 
+class ProbDistTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+        self.dist = probability.ProbDist(dog=0.5, cat=0.3, fish=0.15,
+                kangaroo=0.05)
+
+    def test_sample(self):
+        counts = dict.fromkeys(self.dist, 0)
+        n_samples = 10000
+        for i in xrange(n_samples):
+            counts[self.dist.sample()] += 1
+        for symbol, pdf in self.dist.iteritems():
+            self.assertAlmostEqual(float(counts[symbol]) / n_samples, pdf,
+                    places=1)
+
+    def test_sample_n(self):
+        for i in xrange(100):
+            result = self.dist.sample_n(2, exclude_set=set(['cat']))
+            self.assertEqual(len(result), 2)
+            self.assertEqual(len(set(result)), 2)
+            assert 'cat' not in result
+
+        self.assertEqual(set(self.dist.sample_n(3, set(['dog']))),
+                set(['cat', 'fish', 'kangaroo']))
+        self.assertRaises(ValueError, self.dist.sample_n, 4, set(['dog']))
+
+    def test_sample_n_without_replacement(self):
+        "The first draw should follow the distribution itself."
+        counts = dict.fromkeys(self.dist, 0)
+        n_samples = 10000
+        for i in xrange(n_samples):
+            for symbol in self.dist.sample_n(1):
+                counts[symbol] += 1
+        for symbol, pdf in self.dist.iteritems():
+            self.assertAlmostEqual(float(counts[symbol]) / n_samples, pdf,
+                    places=1)
+
+class AliasTableTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+        self.dist = dict(dog=5, cat=3, fish=1.5, kangaroo=0.5, emu=0)
+        self.table = probability.AliasTable(self.dist)
+
+    def test_sample(self):
+        counts = dict.fromkeys(self.dist, 0)
+        n_samples = 10000
+        for i in xrange(n_samples):
+            counts[self.table.sample()] += 1
+        self.assertEqual(counts['emu'], 0)
+        for symbol, count in self.dist.iteritems():
+            self.assertAlmostEqual(float(counts[symbol]) / n_samples,
+                    count / 10.0, places=1)
+
+    def test_empty(self):
+        self.assertRaises(ValueError, probability.AliasTable, {})
+
+class SeqDistTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+
+    def test_sample_n(self):
+        dist = probability.SeqDist(
+                probability.ProbDist(a=0.5, b=0.3, c=0.2),
+                u'-',
+                probability.ProbDist(x=0.9, y=0.1),
+            )
+        for i in xrange(50):
+            result = dist.sample_n(4, exclude_set=set([u'a-x']))
+            flat_results = set(u''.join(segments) for segments in result)
+            self.assertEqual(len(flat_results), 4)
+            assert u'a-x' not in flat_results
+            for segments in result:
+                self.assertEqual(len(segments), 3)
+                self.assertEqual(segments[1], u'-')
+
+    def test_sample_n_exhausted(self):
+        "Sequences with tiny probability are still found when needed."
+        dist = probability.SeqDist(
+                probability.ProbDist(a=1.0 - 1e-9, b=1e-9),
+                probability.ProbDist(x=1.0 - 1e-9, y=1e-9),
+            )
+        result = dist.sample_n(3, exclude_set=set([u'by']))
+        self.assertEqual(set(u''.join(s) for s in result),
+                set([u'ax', u'ay', u'bx']))
+        self.assertRaises(ValueError, dist.sample_n, 4, set([u'by']))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file